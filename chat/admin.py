@@ -4,6 +4,7 @@ from django.urls import reverse
 from django.utils import timezone
 from django.db.models import Count, Q
 from .models import *
+from .snapshots import invalidate_room_snapshot
 
 class IsOnlineFilter(admin.SimpleListFilter):
     title = 'online status'
@@ -461,7 +462,10 @@ class MessageAdmin(admin.ModelAdmin):
     soft_delete_messages.short_description = "Soft delete selected messages"
 
     def restore_messages(self, request, queryset):
+        room_ids = set(queryset.values_list('room_id', flat=True))
         updated = queryset.update(is_deleted=False, deleted_at=None, deleted_by=None)
+        for room_id in room_ids:
+            invalidate_room_snapshot(room_id)
         self.message_user(request, f'{updated} messages restored')
     restore_messages.short_description = "Restore selected messages"
 
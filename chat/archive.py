@@ -0,0 +1,134 @@
+# chat/archive.py
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Cold storage for old messages. chat_message only keeps the last
+# CHAT_ARCHIVE_AFTER_DAYS of history; `manage.py chat_archive_messages`
+# moves anything older, with its read receipts, reactions and edit history,
+# into ArchivedMessage/ArchivedReadReceipt/ArchivedReaction, one batch per
+# transaction. Archived messages keep their ids, and room history pages that
+# reach past the window read through to the archive (keyset_page).
+#
+# A message stays hot while deleting it would cascade into or null out rows
+# that are still hot: thread roots with messages in chat_message, reply
+# targets, and workflow chat messages. They move once those are gone.
+#
+# Unread counts only look at chat_message, so messages left unread for
+# longer than the window stop counting once archived.
+
+ARCHIVED_FIELDS = [
+    'id', 'room_id', 'user_id', 'content', 'message_type', 'file_url',
+    'file_name', 'file_size', 'file_type', 'file_blob_id', 'image_width',
+    'image_height', 'reply_to_id', 'thread_id', 'is_edited', 'edited_at',
+    'is_deleted', 'deleted_at', 'deleted_by_id', 'timestamp', 'ip_address',
+    'created_at', 'updated_at',
+]
+
+
+def archive_after_days():
+    return getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 90)
+
+
+def archive_batch_size():
+    return getattr(settings, 'CHAT_ARCHIVE_BATCH_SIZE', 1000)
+
+
+def archive_cutoff():
+    """Messages before this are archived; history reaching past it reads the archive too"""
+    return timezone.now() - timedelta(days=archive_after_days())
+
+
+def archivable_messages(cutoff):
+    """Messages older than `cutoff` that can leave chat_message without touching hot rows"""
+    from .models import Message
+
+    remaining = Message.objects.exclude(pk=OuterRef('pk'))
+    return Message.objects.filter(timestamp__lt=cutoff).exclude(
+        Exists(remaining.filter(thread=OuterRef('pk')))
+    ).exclude(
+        Exists(remaining.filter(reply_to=OuterRef('pk')))
+    ).filter(workflowmessagecontext__isnull=True)
+
+
+@transaction.atomic
+def archive_batch(cutoff, batch_size, purge_deleted=False):
+    """
+    Move up to `batch_size` archivable messages (oldest ids first) to the
+    archive tables. With `purge_deleted`, soft-deleted messages are dropped
+    instead of archived. Returns (archived, purged).
+    """
+    from .models import (
+        ArchivedMessage, ArchivedReaction, ArchivedReadReceipt, FileBlob,
+        Message, MessageEditHistory, MessageReadReceipt, Reaction,
+    )
+    from .snapshots import invalidate_room_snapshot
+
+    messages = list(
+        archivable_messages(cutoff).only(*ARCHIVED_FIELDS).order_by('id')
+        .select_for_update(of=('self',), skip_locked=True)[:batch_size]
+    )
+    if not messages:
+        return 0, 0
+
+    archived = [m for m in messages if not (purge_deleted and m.is_deleted)]
+    archived_ids = [m.id for m in archived]
+
+    edit_history = defaultdict(list)
+    for entry in MessageEditHistory.objects.filter(message_id__in=archived_ids).order_by('edited_at').values(
+        'message_id', 'old_content', 'new_content', 'edited_at'
+    ):
+        edit_history[entry['message_id']].append({
+            'old_content': entry['old_content'],
+            'new_content': entry['new_content'],
+            'edited_at': entry['edited_at'].isoformat(),
+        })
+
+    ArchivedMessage.objects.bulk_create([
+        ArchivedMessage(
+            edit_history=edit_history.get(m.id, []),
+            **{field: getattr(m, field) for field in ARCHIVED_FIELDS},
+        )
+        for m in archived
+    ])
+    ArchivedReadReceipt.objects.bulk_create(
+        [
+            ArchivedReadReceipt(**receipt)
+            for receipt in MessageReadReceipt.objects.filter(message_id__in=archived_ids).values(
+                'message_id', 'user_id', 'read_at'
+            ).iterator()
+        ],
+        batch_size=batch_size,
+    )
+    ArchivedReaction.objects.bulk_create(
+        [
+            ArchivedReaction(**reaction)
+            for reaction in Reaction.objects.filter(message_id__in=archived_ids).values(
+                'message_id', 'user_id', 'reaction_type'
+            ).iterator()
+        ],
+        batch_size=batch_size,
+    )
+
+    # Cascades to the hot receipts, reactions and edit history
+    Message.objects.filter(id__in=[m.id for m in messages]).delete()
+
+    # The delete released each message's blob reference; archived rows keep theirs
+    blobs_by_refs = defaultdict(list)
+    for blob_id, refs in Counter(m.file_blob_id for m in archived if m.file_blob_id).items():
+        blobs_by_refs[refs].append(blob_id)
+    for refs, blob_ids in blobs_by_refs.items():
+        FileBlob.objects.filter(pk__in=blob_ids).update(ref_count=F('ref_count') + refs, updated_at=timezone.now())
+
+    # Quiet rooms may still have these in their connect snapshot
+    for room_id in {m.room_id for m in messages}:
+        invalidate_room_snapshot(room_id)
+
+    return len(archived), len(messages) - len(archived)
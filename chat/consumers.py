@@ -4,37 +4,49 @@ from datetime import datetime
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.utils import timezone
 from django.core.cache import cache
-import redis
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from urllib.parse import parse_qs
 import logging
 
+from . import presence, rate_limit, thumbnails, typing_indicators, uploads
+from .events import room_group_name, user_group_name
+from .snapshots import build_room_snapshot, latest_message_id, snapshot_cache_key, snapshot_generation
+from .pagination import InvalidCursor, keyset_page
+from .redis_client import get_redis, RedisError
+from .write_buffer import get_write_buffer
+
 logger = logging.getLogger('websockets')
 
 User = get_user_model()
 
+# In-flight connect snapshot builds in this worker, keyed by (room_id, version, generation)
+_snapshot_builds = {}
+
 class RobustChatConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        try:
-            self.redis_client = redis.Redis(
-                host='localhost', 
-                port=6379, 
-                db=0, 
-                decode_responses=True,
-                socket_connect_timeout=5,
-                retry_on_timeout=True
-            )
-            self.redis_client.ping()  # Test connection
-        except redis.ConnectionError:
-            logger.warning("Redis connection failed, using in-memory storage")
-            self.redis_client = None
-        
-        self.typing_tasks = {}
+        self.heartbeat_task = None
         self.room_name = None
         self.room_group_name = None
         self.user = None
 
+        # Resolved once in validate_room_access and kept fresh through
+        # membership_changed events, so steady-state messaging needs no
+        # permission queries
+        self.room_id = None
+        self.membership_role = None
+        self.is_banned = False
+        self.slow_mode = 0
+
+    @property
+    def redis_client(self):
+        """Shared async redis client (one pool per worker process)"""
+        return get_redis()
+
     async def connect(self):
         try:
             self.user = self.scope["user"]
@@ -46,7 +58,7 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
                 return
 
             self.room_name = self.scope['url_route']['kwargs']['room_name']
-            self.room_group_name = f'chat_{self.room_name}'
+            self.room_group_name = room_group_name(self.room_name)
 
             # Validate room access
             if not await self.validate_room_access():
@@ -68,13 +80,14 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
             await self.accept()
 
             # Update user presence
-            await self.set_user_presence(True)
+            joined_room = await self.set_user_presence(True)
             
             # Send initial data
             await self.send_initial_data()
 
-            # Notify room about user join
-            await self.broadcast_user_presence('joined')
+            # Notify room about user join (not for a second tab)
+            if joined_room:
+                await self.broadcast_user_presence('joined')
 
             logger.info(f"User {self.user.username} connected to {self.room_group_name}")
 
@@ -85,16 +98,15 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         try:
             if hasattr(self, 'room_group_name') and self.room_group_name:
-                # Clean up typing tasks
-                if self.user.id in self.typing_tasks:
-                    self.typing_tasks[self.user.id].cancel()
-                    del self.typing_tasks[self.user.id]
+                # Clear this user's typing indicator
+                await self.set_typing(False)
 
                 # Update user presence
-                await self.set_user_presence(False)
+                left_room = await self.set_user_presence(False)
 
-                # Notify room about user leave
-                await self.broadcast_user_presence('left')
+                # Notify room about user leave (once the last tab closes)
+                if left_room:
+                    await self.broadcast_user_presence('left')
 
                 # Leave room group
                 await self.channel_layer.group_discard(
@@ -114,13 +126,15 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
 
             # Validate message type
             if message_type not in ['message', 'typing_start', 'typing_stop', 'message_read', 
-                                  'edit_message', 'delete_message', 'react_message']:
+                                  'edit_message', 'delete_message', 'react_message',
+                                  'load_history']:
                 await self.send_error('Invalid message type')
                 return
 
-            # Rate limiting
-            if not await self.check_message_rate_limit():
-                await self.send_error('Rate limit exceeded. Please wait a moment.')
+            # Rate limiting (every frame; messages also pay the send limits)
+            decision = await rate_limit.take(rate_limit.socket_event_buckets(self.user.id))
+            if not decision.allowed:
+                await self.send_error(rate_limit.retry_message(decision), retry_after=round(decision.retry_after, 1))
                 return
 
             # Route to appropriate handler
@@ -132,6 +146,7 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
                 'edit_message': self.handle_edit_message,
                 'delete_message': self.handle_delete_message,
                 'react_message': self.handle_message_reaction,
+                'load_history': self.handle_load_history,
             }
 
             if message_type in handler_map:
@@ -163,6 +178,9 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
             await self.send_error('You do not have permission to send messages in this room')
             return
 
+        if not await self.check_message_rate_limit():
+            return
+
         # Save to database
         try:
             message_obj = await self.save_message(
@@ -181,20 +199,11 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
 
     async def handle_typing_start(self, data):
         """Handle typing indicator start"""
-        await self.broadcast_typing_indicator(True)
-
-        # Cancel existing typing task
-        if self.user.id in self.typing_tasks:
-            self.typing_tasks[self.user.id].cancel()
-        
-        # Schedule auto stop
-        self.typing_tasks[self.user.id] = asyncio.create_task(
-            self.auto_stop_typing()
-        )
+        await self.set_typing(True)
 
     async def handle_typing_stop(self, data):
         """Handle typing indicator stop"""
-        await self.broadcast_typing_indicator(False)
+        await self.set_typing(False)
 
     async def handle_message_read(self, data):
         """Handle message read receipt"""
@@ -272,215 +281,246 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error adding reaction: {e}")
             await self.send_error('Failed to add reaction')
 
+    async def handle_load_history(self, data):
+        """Send one keyset page of older (or, with a newer cursor, later) messages"""
+        try:
+            limit = max(1, min(int(data.get('limit', 50)), 100))
+        except (TypeError, ValueError):
+            await self.send_error('Invalid limit')
+            return
+
+        try:
+            history = await self.get_message_history(data.get('cursor'), limit)
+        except InvalidCursor:
+            await self.send_error('Invalid cursor')
+            return
+
+        await self.send(text_data=json.dumps({
+            'type': 'history',
+            'request_id': data.get('request_id'),
+            **history,
+        }))
+
     # Broadcast Methods
-    async def broadcast_message(self, message_obj):
-        """Broadcast new message to room"""
+    #
+    # Each broadcast encodes the client-facing JSON frame exactly once here;
+    # the group's consumers only forward the pre-encoded text (see
+    # forward_frame), so a 1,000-member room costs one json.dumps, not 1,000.
+    async def group_send_frame(self, handler, frame):
+        """Encode a client frame once and fan it out to the room group"""
         await self.channel_layer.group_send(
             self.room_group_name,
             {
-                'type': 'chat_message',
-                'message_id': str(message_obj.id),
-                'content': message_obj.content,
-                'message_type': message_obj.message_type,
-                'user_id': str(self.user.id),
-                'username': self.user.username,
-                'display_name': self.user.get_full_name(),
-                'timestamp': message_obj.timestamp.isoformat(),
-                'reply_to': await self.get_reply_data(message_obj.reply_to_id),
-                'file_data': await self.get_file_data(message_obj),
+                'type': handler,
+                'room': self.room_name,
+                'frame': json.dumps(frame),
             }
         )
 
-    async def broadcast_typing_indicator(self, is_typing):
-        """Broadcast typing indicator"""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user_id': str(self.user.id),
-                'username': self.user.username,
-                'display_name': self.user.get_full_name(),
-                'is_typing': is_typing,
-                'timestamp': datetime.now().isoformat(),
-            }
-        )
+    async def broadcast_message(self, message_obj):
+        """Broadcast new message to room"""
+        await self.group_send_frame('chat_message', {
+            'type': 'message',
+            'message_id': str(message_obj.id),
+            'content': message_obj.content,
+            'message_type': message_obj.message_type,
+            'user_id': str(self.user.id),
+            'username': self.user.username,
+            'display_name': self.user.get_full_name(),
+            'timestamp': message_obj.timestamp.isoformat(),
+            'reply_to': self.get_reply_data(message_obj),
+            'file_data': self.get_file_data(message_obj),
+        })
+
+    async def set_typing(self, is_typing):
+        """Update typing state; room snapshots are coalesced in typing_indicators"""
+        try:
+            if is_typing:
+                await typing_indicators.start(self.redis_client, self.channel_layer, self.room_name, self.user)
+            else:
+                await typing_indicators.stop(self.redis_client, self.channel_layer, self.room_name, self.user)
+        except RedisError as e:
+            logger.warning(f"Typing indicator update failed for user {self.user.id}: {e}")
 
     async def broadcast_user_presence(self, action):
         """Broadcast user presence change"""
         online_count = await self.get_online_count()
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_presence',
-                'user_id': str(self.user.id),
-                'username': self.user.username,
-                'display_name': self.user.get_full_name(),
-                'action': action,
-                'timestamp': datetime.now().isoformat(),
-                'online_count': online_count,
-            }
-        )
+
+        await self.group_send_frame('user_presence', {
+            'type': 'user_presence',
+            'user_id': str(self.user.id),
+            'username': self.user.username,
+            'display_name': self.user.get_full_name(),
+            'action': action,
+            'timestamp': datetime.now().isoformat(),
+            'online_count': online_count,
+        })
 
     async def broadcast_read_receipt(self, message_id):
         """Broadcast read receipt"""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'message_read',
-                'message_id': message_id,
-                'user_id': str(self.user.id),
-                'username': self.user.username,
-                'display_name': self.user.get_full_name(),
-                'timestamp': datetime.now().isoformat(),
-            }
-        )
+        await self.group_send_frame('message_read', {
+            'type': 'message_read',
+            'message_id': message_id,
+            'user_id': str(self.user.id),
+            'username': self.user.username,
+            'display_name': self.user.get_full_name(),
+            'timestamp': datetime.now().isoformat(),
+        })
 
     async def broadcast_message_edit(self, message_obj):
         """Broadcast message edit"""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'message_edited',
-                'message_id': str(message_obj.id),
-                'content': message_obj.content,
-                'edited_at': message_obj.edited_at.isoformat(),
-                'user_id': str(self.user.id),
-            }
-        )
+        await self.group_send_frame('message_edited', {
+            'type': 'message_edited',
+            'message_id': str(message_obj.id),
+            'content': message_obj.content,
+            'edited_at': message_obj.edited_at.isoformat(),
+            'user_id': str(self.user.id),
+        })
 
     async def broadcast_message_deletion(self, message_id):
         """Broadcast message deletion"""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'message_deleted',
-                'message_id': message_id,
-                'user_id': str(self.user.id),
-                'username': self.user.username,
-                'timestamp': datetime.now().isoformat(),
-            }
-        )
+        await self.group_send_frame('message_deleted', {
+            'type': 'message_deleted',
+            'message_id': message_id,
+            'user_id': str(self.user.id),
+            'username': self.user.username,
+            'timestamp': datetime.now().isoformat(),
+        })
 
     async def broadcast_reaction(self, message_id, reaction):
         """Broadcast message reaction"""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'message_reacted',
-                'message_id': message_id,
-                'user_id': str(self.user.id),
-                'username': self.user.username,
-                'display_name': self.user.get_full_name(),
-                'reaction': reaction,
-                'timestamp': datetime.now().isoformat(),
-            }
-        )
+        await self.group_send_frame('message_reacted', {
+            'type': 'message_reacted',
+            'message_id': message_id,
+            'user_id': str(self.user.id),
+            'username': self.user.username,
+            'display_name': self.user.get_full_name(),
+            'reaction': reaction,
+            'timestamp': datetime.now().isoformat(),
+        })
 
     # Event Handlers (send to individual clients)
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message',
-            'message_id': event['message_id'],
-            'content': event['content'],
-            'message_type': event['message_type'],
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'display_name': event['display_name'],
-            'timestamp': event['timestamp'],
-            'reply_to': event.get('reply_to'),
-            'file_data': event.get('file_data'),
-        }))
-
-    async def user_presence(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_presence',
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'display_name': event['display_name'],
-            'action': event['action'],
-            'timestamp': event['timestamp'],
-            'online_count': event['online_count'],
-        }))
-
-    async def typing_indicator(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'typing_indicator',
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'display_name': event['display_name'],
-            'is_typing': event['is_typing'],
-            'timestamp': event['timestamp'],
-        }))
-
-    async def message_read(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_read',
-            'message_id': event['message_id'],
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'display_name': event['display_name'],
-            'timestamp': event['timestamp'],
-        }))
+    async def forward_frame(self, event):
+        """Forward a frame that was already encoded by the broadcaster"""
+        await self.send(text_data=event['frame'])
+
+    chat_message = forward_frame
+    user_presence = forward_frame
+    typing_indicator = forward_frame
+    message_read = forward_frame
+    message_edited = forward_frame
+    message_deleted = forward_frame
+    message_reacted = forward_frame
+
+    # Control Events (not forwarded to clients)
+    async def membership_changed(self, event):
+        """Refresh the cached membership after a ban/unban/promote/demote"""
+        if event['user_id'] != str(self.user.id):
+            return
 
-    async def message_edited(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_edited',
-            'message_id': event['message_id'],
-            'content': event['content'],
-            'edited_at': event['edited_at'],
-            'user_id': event['user_id'],
-        }))
+        self.membership_role = event.get('role')
+        self.is_banned = event.get('is_banned', False)
 
-    async def message_deleted(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_deleted',
-            'message_id': event['message_id'],
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'timestamp': event['timestamp'],
-        }))
+        if self.is_banned or event.get('removed'):
+            logger.info(f"Closing socket for user {self.user.id} in {self.room_group_name}: membership revoked")
+            await self.close(code=4003)
 
-    async def message_reacted(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_reacted',
-            'message_id': event['message_id'],
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'display_name': event['display_name'],
-            'reaction': event['reaction'],
-            'timestamp': event['timestamp'],
-        }))
+    async def room_settings_changed(self, event):
+        """Pick up a new slow_mode without reconnecting"""
+        self.slow_mode = event.get('slow_mode', 0)
 
     # Utility Methods
-    async def auto_stop_typing(self):
-        """Automatically stop typing after 3 seconds"""
-        await asyncio.sleep(3)
-        await self.broadcast_typing_indicator(False)
-
     async def send_initial_data(self):
-        """Send initial room data to client"""
+        """
+        Send the connect snapshot: the room's shared snapshot (cached, see
+        chat.snapshots) plus this user's membership state and who is online.
+        A reconnecting client can pass ?since_message_id=<id> to receive only
+        newer messages; `has_gap` means more arrived than the snapshot holds
+        and the client should fetch the rest with load_history.
+        """
         try:
-            room_info = await self.get_room_info()
-            recent_messages = await self.get_recent_messages()
-            online_users = await self.get_online_users()
+            since_message_id = self.get_since_message_id()
+            snapshot, unread_count, online_users = await asyncio.gather(
+                self.get_room_snapshot(),
+                database_sync_to_async(self.get_unread_count, thread_sensitive=False)(),
+                self.get_online_users(),
+            )
 
-            await self.send(text_data=json.dumps({
+            messages = snapshot['messages']
+            has_gap = False
+            if since_message_id is not None:
+                # Ids are global, so only a since_message_id inside the
+                # snapshot window proves nothing newer was left out
+                has_gap = bool(messages) and not snapshot['complete'] and since_message_id < messages[0][0]
+                messages = [m for m in messages if m[0] > since_message_id]
+
+            room = dict(snapshot['room'], online_count=len(online_users))
+            frame = json.dumps({
                 'type': 'initial_data',
-                'room': room_info,
-                'messages': recent_messages,
+                'room': room,
+                'membership': {
+                    'role': self.membership_role,
+                    'is_member': self.membership_role is not None and not self.is_banned,
+                    'unread_count': unread_count,
+                },
                 'online_users': online_users,
                 'user_id': str(self.user.id),
-            }))
+                'last_message_id': snapshot['version'],
+                'since_message_id': since_message_id,
+                'has_gap': has_gap,
+                'has_more_history': not snapshot['complete'],
+            }, cls=DjangoJSONEncoder)
+
+            # Splice in the pre-encoded messages instead of re-encoding them
+            messages_json = ', '.join(encoded for _, encoded in messages)
+            await self.send(text_data=f'{frame[:-1]}, "messages": [{messages_json}]}}')
         except Exception as e:
             logger.error(f"Error sending initial data: {e}")
 
-    async def send_error(self, message):
-        """Send error message to client"""
+    def get_since_message_id(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return int(query['since_message_id'][0])
+        except (KeyError, IndexError, ValueError):
+            return None
+
+    async def get_room_snapshot(self):
+        """Shared snapshot for this room, rebuilt at most once per version per worker"""
+        version, generation = await asyncio.gather(
+            database_sync_to_async(latest_message_id, thread_sensitive=False)(self.room_id),
+            snapshot_generation(self.room_id),
+        )
+        snapshot = await cache.aget(snapshot_cache_key(self.room_id, generation))
+        if snapshot and snapshot['version'] == version:
+            return snapshot
+
+        # After a deploy every socket in a room reconnects at once; let one
+        # of them build the snapshot and the rest wait for it
+        key = (self.room_id, version, generation)
+        pending = _snapshot_builds.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(
+                database_sync_to_async(build_room_snapshot, thread_sensitive=False)(
+                    self.room_id, version, generation
+                )
+            )
+            _snapshot_builds[key] = pending
+            pending.add_done_callback(lambda _: _snapshot_builds.pop(key, None))
+        return await asyncio.shield(pending)
+
+    def get_unread_count(self):
+        from .models import ChatRoom
+        return ChatRoom.objects.with_unread_count(self.user).filter(
+            id=self.room_id
+        ).values_list('unread_count', flat=True).first() or 0
+
+    async def send_error(self, message, **extra):
+        """Send error message to client (extra keys such as retry_after go in the frame)"""
         await self.send(text_data=json.dumps({
             'type': 'error',
             'error': message,
             'timestamp': datetime.now().isoformat(),
+            **extra,
         }))
 
     async def validate_message(self, content, message_type, file_data):
@@ -496,34 +536,24 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
         
         return None
 
-    # Rate Limiting
+    # Rate Limiting (token buckets shared with the REST views, see chat.rate_limit)
     async def check_connection_rate_limit(self):
         """Rate limit connection attempts"""
-        if not self.redis_client:
-            return True
-            
-        key = f"conn_rate_limit:{self.user.id}"
-        try:
-            current = self.redis_client.incr(key)
-            if current == 1:
-                self.redis_client.expire(key, 60)  # 1 minute window
-            return current <= 10  # 10 connections per minute
-        except redis.RedisError:
-            return True
+        decision = await rate_limit.take(rate_limit.connection_buckets(self.user.id))
+        return decision.allowed
 
     async def check_message_rate_limit(self):
-        """Rate limit message sending"""
-        if not self.redis_client:
-            return True
-            
-        key = f"msg_rate_limit:{self.user.id}:{self.room_name}"
-        try:
-            current = self.redis_client.incr(key)
-            if current == 1:
-                self.redis_client.expire(key, 60)  # 1 minute window
-            return current <= 30  # 30 messages per minute
-        except redis.RedisError:
-            return True
+        """
+        Charge the per-user, per-room and slow-mode buckets for one message,
+        from the cached room settings and role. Sends the error on rejection.
+        """
+        decision = await rate_limit.take(rate_limit.message_buckets(
+            self.user.id, self.room_id, self.slow_mode,
+            self.membership_role in ['owner', 'admin', 'moderator'],
+        ))
+        if not decision.allowed:
+            await self.send_error(rate_limit.retry_message(decision), retry_after=round(decision.retry_after, 1))
+        return decision.allowed
 
     # Database Operations (with proper error handling)
     @database_sync_to_async
@@ -531,175 +561,363 @@ class RobustChatConsumer(AsyncWebsocketConsumer):
         """Validate user has access to room"""
         from .models import ChatRoom, RoomMembership
         try:
-            room = ChatRoom.objects.get(name=self.room_name, is_active=True)
-            return RoomMembership.objects.filter(
-                room=room, 
-                user=self.user, 
-                is_banned=False
-            ).exists() or room.created_by == self.user
+            room = ChatRoom.objects.only('id', 'created_by', 'slow_mode').get(name=self.room_name, is_active=True)
+            membership = RoomMembership.objects.filter(room=room, user=self.user).first()
+
+            self.room_id = room.id
+            self.membership_role = membership.role if membership else None
+            self.is_banned = bool(membership and membership.is_banned_currently())
+            self.slow_mode = room.slow_mode
+
+            return (membership is not None and not self.is_banned) or room.created_by_id == self.user.id
         except ChatRoom.DoesNotExist:
             return False
         except Exception as e:
             logger.error(f"Error validating room access: {e}")
             return False
 
-    @database_sync_to_async
-    def can_send_message(self):
-        """Check if user can send messages in room"""
-        from .models import RoomMembership
-        try:
-            membership = RoomMembership.objects.get(
-                room__name=self.room_name, 
-                user=self.user
-            )
-            return not membership.is_banned
-        except RoomMembership.DoesNotExist:
-            return False
+    async def can_send_message(self):
+        """Check if user can send messages in room (from the cached membership)"""
+        return self.membership_role is not None and not self.is_banned
 
     @database_sync_to_async
     def save_message(self, content, message_type, reply_to_id, file_data):
-        """Save message to database"""
+        """Save message to database in a single INSERT"""
         from .models import Message, ChatRoom
         try:
-            room = ChatRoom.objects.get(name=self.room_name)
-            
-            message = Message.objects.create(
-                room=room,
-                user=self.user,
-                content=content,
-                message_type=message_type,
-            )
-            
+            room_id = self.room_id
+
+            # Resolve the reply target up front (with everything its broadcast
+            # payload needs) so the message is inserted fully populated
+            reply_to = None
             if reply_to_id:
-                try:
-                    message.reply_to = Message.objects.get(id=reply_to_id, room=room)
-                    message.save()
-                except Message.DoesNotExist:
-                    pass
-            
-            if file_data:
-                message.file_url = file_data.get('url')
-                message.file_name = file_data.get('name')
-                message.file_size = file_data.get('size')
-                message.save()
-            
-            # Update room last activity
-            room.last_activity = datetime.now()
-            room.save()
-            
+                reply_to = Message.objects.select_related(
+                    'user', 'user__chat_profile'
+                ).filter(id=reply_to_id, room_id=room_id).first()
+
+            file_data = file_data or {}
+            # Attachments the sender uploaded beforehand (without a room) are
+            # linked to their blob for refcounting and thumbnails
+            blob = uploads.blob_for_upload(self.user, file_data.get('url')) if file_data else None
+            with transaction.atomic():
+                message = Message.objects.create(
+                    room_id=room_id,
+                    user=self.user,
+                    content=content,
+                    message_type=message_type,
+                    reply_to=reply_to,
+                    file_url=file_data.get('url'),
+                    file_name=file_data.get('name'),
+                    file_size=file_data.get('size'),
+                    file_type=file_data.get('type'),
+                    file_blob=blob,
+                    image_width=blob.width if blob else None,
+                    image_height=blob.height if blob else None,
+                )
+                if blob:
+                    blob.add_reference()
+                    thumbnails.schedule(blob)
+
+                # Targeted UPDATE instead of a full-row room.save()
+                ChatRoom.objects.filter(id=room_id).update(last_activity=timezone.now())
+
             return message
-            
+
         except Exception as e:
             logger.error(f"Error saving message: {e}")
             raise
 
-    @database_sync_to_async
-    def set_user_presence(self, is_online):
-        """Update user online status"""
-        from .models import UserProfile
+    async def set_user_presence(self, is_online):
+        """
+        Register or unregister this socket in the room's presence set.
+        Returns True when the user's first socket joined or last socket left
+        the room. The profile's online/last_seen is written in batches by the
+        write buffer rather than here.
+        """
         try:
-            profile, created = UserProfile.objects.get_or_create(user=self.user)
-            profile.online = is_online
-            profile.last_seen = datetime.now()
-            profile.save()
-
-            # Update room presence in Redis for quick access
-            if self.redis_client:
-                key = f"room_presence:{self.room_name}"
-                if is_online:
-                    self.redis_client.sadd(key, str(self.user.id))
-                else:
-                    self.redis_client.srem(key, str(self.user.id))
-                    
+            if is_online:
+                joined_room, came_online = await presence.join(
+                    self.redis_client, self.room_id, self.user.id, self.channel_name
+                )
+                self.heartbeat_task = asyncio.create_task(self.presence_heartbeat())
+                if came_online:
+                    get_write_buffer().touch_presence(self.user.id, True)
+                changed = joined_room
+            else:
+                if self.heartbeat_task is None:
+                    return False  # never joined (connect was rejected)
+                self.heartbeat_task.cancel()
+                self.heartbeat_task = None
+                left_room, went_offline = await presence.leave(
+                    self.redis_client, self.room_id, self.user.id, self.channel_name
+                )
+                if went_offline:
+                    get_write_buffer().touch_presence(self.user.id, False)
+                changed = left_room
+
+            if changed:
+                # Keeps ChatRoom.get_online_count() (REST room listings) current
+                await cache.aset(
+                    f"room_online_{self.room_id}",
+                    await presence.online_count(self.redis_client, self.room_id),
+                    presence.presence_ttl(),
+                )
+            return changed
+
         except Exception as e:
             logger.error(f"Error setting user presence: {e}")
+            return is_online
 
-    @database_sync_to_async
-    def get_online_count(self):
-        """Get number of online users in room"""
-        if self.redis_client:
+    async def presence_heartbeat(self):
+        """Refresh this socket's presence TTL until it disconnects"""
+        while True:
+            await asyncio.sleep(presence.heartbeat_interval())
             try:
-                key = f"room_presence:{self.room_name}"
-                return self.redis_client.scard(key)
-            except redis.RedisError:
-                pass
-                
+                await presence.heartbeat(self.redis_client, self.room_id, self.user.id, self.channel_name)
+                get_write_buffer().touch_presence(self.user.id, True)
+            except RedisError as e:
+                logger.warning(f"Presence heartbeat failed for user {self.user.id}: {e}")
+
+    async def get_online_count(self):
+        """Get number of online users in room"""
+        try:
+            return await presence.online_count(self.redis_client, self.room_id)
+        except RedisError:
+            pass
+
         # Fallback to database
-        from .models import UserProfile
-        return UserProfile.objects.filter(online=True).count()
+        return await self.get_online_count_from_db()
 
     @database_sync_to_async
-    def get_online_users(self):
-        """Get list of online users"""
-        from .models import UserProfile
-        from .serializers import UserLiteSerializer
-        
-        online_profiles = UserProfile.objects.filter(online=True).select_related('user')
-        return UserLiteSerializer([profile.user for profile in online_profiles], many=True).data
+    def get_online_count_from_db(self):
+        """Count the room's members flagged online when redis is unavailable"""
+        from .models import RoomMembership
+        return RoomMembership.objects.filter(
+            room_id=self.room_id, is_banned=False, user__chat_profile__online=True
+        ).count()
+
+    async def get_online_users(self):
+        """Get list of users online in this room"""
+        try:
+            user_ids = await presence.online_user_ids(self.redis_client, self.room_id)
+        except RedisError:
+            user_ids = None
+        return await self.serialize_online_users(user_ids)
 
     @database_sync_to_async
-    def get_room_info(self):
-        """Get room information"""
-        from .models import ChatRoom, RoomMembership
-        from .serializers import ChatRoomSerializer
-        
-        room = ChatRoom.objects.get(name=self.room_name)
-        return ChatRoomSerializer(room, context={'user': self.user}).data
+    def serialize_online_users(self, user_ids):
+        from .models import RoomMembership
+        from .serializers import UserLiteSerializer
+
+        if user_ids is None:
+            # Redis unavailable: fall back to the room's members flagged online
+            user_ids = RoomMembership.objects.filter(
+                room_id=self.room_id, is_banned=False, user__chat_profile__online=True
+            ).values('user_id')
+        users = User.objects.filter(id__in=user_ids).select_related('chat_profile')
+        return UserLiteSerializer(users, many=True).data
 
     @database_sync_to_async
-    def get_recent_messages(self, limit=50):
-        """Get recent messages for room"""
-        from .models import Message, ChatRoom
+    def get_message_history(self, cursor, limit):
+        """Keyset page of room history, same cursors as the REST messages endpoint"""
+        from .models import ArchivedMessage, Message
         from .serializers import MessageSerializer
-        
-        room = ChatRoom.objects.get(name=self.room_name)
-        messages = Message.objects.filter(
-            room=room, 
+
+        queryset = Message.objects.filter(
+            room_id=self.room_id,
             is_deleted=False
-        ).select_related('user', 'reply_to').prefetch_related('reactions').order_by('-timestamp')[:limit]
-        
-        return MessageSerializer(messages.reverse(), many=True).data  # Reverse to get chronological order
+        ).for_serializer(self.user)
+        archived = ArchivedMessage.objects.filter(
+            room_id=self.room_id,
+            is_deleted=False
+        ).for_serializer(self.user)
+        messages, next_cursor, previous_cursor = keyset_page(queryset, cursor=cursor, limit=limit, archive=archived)
 
-    @database_sync_to_async
-    def get_reply_data(self, reply_to_id):
-        """Get reply message data"""
-        if not reply_to_id:
-            return None
-            
-        from .models import Message
-        from .serializers import MessageSerializer
-        
-        try:
-            message = Message.objects.get(id=reply_to_id)
-            return MessageSerializer(message).data
-        except Message.DoesNotExist:
+        return {
+            'messages': MessageSerializer(messages[::-1], many=True).data,  # chronological order
+            'next_cursor': next_cursor,
+            'previous_cursor': previous_cursor,
+        }
+
+    async def mark_message_as_read(self, message_id):
+        """Buffer a read receipt; persisted in bulk by the write buffer"""
+        get_write_buffer().mark_read(self.room_id, self.user.id, int(message_id))
+
+    async def add_message_reaction(self, message_id, reaction):
+        """Buffer a reaction; persisted in bulk by the write buffer"""
+        get_write_buffer().set_reaction(self.room_id, int(message_id), self.user.id, reaction)
+
+    def get_reply_data(self, message_obj):
+        """Serialize the replied-to message already loaded by save_message"""
+        if not message_obj.reply_to_id:
             return None
 
-    @database_sync_to_async
+        from .serializers import ReplyMessageSerializer
+        return ReplyMessageSerializer(message_obj.reply_to).data
+
     def get_file_data(self, message_obj):
         """Get file data for message"""
         if not message_obj.file_url:
             return None
             
+        blob = message_obj.file_blob if message_obj.file_blob_id else None
         return {
             'url': message_obj.file_url,
             'name': message_obj.file_name,
             'size': message_obj.file_size,
             'type': message_obj.file_type,
+            'width': message_obj.image_width,
+            'height': message_obj.image_height,
+            'thumbnails': blob.thumbnail_urls() if blob else {},
         }
 
     # ... (other database operations with proper error handling)
 
-# Additional consumer for typing indicators only
-class TypingConsumer(AsyncWebsocketConsumer):
-    """Lightweight consumer for typing indicators only"""
-    async def connect(self):
-        # Implementation for typing-only connections
-        pass
-
 # Consumer for notifications
 class NotificationConsumer(AsyncWebsocketConsumer):
-    """Consumer for user-specific notifications"""
+    """
+    One socket per user for everything they belong to: the events of all
+    their rooms and their own app notifications (workflow approvals, ...).
+    A client in 50 rooms keeps this one socket open and only opens a
+    RobustChatConsumer for the room on screen; sending messages, typing and
+    history stay on that socket or the REST API.
+
+    Frames sent to the client:
+        subscribed        on connect: {"rooms": {name: unread_count}}
+        room_event        {"room": name, "event": <the room socket's frame>}
+        room_joined/left  the socket started or stopped following a room
+        notification      {"category": ..., "data": {...}}
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = None
+        self.user_group_name = None
+        self.rooms = set()
+
     async def connect(self):
-        # Implementation for user notification channel
-        pass
\ No newline at end of file
+        try:
+            self.user = self.scope["user"]
+
+            if isinstance(self.user, AnonymousUser):
+                logger.warning("Anonymous user attempted notification WebSocket connection")
+                await self.close(code=4001)
+                return
+
+            decision = await rate_limit.take(rate_limit.connection_buckets(self.user.id))
+            if not decision.allowed:
+                await self.close(code=4004)
+                return
+
+            # One query for every room and its unread count
+            unread_counts = await self.get_rooms()
+            self.rooms = set(unread_counts)
+            self.user_group_name = user_group_name(self.user.id)
+
+            groups = [self.user_group_name] + [room_group_name(name) for name in self.rooms]
+            await asyncio.gather(*(
+                self.channel_layer.group_add(group, self.channel_name) for group in groups
+            ))
+
+            await self.accept()
+            await self.send(text_data=json.dumps({
+                'type': 'subscribed',
+                'user_id': str(self.user.id),
+                'rooms': unread_counts,
+            }))
+
+            logger.info(f"User {self.user.id} connected to notifications ({len(self.rooms)} rooms)")
+
+        except Exception as e:
+            logger.error(f"Notification connection error for user {getattr(self.user, 'id', 'unknown')}: {e}")
+            await self.close(code=4000)
+
+    async def disconnect(self, close_code):
+        if not self.user_group_name:
+            return
+        try:
+            groups = [self.user_group_name] + [room_group_name(name) for name in self.rooms]
+            await asyncio.gather(*(
+                self.channel_layer.group_discard(group, self.channel_name) for group in groups
+            ))
+        except Exception as e:
+            logger.error(f"Notification disconnection error: {e}")
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            await self.send_error('Invalid JSON format')
+            return
+
+        decision = await rate_limit.take(rate_limit.socket_event_buckets(self.user.id))
+        if not decision.allowed:
+            await self.send_error(rate_limit.retry_message(decision), retry_after=round(decision.retry_after, 1))
+            return
+
+        if data.get('type') == 'ping':
+            await self.send(text_data=json.dumps({'type': 'pong', 'timestamp': datetime.now().isoformat()}))
+        else:
+            await self.send_error('Invalid message type')
+
+    async def send_error(self, message, **extra):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'error': message,
+            'timestamp': datetime.now().isoformat(),
+            **extra,
+        }))
+
+    # Room group events: wrap the broadcaster's pre-encoded frame without
+    # decoding it
+    async def forward_room_frame(self, event):
+        room = json.dumps(event.get('room'))
+        await self.send(text_data=f'{{"type": "room_event", "room": {room}, "event": {event["frame"]}}}')
+
+    chat_message = forward_room_frame
+    user_presence = forward_room_frame
+    typing_indicator = forward_room_frame
+    message_read = forward_room_frame
+    message_edited = forward_room_frame
+    message_deleted = forward_room_frame
+    message_reacted = forward_room_frame
+
+    async def membership_changed(self, event):
+        """Room sockets' control event; our copy arrives as room_membership"""
+
+    async def room_settings_changed(self, event):
+        """Only matters to sockets that send messages"""
+
+    # User group events
+    async def room_membership(self, event):
+        """Follow a room the user joined, drop one they left or were banned from"""
+        room = event['room']
+        group = room_group_name(room)
+
+        if event.get('removed') or event.get('is_banned'):
+            if room in self.rooms:
+                self.rooms.discard(room)
+                await self.channel_layer.group_discard(group, self.channel_name)
+                await self.send(text_data=json.dumps({'type': 'room_left', 'room': room}))
+        elif room not in self.rooms:
+            self.rooms.add(room)
+            await self.channel_layer.group_add(group, self.channel_name)
+            await self.send(text_data=json.dumps({'type': 'room_joined', 'room': room, 'role': event.get('role')}))
+
+    async def user_notification(self, event):
+        await self.send(text_data=event['frame'])
+
+    @database_sync_to_async
+    def get_rooms(self):
+        """{room name: unread count} for the active rooms the user may connect to"""
+        from django.db.models import Q
+        from .models import ChatRoom, RoomMembership
+
+        memberships = RoomMembership.objects.filter(user=self.user).filter(
+            Q(is_banned=False) | Q(banned_until__lt=timezone.now())
+        )
+        rooms = ChatRoom.objects.filter(
+            Q(id__in=memberships.values('room_id')) | Q(created_by=self.user),
+            is_active=True,
+        ).with_unread_count(self.user)
+        return dict(rooms.values_list('name', 'unread_count'))
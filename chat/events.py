@@ -0,0 +1,98 @@
+# chat/events.py
+import json
+import logging
+from datetime import datetime
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Two kinds of channel layer groups carry events to sockets:
+#
+#   chat_<room_name>   every socket in the room: RobustChatConsumer for that
+#                      room, and the NotificationConsumer of each member
+#   user_<user_id>     the user's own NotificationConsumer sockets: app
+#                      notifications and their room membership changes
+#
+# Every room event carries 'room' so a socket subscribed to many rooms knows
+# where it came from.
+
+
+def room_group_name(room_name):
+    """Channel layer group shared by every socket connected to a room"""
+    return f'chat_{room_name}'
+
+
+def user_group_name(user_id):
+    """Channel layer group for one user's notification sockets"""
+    return f'user_{user_id}'
+
+
+def _send_on_commit(group, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    def _send():
+        try:
+            async_to_sync(channel_layer.group_send)(group, event)
+        except Exception as e:
+            logger.error(f"Failed to send {event.get('type')} to {group}: {e}")
+
+    transaction.on_commit(_send)
+
+
+def send_room_event(room_name, event):
+    """Send a control event to a room group once the current transaction commits"""
+    _send_on_commit(room_group_name(room_name), dict(event, room=room_name))
+
+
+def send_user_event(user_id, event):
+    """Send an event to a user's notification sockets once the current transaction commits"""
+    _send_on_commit(user_group_name(user_id), event)
+
+
+def send_user_notification(user_id, category, data):
+    """
+    Push an app notification (workflow approvals, documents, ...) to the
+    user's notification sockets. The frame is encoded once here and
+    forwarded as-is to each of their open sockets.
+    """
+    send_user_event(user_id, {
+        'type': 'user_notification',
+        'frame': json.dumps({
+            'type': 'notification',
+            'category': category,
+            'data': data,
+            'timestamp': datetime.now().isoformat(),
+        }, cls=DjangoJSONEncoder),
+    })
+
+
+def notify_membership_changed(membership, removed=False):
+    """
+    Tell connected consumers to refresh their cached role/ban state for a
+    member, and the member's notification sockets to subscribe to or drop
+    the room. Also sent when someone joins.
+    """
+    event = {
+        'type': 'membership_changed',
+        'user_id': str(membership.user_id),
+        'role': None if removed else membership.role,
+        # A ban that has run out no longer counts, even before it is cleared
+        'is_banned': False if removed else membership.is_banned_currently(),
+        'removed': removed,
+    }
+    send_room_event(membership.room.name, event)
+    send_user_event(membership.user_id, dict(event, type='room_membership', room=membership.room.name))
+
+
+def notify_room_settings_changed(room):
+    """Tell connected consumers to refresh the room settings they cache (slow mode)"""
+    send_room_event(room.name, {
+        'type': 'room_settings_changed',
+        'slow_mode': room.slow_mode,
+    })
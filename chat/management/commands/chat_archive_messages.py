@@ -0,0 +1,43 @@
+# chat/management/commands/chat_archive_messages.py
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Move chat messages older than CHAT_ARCHIVE_AFTER_DAYS, with their read receipts, "
+        "reactions and edit history, to the archive tables in batches."
+    )
+
+    def add_arguments(self, parser):
+        from chat import archive
+
+        parser.add_argument(
+            '--batch-size', type=int, default=archive.archive_batch_size(),
+            help='Messages moved per transaction',
+        )
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument(
+            '--purge-deleted', action='store_true',
+            help='Drop soft-deleted messages instead of archiving them',
+        )
+
+    def handle(self, *args, **options):
+        from chat import archive
+
+        # One cutoff for the whole run, so batches don't chase a moving window
+        cutoff = archive.archive_cutoff()
+        batch_size = max(1, options['batch_size'])
+        archived = purged = batches = 0
+
+        while options['max_batches'] is None or batches < options['max_batches']:
+            moved, dropped = archive.archive_batch(cutoff, batch_size, purge_deleted=options['purge_deleted'])
+            if not moved and not dropped:
+                break
+            archived += moved
+            purged += dropped
+            batches += 1
+
+        self.stdout.write(
+            f"Archived {archived} message(s) older than {cutoff:%Y-%m-%d}, "
+            f"purged {purged} deleted message(s) in {batches} batch(es)"
+        )
@@ -0,0 +1,84 @@
+# chat/management/commands/chat_broadcast_benchmark.py
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+
+def _sample_event():
+    return {
+        'type': 'message',
+        'message_id': '123456',
+        'content': 'Quarterly budget draft is ready for review, please leave comments by Friday. ' * 3,
+        'message_type': 'text',
+        'user_id': '42',
+        'username': 'jane.doe',
+        'display_name': 'Jane Doe',
+        'timestamp': '2025-01-01T12:00:00+00:00',
+        'reply_to': None,
+        'file_data': None,
+    }
+
+
+async def _legacy_handler(consumer, event):
+    # Per-recipient rebuild + encode, as the handlers did before pre-encoding
+    await consumer.send(text_data=json.dumps({
+        'type': 'message',
+        'message_id': event['message_id'],
+        'content': event['content'],
+        'message_type': event['message_type'],
+        'user_id': event['user_id'],
+        'username': event['username'],
+        'display_name': event['display_name'],
+        'timestamp': event['timestamp'],
+        'reply_to': event.get('reply_to'),
+        'file_data': event.get('file_data'),
+    }))
+
+
+class Command(BaseCommand):
+    help = "Measure CPU time per chat broadcast vs. room size, per-recipient encoding vs. pre-encoded frames."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,5000', help='Comma separated room sizes')
+        parser.add_argument('--broadcasts', type=int, default=50)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(f"{'members':>8} {'per-recipient ms':>18} {'pre-encoded ms':>16} {'speedup':>8}")
+        for size in sizes:
+            legacy, encoded = asyncio.run(self.run_size(size, options['broadcasts']))
+            self.stdout.write(
+                f"{size:>8} {legacy * 1000:>18.3f} {encoded * 1000:>16.3f} {legacy / encoded if encoded else 0:>7.1f}x"
+            )
+
+    async def run_size(self, size, broadcasts):
+        from chat.consumers import RobustChatConsumer
+
+        async def discard(message):
+            return None
+
+        consumers = []
+        for _ in range(size):
+            consumer = RobustChatConsumer()
+            consumer.base_send = discard
+            consumers.append(consumer)
+
+        payload = _sample_event()
+        legacy_event = dict(payload, type='chat_message')
+
+        start = time.process_time()
+        for _ in range(broadcasts):
+            for consumer in consumers:
+                await _legacy_handler(consumer, legacy_event)
+        legacy = (time.process_time() - start) / broadcasts
+
+        start = time.process_time()
+        for _ in range(broadcasts):
+            event = {'type': 'chat_message', 'frame': json.dumps(payload)}
+            for consumer in consumers:
+                await consumer.chat_message(event)
+        encoded = (time.process_time() - start) / broadcasts
+
+        return legacy, encoded
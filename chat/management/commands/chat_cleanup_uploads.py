@@ -0,0 +1,60 @@
+# chat/management/commands/chat_cleanup_uploads.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Abort resumable chat uploads that have been idle too long, delete their "
+        "staging files, and delete stored attachments no message references anymore."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=getattr(settings, 'CHAT_UPLOAD_EXPIRY_HOURS', 24),
+            help='Idle time after which a pending upload or unreferenced blob is removed',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        self.abort_stale_uploads(cutoff)
+        self.delete_unreferenced_blobs(cutoff)
+
+    def abort_stale_uploads(self, cutoff):
+        from chat import uploads
+        from chat.models import FileUpload
+
+        stale = FileUpload.objects.filter(status='pending', updated_at__lt=cutoff)
+
+        count = 0
+        for upload in stale.iterator():
+            uploads.discard_staging(upload)
+            count += 1
+        stale.update(status='aborted')
+
+        self.stdout.write(f"Aborted {count} stale upload(s)")
+
+    def delete_unreferenced_blobs(self, cutoff):
+        """The grace period covers blobs stored by uploads that haven't taken their reference yet"""
+        from chat.models import FileBlob
+
+        count = 0
+        freed = 0
+        for blob in FileBlob.objects.filter(ref_count=0, updated_at__lt=cutoff).iterator():
+            try:
+                # Re-check the count in the DELETE itself in case it was just reused
+                deleted, _ = FileBlob.objects.filter(pk=blob.pk, ref_count=0).delete()
+            except ProtectedError:
+                # Still attached to (soft-deleted) messages; the count drifted
+                continue
+            if deleted:
+                default_storage.delete(blob.path)
+                count += 1
+                freed += blob.size
+
+        self.stdout.write(f"Deleted {count} unreferenced blob(s), {freed / (1024 * 1024):.1f}MB")
@@ -0,0 +1,154 @@
+# chat/management/commands/chat_fanout_loadtest.py
+import asyncio
+import multiprocessing
+import queue
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def _receive_all(index, sockets, group, expected, ready_queue, timeout):
+    from channels.layers import get_channel_layer
+
+    layer = get_channel_layer()
+    channels = [await layer.new_channel() for _ in range(sockets)]
+    for channel in channels:
+        await layer.group_add(group, channel)
+    ready_queue.put(index)
+
+    latencies = []
+
+    async def drain(channel):
+        for _ in range(expected):
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message['sent_at'])
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*(drain(c) for c in channels)), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+    for channel in channels:
+        await layer.group_discard(group, channel)
+    return latencies
+
+
+def _worker(index, sockets, group, expected, ready_queue, result_queue, timeout):
+    """Simulate one Daphne/Uvicorn worker holding `sockets` consumers in `group`"""
+    import django
+    django.setup()
+
+    latencies = asyncio.run(_receive_all(index, sockets, group, expected, ready_queue, timeout))
+    result_queue.put({'worker': index, 'latencies': latencies})
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test chat fan-out through the configured channel layer: N worker "
+        "processes join one room group and a sender broadcasts to it. Fails if "
+        "any socket misses a message or p99 latency exceeds --max-p99-ms."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes')
+        parser.add_argument('--sockets', type=int, default=100, help='Sockets per worker')
+        parser.add_argument('--messages', type=int, default=100, help='Broadcasts to send')
+        parser.add_argument('--rate', type=float, default=50.0, help='Broadcasts per second')
+        parser.add_argument('--max-p99-ms', type=float, default=250.0)
+        parser.add_argument('--timeout', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        from channels.layers import get_channel_layer, InMemoryChannelLayer
+
+        if isinstance(get_channel_layer(), InMemoryChannelLayer):
+            raise CommandError(
+                "InMemoryChannelLayer cannot deliver across processes; "
+                "set CHANNEL_LAYER_BACKEND=redis to run this load test."
+            )
+
+        workers = options['workers']
+        sockets = options['sockets']
+        messages = options['messages']
+        timeout = options['timeout']
+        group = f"loadtest_{uuid.uuid4().hex}"
+
+        ctx = multiprocessing.get_context('spawn')
+        ready_queue = ctx.Queue()
+        result_queue = ctx.Queue()
+        processes = [
+            ctx.Process(
+                target=_worker,
+                args=(i, sockets, group, messages, ready_queue, result_queue, timeout),
+            )
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            for _ in range(workers):
+                ready_queue.get(timeout=timeout)
+        except queue.Empty:
+            for process in processes:
+                process.terminate()
+            raise CommandError("Workers did not join the group in time")
+
+        started = time.time()
+        asyncio.run(self.broadcast(group, messages, options['rate']))
+        send_duration = time.time() - started
+
+        latencies = []
+        try:
+            for _ in range(workers):
+                latencies.extend(result_queue.get(timeout=timeout + 10)['latencies'])
+        except queue.Empty:
+            raise CommandError("Timed out waiting for worker results")
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+        expected = workers * sockets * messages
+        latencies.sort()
+        p99_ms = _percentile(latencies, 99) * 1000
+
+        self.stdout.write(f"workers={workers} sockets/worker={sockets} broadcasts={messages}")
+        self.stdout.write(f"delivered {len(latencies)}/{expected} frames, sent in {send_duration:.2f}s")
+        self.stdout.write(
+            "latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+                _percentile(latencies, 50) * 1000,
+                _percentile(latencies, 95) * 1000,
+                p99_ms,
+                (latencies[-1] if latencies else 0) * 1000,
+            )
+        )
+
+        if len(latencies) < expected:
+            raise CommandError(f"{expected - len(latencies)} frames were not delivered")
+        if p99_ms > options['max_p99_ms']:
+            raise CommandError(f"p99 latency {p99_ms:.1f}ms exceeds {options['max_p99_ms']}ms")
+
+        self.stdout.write(self.style.SUCCESS("Fan-out across workers OK"))
+
+    async def broadcast(self, group, messages, rate):
+        from channels.layers import get_channel_layer
+
+        layer = get_channel_layer()
+        interval = 1.0 / rate if rate > 0 else 0
+        for seq in range(messages):
+            await layer.group_send(group, {
+                'type': 'loadtest.message',
+                'seq': seq,
+                'sent_at': time.time(),
+            })
+            if interval:
+                await asyncio.sleep(interval)
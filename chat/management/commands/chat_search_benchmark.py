@@ -0,0 +1,188 @@
+# chat/management/commands/chat_search_benchmark.py
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+COMMON_WORDS = [
+    'meeting', 'budget', 'report', 'deadline', 'review', 'draft', 'invoice', 'client',
+    'project', 'update', 'please', 'thanks', 'tomorrow', 'today', 'call', 'team',
+    'document', 'contract', 'approval', 'schedule', 'design', 'release', 'bug', 'fix',
+    'deploy', 'customer', 'feedback', 'question', 'agenda', 'notes', 'quarter', 'sales',
+]
+VOCABULARY_SIZE = 20000
+ROOM_PREFIX = 'searchbench_'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark MessageSearchAPI's full-text path against the old ILIKE scan "
+        "over a synthetic corpus (PostgreSQL only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10_000_000, help='Synthetic messages to generate')
+        parser.add_argument('--rooms', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=250_000)
+        parser.add_argument('--iterations', type=int, default=5, help='Timed runs per query')
+        parser.add_argument('--queries', default='meeting,budget report,w1234,"deadline tomorrow"')
+        parser.add_argument('--skip-legacy', action='store_true', help='Only time the full-text path')
+        parser.add_argument('--reuse', action='store_true', help='Reuse a corpus left by --keep')
+        parser.add_argument('--keep', action='store_true', help='Keep the corpus for later runs')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The search benchmark needs PostgreSQL (tsvector/GIN).")
+
+        user = self.get_user()
+        if options['reuse']:
+            room_ids = self.existing_rooms()
+            if not room_ids:
+                raise CommandError("No corpus to reuse; run once with --keep first.")
+        else:
+            self.cleanup()
+            room_ids = self.create_rooms(user, options['rooms'])
+            self.generate(user, room_ids, options['messages'], options['batch_size'])
+
+        try:
+            self.run_queries(user, options)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+    def get_user(self):
+        User = get_user_model()
+        user, _ = User.objects.get_or_create(
+            email='search-benchmark@example.invalid',
+            defaults={'first_name': 'Search', 'last_name': 'Benchmark', 'is_active': False},
+        )
+        return user
+
+    def existing_rooms(self):
+        from chat.models import ChatRoom
+        return list(ChatRoom.objects.filter(name__startswith=ROOM_PREFIX).values_list('id', flat=True))
+
+    def create_rooms(self, user, count):
+        from chat.models import ChatRoom, RoomMembership
+
+        with transaction.atomic():
+            rooms = ChatRoom.objects.bulk_create([
+                ChatRoom(name=f'{ROOM_PREFIX}{i}', title=f'Search benchmark {i}', created_by=user)
+                for i in range(count)
+            ])
+            RoomMembership.objects.bulk_create([
+                RoomMembership(room=room, user=user, role='owner') for room in rooms
+            ])
+        return [room.id for room in rooms]
+
+    def generate(self, user, room_ids, total, batch_size):
+        """Insert messages server-side with generate_series; the trigger fills search_vector"""
+        self.stdout.write(f"Generating {total:,} messages in {len(room_ids)} rooms...")
+
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            for offset in range(0, total, batch_size):
+                rows = min(batch_size, total - offset)
+                # Word n of the vocabulary is COMMON_WORDS[n] or the token "w<n>";
+                # power(random(), 3) skews picks towards the front, giving a few
+                # very common terms and a long tail of rare ones
+                cursor.execute(
+                    """
+                    INSERT INTO chat_message (
+                        created_at, updated_at, room_id, user_id, content, message_type,
+                        is_edited, is_deleted, timestamp
+                    )
+                    SELECT now(), now(), (%(rooms)s::bigint[])[1 + (g %% %(room_count)s)], %(user)s,
+                           array_to_string(ARRAY(
+                               SELECT CASE WHEN n < %(common_count)s
+                                           THEN (%(common)s::text[])[n + 1]
+                                           ELSE 'w' || n END
+                               FROM (
+                                   SELECT floor(power(random(), 3) * %(vocabulary)s)::int AS n
+                                   FROM generate_series(1, 4 + (g %% 20))
+                               ) picks
+                           ), ' '),
+                           'text', false, false,
+                           now() - make_interval(secs => (%(total)s - g))
+                    FROM generate_series(%(start)s, %(stop)s) AS g
+                    """,
+                    {
+                        'rooms': room_ids, 'room_count': len(room_ids), 'user': user.id,
+                        'common': COMMON_WORDS, 'common_count': len(COMMON_WORDS),
+                        'vocabulary': VOCABULARY_SIZE, 'total': total,
+                        'start': offset, 'stop': offset + rows - 1,
+                    },
+                )
+                self.stdout.write(f"  {offset + rows:,} rows ({time.monotonic() - started:.0f}s)")
+            # Merge the GIN pending list and refresh planner stats before timing
+            cursor.execute("VACUUM ANALYZE chat_message")
+
+    def run_queries(self, user, options):
+        from chat.models import Message, RoomMembership
+        from chat.pagination import keyset_page, search_page
+
+        accessible = Message.objects.filter(
+            room_id__in=RoomMembership.objects.filter(user=user, is_banned=False).values('room_id'),
+            is_deleted=False,
+        )
+        queries = options['queries'].split(',')
+
+        self.stdout.write(f"{'query':<22} {'path':<17} {'median ms':>10} {'p95 ms':>10} {'rows':>6}")
+        for query in queries:
+            query = query.strip()
+
+            def full_text():
+                return search_page(accessible.search(query), limit=50)[0]
+
+            def full_text_page_5():
+                cursor = None
+                for _ in range(5):
+                    page, cursor = search_page(accessible.search(query), cursor=cursor, limit=50)
+                    if cursor is None:
+                        break
+                return page
+
+            def full_text_recent():
+                return keyset_page(accessible.search(query), limit=50)[0]
+
+            paths = [
+                ('full-text', full_text),
+                ('full-text 5 pages', full_text_page_5),
+                ('full-text recent', full_text_recent),
+            ]
+            if not options['skip_legacy']:
+                def legacy():
+                    return list(Message.objects.filter(
+                        room__roommembership__user=user,
+                        room__roommembership__is_banned=False,
+                        is_deleted=False,
+                    ).filter(
+                        Q(content__icontains=query.strip('"')) | Q(file_name__icontains=query.strip('"'))
+                    ).order_by('-timestamp')[:100])
+                paths.insert(0, ('ilike (old)', legacy))
+
+            for label, run in paths:
+                timings = []
+                rows = 0
+                for _ in range(options['iterations']):
+                    started = time.perf_counter()
+                    rows = len(run())
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+                self.stdout.write(
+                    f"{query:<22} {label:<17} {statistics.median(timings):>10.1f} {p95:>10.1f} {rows:>6}"
+                )
+
+    def cleanup(self):
+        from chat.models import ChatRoom
+
+        room_ids = self.existing_rooms()
+        if not room_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM chat_message WHERE room_id = ANY(%s)", [room_ids])
+        ChatRoom.objects.filter(id__in=room_ids).delete()
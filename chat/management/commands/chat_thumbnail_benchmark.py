@@ -0,0 +1,88 @@
+# chat/management/commands/chat_thumbnail_benchmark.py
+import io
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from PIL import Image
+
+
+def naive_thumbnails(data, sizes, quality):
+    """Baseline: full-resolution decode, every bucket resampled from the original"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        rendered = {}
+        for size in sizes:
+            thumb = image.copy()
+            thumb.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            thumb.save(buffer, 'WEBP', quality=quality, method=4)
+            rendered[size] = buffer.getvalue()
+        return image.width, image.height, rendered
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure thumbnail throughput (images/s, and per worker) for synthetic "
+        "phone-sized JPEGs, with thread and process pools of increasing size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=24)
+        parser.add_argument('--width', type=int, default=4032)
+        parser.add_argument('--height', type=int, default=3024)
+        parser.add_argument('--workers', default=None, help='Comma-separated pool sizes (default 1,2,4.. up to the core count)')
+        parser.add_argument('--skip-naive', action='store_true', help="Don't time the full-resolution baseline")
+
+    def handle(self, *args, **options):
+        from chat import thumbnails
+
+        cores = os.cpu_count() or 1
+        if options['workers']:
+            pool_sizes = [int(n) for n in options['workers'].split(',')]
+        else:
+            pool_sizes = sorted({1, cores} | {n for n in (2, 4, 8, 16) if n < cores})
+
+        self.stdout.write(f"Generating {options['images']} {options['width']}x{options['height']} JPEGs...")
+        images = [self.make_jpeg(options['width'], options['height'], seed) for seed in range(options['images'])]
+        megabytes = sum(len(data) for data in images) / (1024 * 1024)
+        sizes, quality = thumbnails.thumbnail_sizes(), thumbnails.thumbnail_quality()
+        self.stdout.write(f"{megabytes:.1f}MB of input, buckets {sizes}, quality {quality}, {cores} core(s)")
+
+        self.stdout.write(f"{'renderer':<10} {'pool':<9} {'workers':>7} {'images/s':>9} {'per worker':>11} {'ms/image':>9}")
+        renderers = [('pipeline', thumbnails.render_thumbnails)]
+        if not options['skip_naive']:
+            renderers.insert(0, ('naive', naive_thumbnails))
+
+        for label, render in renderers:
+            for pool_name, pool_class in (('threads', ThreadPoolExecutor), ('processes', ProcessPoolExecutor)):
+                for workers in pool_sizes:
+                    elapsed = self.run(pool_class, workers, render, images, sizes, quality)
+                    rate = len(images) / elapsed
+                    self.stdout.write(
+                        f"{label:<10} {pool_name:<9} {workers:>7} {rate:>9.1f} "
+                        f"{rate / workers:>11.1f} {elapsed * 1000 / len(images) * workers:>9.0f}"
+                    )
+
+    def run(self, pool_class, workers, render, images, sizes, quality):
+        with pool_class(max_workers=workers) as pool:
+            # Warm up the workers (process start-up, imports) before timing
+            list(pool.map(render, images[:workers], [sizes] * workers, [quality] * workers))
+            started = time.perf_counter()
+            list(pool.map(render, images, [sizes] * len(images), [quality] * len(images)))
+            return time.perf_counter() - started
+
+    def make_jpeg(self, width, height, seed):
+        """A photo-like image: smooth gradients plus sensor noise, so JPEG sizes are realistic"""
+        rng = random.Random(seed)
+        base = Image.linear_gradient('L').resize((width, height))
+        channels = [
+            Image.blend(base.rotate(rng.randint(0, 359)), Image.effect_noise((width, height), rng.randint(20, 60)), 0.3)
+            for _ in range(3)
+        ]
+        buffer = io.BytesIO()
+        Image.merge('RGB', channels).save(buffer, 'JPEG', quality=90)
+        return buffer.getvalue()
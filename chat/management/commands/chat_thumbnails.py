@@ -0,0 +1,63 @@
+# chat/management/commands/chat_thumbnails.py
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate WebP thumbnails for image attachments that don't have them yet "
+        "(uploads from before the pipeline, or jobs lost in a restart)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Render processes')
+        parser.add_argument('--limit', type=int, default=None, help='Process at most this many blobs')
+
+    def handle(self, *args, **options):
+        from chat import thumbnails
+        from chat.models import FileBlob
+
+        pending = FileBlob.objects.filter(
+            content_type__in=thumbnails.THUMBNAIL_CONTENT_TYPES,
+            thumbnails__isnull=True,
+        ).order_by('id')
+        if options['limit']:
+            pending = pending[:options['limit']]
+
+        sizes, quality = thumbnails.thumbnail_sizes(), thumbnails.thumbnail_quality()
+        workers = max(1, options['workers'])
+        self.done = self.failed = 0
+
+        # Rendering runs in the pool; storage and database writes stay here.
+        # Only a few images per worker are read ahead, to bound memory.
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for blob in pending.iterator():
+                try:
+                    data = thumbnails.read_blob(blob)
+                except OSError as e:
+                    thumbnails.mark_failed(blob, e)
+                    self.failed += 1
+                    continue
+                in_flight.append((blob, pool.submit(thumbnails.render_thumbnails, data, sizes, quality)))
+                if len(in_flight) >= workers * 2:
+                    self.finish(*in_flight.popleft())
+            while in_flight:
+                self.finish(*in_flight.popleft())
+
+        self.stdout.write(f"Thumbnailed {self.done} image(s), {self.failed} failed")
+
+    def finish(self, blob, future):
+        from chat import thumbnails
+
+        try:
+            width, height, rendered = future.result()
+        except Exception as e:
+            thumbnails.mark_failed(blob, e)
+            self.failed += 1
+            return
+        thumbnails.save_thumbnails(blob, width, height, rendered)
+        self.done += 1
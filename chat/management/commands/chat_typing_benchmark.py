@@ -0,0 +1,118 @@
+# chat/management/commands/chat_typing_benchmark.py
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class CountingLayer:
+    """Channel layer stand-in that counts group sends instead of delivering them"""
+
+    def __init__(self):
+        self.sends = 0
+
+    async def group_send(self, group, message):
+        self.sends += 1
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"typist{user_id}"
+
+    def get_full_name(self):
+        return f"Typist {self.id}"
+
+
+class LegacyTyping:
+    """The old behaviour: one broadcast per typing_start plus a 3s auto-stop broadcast"""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.stop_tasks = {}
+
+    async def start(self, user):
+        await self.layer.group_send('room', {'type': 'typing_indicator'})
+        if user.id in self.stop_tasks:
+            self.stop_tasks[user.id].cancel()
+        self.stop_tasks[user.id] = asyncio.ensure_future(self.auto_stop())
+
+    async def auto_stop(self):
+        await asyncio.sleep(3)
+        await self.layer.group_send('room', {'type': 'typing_indicator'})
+
+    async def stop(self, user):
+        await self.layer.group_send('room', {'type': 'typing_indicator'})
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare typing-indicator frames per second delivered to a room's members "
+        "with per-event broadcasts vs. coalesced per-room snapshots."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=500)
+        parser.add_argument('--typists', type=int, default=10)
+        parser.add_argument('--rate', type=float, default=3.0, help='typing_start events per typist per second')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of simulated typing')
+        parser.add_argument('--redis', action='store_true', help='Use CHAT_REDIS_URL instead of the in-memory client')
+
+    def handle(self, *args, **options):
+        members = options['members']
+        duration = options['duration']
+
+        legacy_sends = asyncio.run(self.run_legacy(options))
+        coalesced_sends = asyncio.run(self.run_coalesced(options))
+
+        self.stdout.write(
+            f"{options['typists']} typists at {options['rate']}/s for {duration:.0f}s in a {members}-member room"
+        )
+        self.stdout.write(f"{'mode':<12} {'broadcasts':>11} {'frames':>10} {'frames/s':>10}")
+        for label, sends in (('per-event', legacy_sends), ('coalesced', coalesced_sends)):
+            frames = sends * members
+            self.stdout.write(f"{label:<12} {sends:>11} {frames:>10} {frames / duration:>10.0f}")
+
+    async def simulate(self, handler, options):
+        typists = [FakeUser(i) for i in range(options['typists'])]
+        interval = 1.0 / options['rate']
+
+        async def type_for(user):
+            deadline = time.monotonic() + options['duration']
+            # Stagger typists so their events don't all land on the same tick
+            await asyncio.sleep(random.uniform(0, interval))
+            while time.monotonic() < deadline:
+                await handler.start(user)
+                await asyncio.sleep(interval)
+            await handler.stop(user)
+
+        await asyncio.gather(*(type_for(user) for user in typists))
+
+    async def run_legacy(self, options):
+        layer = CountingLayer()
+        legacy = LegacyTyping(layer)
+        await self.simulate(legacy, options)
+        for task in legacy.stop_tasks.values():
+            task.cancel()
+        return layer.sends
+
+    async def run_coalesced(self, options):
+        from chat import typing_indicators
+        from chat.redis_client import InMemoryRedis, get_redis
+
+        redis = get_redis() if options['redis'] else InMemoryRedis()
+        layer = CountingLayer()
+        room = f"typingbench{random.randint(0, 1 << 30)}"
+
+        class Coalesced:
+            async def start(self, user):
+                await typing_indicators.start(redis, layer, room, user)
+
+            async def stop(self, user):
+                await typing_indicators.stop(redis, layer, room, user)
+
+        await self.simulate(Coalesced(), options)
+        # Let the final "nobody is typing" snapshot go out
+        await asyncio.sleep(typing_indicators.typing_interval() * 2)
+        return layer.sends
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_read_cursors(apps, schema_editor):
+    """
+    Seed last_read_message_id so unread counts stay close to what the old
+    receipt anti-join reported: the newest message the member has a receipt
+    for, otherwise the newest message sent before their last login.
+    """
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+    Message = apps.get_model('chat', 'Message')
+    MessageReadReceipt = apps.get_model('chat', 'MessageReadReceipt')
+
+    memberships = RoomMembership.objects.filter(
+        last_read_message_id__isnull=True
+    ).select_related('user').iterator(chunk_size=1000)
+
+    for membership in memberships:
+        cursor = MessageReadReceipt.objects.filter(
+            user_id=membership.user_id,
+            message__room_id=membership.room_id,
+        ).aggregate(cursor=Max('message_id'))['cursor']
+
+        if cursor is None and membership.user.last_login:
+            cursor = Message.objects.filter(
+                room_id=membership.room_id,
+                timestamp__lte=membership.user.last_login,
+            ).aggregate(cursor=Max('id'))['cursor']
+
+        if cursor is not None:
+            RoomMembership.objects.filter(pk=membership.pk).update(last_read_message_id=cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_roommembership_last_read_message_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='chat_messag_room_id_12c833_idx'),
+        ),
+        migrations.RunPython(backfill_read_cursors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+# File names are split on . _ - so "q3_report.pdf" matches a search for "report"
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce({row}content, '')), 'A') || "
+    "setweight(to_tsvector('simple', regexp_replace(coalesce({row}file_name, ''), '[._-]+', ' ', 'g')), 'B')"
+)
+
+CREATE_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION chat_message_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR_SQL.format(row='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chat_message_search_vector_trigger ON chat_message;
+CREATE TRIGGER chat_message_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF content, file_name ON chat_message
+    FOR EACH ROW EXECUTE FUNCTION chat_message_search_vector_update();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS chat_message_search_vector_trigger ON chat_message;
+DROP FUNCTION IF EXISTS chat_message_search_vector_update();
+"""
+
+BACKFILL_BATCH_SIZE = 50000
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_TRIGGER_SQL)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_TRIGGER_SQL)
+
+
+def backfill_search_vectors(apps, schema_editor):
+    """Fill search_vector for existing rows in id ranges, one commit per batch"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM chat_message")
+        start, last = cursor.fetchone()
+        while start <= last:
+            cursor.execute(
+                f"UPDATE chat_message SET search_vector = {SEARCH_VECTOR_SQL.format(row='')} "
+                "WHERE id >= %s AND id < %s AND search_vector IS NULL",
+                [start, start + BACKFILL_BATCH_SIZE],
+            )
+            start += BACKFILL_BATCH_SIZE
+
+
+class Migration(migrations.Migration):
+    # Backfill batches commit individually instead of holding one
+    # transaction (and row locks) across the whole message table
+    atomic = False
+
+    dependencies = [
+        ('chat', '0003_message_room_id_index_backfill_read_cursor'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, help_text='Full-text search vector over content and file name', null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+        # Built after the backfill so the GIN index is created in one pass
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='chat_messag_search__9be221_gin'),
+        ),
+    ]
@@ -1,7 +1,20 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 from django.core.cache import cache
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connections
+from django.db.models import BigIntegerField, Count, Exists, F, FloatField, IntegerField, Max, OuterRef, Prefetch, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+# Text search configuration used by the chat_message search_vector trigger
+# (migration 0004). 'simple' does no stemming, which suits mixed-language chat.
+MESSAGE_SEARCH_CONFIG = 'simple'
 
 class BaseModel(models.Model):
     """Abstract base model with common fields"""
@@ -12,6 +25,57 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
 
+class ChatRoomQuerySet(models.QuerySet):
+    def with_member_info(self, user):
+        """
+        Annotate everything ChatRoomSerializer needs per room so a list
+        serializes without per-row queries: member_count, the user's
+        user_role/is_member, and the last visible message's fields.
+        """
+        members = RoomMembership.objects.filter(room=OuterRef('pk'))
+        own_membership = members.filter(user=user)
+        active_members = members.filter(is_banned=False).order_by().values('room').annotate(
+            count=Count('id')
+        ).values('count')
+        last_message = Message.objects.filter(
+            room=OuterRef('pk'), is_deleted=False
+        ).order_by('-timestamp')
+
+        return self.annotate(
+            member_count=Coalesce(Subquery(active_members, output_field=IntegerField()), 0),
+            user_role=Subquery(own_membership.values('role')[:1]),
+            is_member=Exists(own_membership.filter(is_banned=False)),
+            last_message_content=Subquery(last_message.values('content')[:1]),
+            last_message_timestamp=Subquery(last_message.values('timestamp')[:1]),
+            last_message_type=Subquery(last_message.values('message_type')[:1]),
+            last_message_first_name=Subquery(last_message.values('user__first_name')[:1]),
+            last_message_last_name=Subquery(last_message.values('user__last_name')[:1]),
+        )
+
+    def with_unread_count(self, user):
+        """
+        Annotate `unread_count` for `user`: messages from others past the
+        member's read cursor, counted as an index range on (room, id).
+        Non-members get 0.
+        """
+        read_cursor = RoomMembership.objects.filter(
+            room=OuterRef('pk'), user=user
+        ).annotate(
+            cursor=Coalesce('last_read_message_id', Value(0), output_field=BigIntegerField())
+        ).values('cursor')[:1]
+
+        unread = Message.objects.filter(
+            room=OuterRef('pk'),
+            id__gt=OuterRef('read_cursor'),
+            is_deleted=False,
+        ).exclude(user=user).order_by().values('room').annotate(
+            count=Count('id')
+        ).values('count')
+
+        return self.annotate(read_cursor=Subquery(read_cursor)).annotate(
+            unread_count=Coalesce(Subquery(unread), 0)
+        )
+
 class ChatRoom(BaseModel):
     PRIVACY_LEVELS = [
         ('public', 'Public'),
@@ -35,6 +99,8 @@ class ChatRoom(BaseModel):
     require_approval = models.BooleanField(default=False)
     slow_mode = models.IntegerField(default=0)  # seconds between messages
     
+    objects = ChatRoomQuerySet.as_manager()
+    
     class Meta:
         indexes = [
             models.Index(fields=['name', 'is_active']),
@@ -72,6 +138,9 @@ class RoomMembership(BaseModel):
     is_banned = models.BooleanField(default=False)
     banned_until = models.DateTimeField(null=True, blank=True)
     notifications = models.BooleanField(default=True)
+    # High-water mark of what the member has read; everything in the room up
+    # to and including this message id counts as read
+    last_read_message_id = models.BigIntegerField(null=True, blank=True)
     
     class Meta:
         unique_together = ['user', 'room']
@@ -80,6 +149,21 @@ class RoomMembership(BaseModel):
             models.Index(fields=['room', 'is_banned']),
         ]
     
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.last_read_message_id is None:
+            self.mark_history_read()
+        super().save(*args, **kwargs)
+    
+    def mark_history_read(self):
+        """
+        Move the read cursor to the room's newest message, so a member who
+        (re)joins doesn't see the whole history as unread. Migration 0003
+        seeded existing memberships the same way. Does not save.
+        """
+        self.last_read_message_id = Message.objects.filter(
+            room_id=self.room_id
+        ).aggregate(cursor=Max('id'))['cursor']
+    
     def can_moderate(self):
         return self.role in ['owner', 'admin', 'moderator']
     
@@ -92,6 +176,48 @@ class RoomMembership(BaseModel):
             return False
         return True
 
+class MessageQuerySet(models.QuerySet):
+    def search(self, text):
+        """
+        Filter to messages matching `text` and annotate a relevance `rank`.
+
+        On PostgreSQL this matches the GIN-indexed search_vector with
+        websearch syntax (quoted phrases, OR, -exclusions) and ranks with
+        ts_rank. Other backends fall back to a substring match with rank 0,
+        which leaves results in id (recency) order.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(text, config=MESSAGE_SEARCH_CONFIG, search_type='websearch')
+            # ts_rank returns float4; cast so the rank round-trips exactly
+            # through keyset cursors (see chat.pagination.search_page)
+            return self.filter(search_vector=query).annotate(
+                rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+            )
+        return self.filter(
+            Q(content__icontains=text) | Q(file_name__icontains=text)
+        ).annotate(rank=Value(0.0, output_field=FloatField()))
+
+    def for_serializer(self, user):
+        """
+        Load everything MessageSerializer reads per message up front: sender
+        and reply sender profiles, the room, the attachment blob (thumbnails),
+        reactions, and only `user`'s own read receipt (as `own_read_receipts`)
+        instead of every reader's.
+        The search_vector column is never serialized, so it is not fetched.
+        """
+        return self.select_related(
+            'user', 'user__chat_profile', 'room', 'file_blob',
+            'reply_to', 'reply_to__user', 'reply_to__user__chat_profile',
+        ).prefetch_related(
+            Prefetch('reactions', queryset=Reaction.objects.only('id', 'message_id', 'reaction_type')),
+            Prefetch(
+                'read_receipts',
+                queryset=MessageReadReceipt.objects.filter(user=user).only('id', 'message_id'),
+                to_attr='own_read_receipts',
+            ),
+        ).defer('search_vector')
+
+
 class Message(BaseModel):
     MESSAGE_TYPES = [
         ('text', 'Text'),
@@ -111,6 +237,11 @@ class Message(BaseModel):
     file_name = models.CharField(max_length=255, blank=True, null=True)
     file_size = models.IntegerField(blank=True, null=True)
     file_type = models.CharField(max_length=100, blank=True, null=True)
+    # Content-addressed copy of the attachment (see FileBlob); file_url points at it
+    file_blob = models.ForeignKey('FileBlob', on_delete=models.PROTECT, null=True, blank=True, related_name='messages')
+    # Filled in by the thumbnail pipeline (chat.thumbnails) for images
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
     
     # Threading
     reply_to = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='replies')
@@ -127,13 +258,25 @@ class Message(BaseModel):
     timestamp = models.DateTimeField(auto_now_add=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     
+    # Maintained by a database trigger on PostgreSQL (see migration 0004)
+    search_vector = SearchVectorField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Full-text search vector over content and file name"
+    )
+    
+    objects = MessageQuerySet.as_manager()
+    
     class Meta:
         ordering = ['timestamp']
         indexes = [
             models.Index(fields=['room', 'timestamp']),
+            models.Index(fields=['room', 'id']),  # unread counts: id > read cursor
             models.Index(fields=['user', 'timestamp']),
             models.Index(fields=['thread', 'timestamp']),
             models.Index(fields=['is_deleted', 'timestamp']),
+            GinIndex(fields=['search_vector']),
         ]
     
     def __str__(self):
@@ -150,6 +293,7 @@ class Message(BaseModel):
         self.file_size = None
         self.file_type = None
         self.save()
+        self._invalidate_room_snapshot()
     
     def edit_message(self, new_content):
         """Edit message with version tracking"""
@@ -164,6 +308,32 @@ class Message(BaseModel):
         self.is_edited = True
         self.edited_at = timezone.now()
         self.save()
+        self._invalidate_room_snapshot()
+
+    def readers(self):
+        """
+        Memberships whose read cursor has reached this message, annotated
+        with `read_at`: the earliest receipt at or after it in the room.
+        Receipts are only written for the newest message of each read
+        report, so they can't say who has read a message on their own.
+        """
+        first_receipt = MessageReadReceipt.objects.filter(
+            user_id=OuterRef('user_id'),
+            message__room_id=self.room_id,
+            message_id__gte=self.id,
+        ).order_by('read_at').values('read_at')[:1]
+
+        return RoomMembership.objects.filter(
+            room_id=self.room_id, last_read_message_id__gte=self.id
+        ).select_related('user').annotate(
+            read_at=Subquery(first_receipt)
+        ).order_by(F('read_at').desc(nulls_last=True), '-id')
+
+    def _invalidate_room_snapshot(self):
+        # The cached WebSocket connect snapshot is only versioned by the
+        # newest message id, so changes to existing messages must drop it
+        from .snapshots import invalidate_room_snapshot
+        invalidate_room_snapshot(self.room_id)
 
 class MessageEditHistory(BaseModel):
     """Track message edit history"""
@@ -258,4 +428,187 @@ class BanHistory(BaseModel):
     class Meta:
         indexes = [
             models.Index(fields=['user', 'room', 'is_active']),
-        ]
\ No newline at end of file
+        ]
+
+class FileBlob(BaseModel):
+    """
+    One stored copy of an attachment's bytes, keyed by SHA-256. Every message
+    sharing the same content points at the same blob, so duplicates cost no
+    storage. `ref_count` counts those references (plus uploads handed out
+    without a room, which are never released); chat_cleanup_uploads deletes
+    blobs that have stayed unreferenced past the upload expiry.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100)
+    path = models.CharField(max_length=255)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    # Images only, set by chat.thumbnails: {"<size>": storage path} per size
+    # bucket. NULL means not processed yet; {} means no thumbnails apply.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnails = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
+    @property
+    def url(self):
+        from django.core.files.storage import default_storage
+        return default_storage.url(self.path)
+
+    def thumbnail_urls(self):
+        from django.core.files.storage import default_storage
+        return {size: default_storage.url(path) for size, path in (self.thumbnails or {}).items()}
+
+    def is_visible_to(self, user):
+        """Whether `user` could already see this content in some message"""
+        visible = Q(user=user) | Q(room__roommembership__user=user, room__roommembership__is_banned=False)
+        return self.messages.filter(visible).exists() or self.archived_messages.filter(visible).exists()
+
+    def add_reference(self):
+        FileBlob.objects.filter(pk=self.pk).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender='chat.ArchivedMessage')
+def release_file_blob(sender, instance, **kwargs):
+    """
+    Drop the blob reference of a hard-deleted message (soft deletes keep it).
+    Moving a message to the archive hands its reference to the archived row
+    (see chat.archive).
+    """
+    if instance.file_blob_id:
+        FileBlob.objects.filter(pk=instance.file_blob_id, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1, updated_at=timezone.now()
+        )
+
+
+class FileUpload(BaseModel):
+    """
+    A resumable chunked upload (see chat.uploads). Chunks are appended to a
+    staging file and `offset` counts the bytes received so far; a client that
+    lost its connection asks for the offset and continues from there.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('complete', 'Complete'),
+        ('aborted', 'Aborted'),
+    ]
+
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_uploads')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, null=True, blank=True, related_name='uploads')
+    file_name = models.CharField(max_length=255)
+    file_size = models.BigIntegerField()
+    file_type = models.CharField(max_length=100)
+    description = models.TextField(blank=True)
+    offset = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    file_url = models.URLField(blank=True, null=True)
+    message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.file_size})"
+
+
+class ArchivedMessageQuerySet(models.QuerySet):
+    def for_serializer(self, user):
+        """Same loading as MessageQuerySet.for_serializer, for archived rows"""
+        return self.select_related(
+            'user', 'user__chat_profile', 'room', 'file_blob',
+            'reply_to', 'reply_to__user', 'reply_to__user__chat_profile',
+        ).prefetch_related(
+            Prefetch('reactions', queryset=ArchivedReaction.objects.only('id', 'message_id', 'reaction_type')),
+            Prefetch(
+                'read_receipts',
+                queryset=ArchivedReadReceipt.objects.filter(user=user).only('id', 'message_id'),
+                to_attr='own_read_receipts',
+            ),
+        )
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of chat_message by `manage.py chat_archive_messages`
+    once it is older than CHAT_ARCHIVE_AFTER_DAYS. It keeps its original id,
+    so history cursors stay valid, and has the attributes MessageSerializer
+    reads; history pages past the hot window read through to this table
+    (see chat.pagination.keyset_page). Archived messages are read-only.
+
+    reply_to and thread keep the original ids without a constraint, since the
+    target may be archived too (reply_to then serializes without
+    reply_to_data). Edit history is folded into `edit_history`.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archived_messages')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_messages')
+    content = models.TextField()
+    message_type = models.CharField(max_length=10, choices=Message.MESSAGE_TYPES, default='text')
+
+    file_url = models.URLField(blank=True, null=True)
+    file_name = models.CharField(max_length=255, blank=True, null=True)
+    file_size = models.IntegerField(blank=True, null=True)
+    file_type = models.CharField(max_length=100, blank=True, null=True)
+    file_blob = models.ForeignKey(FileBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='archived_messages')
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+
+    reply_to = models.ForeignKey(
+        Message, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+        null=True, blank=True, related_name='+'
+    )
+    thread = models.ForeignKey(
+        Message, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+        null=True, blank=True, related_name='+'
+    )
+
+    is_edited = models.BooleanField(default=False)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    edit_history = models.JSONField(default=list, blank=True)
+    is_deleted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    deleted_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    timestamp = models.DateTimeField()
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ArchivedMessageQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp']),
+            models.Index(fields=['user', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email}: {self.content[:50]} (archived)"
+
+
+class ArchivedReadReceipt(BaseModel):
+    message = models.ForeignKey(ArchivedMessage, on_delete=models.CASCADE, related_name='read_receipts')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    read_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['message', 'user']
+
+
+class ArchivedReaction(BaseModel):
+    message = models.ForeignKey(ArchivedMessage, on_delete=models.CASCADE, related_name='reactions')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    reaction_type = models.CharField(max_length=10, choices=Reaction.REACTION_TYPES)
+
+    class Meta:
+        unique_together = ['message', 'user']
@@ -0,0 +1,208 @@
+# chat/pagination.py
+import base64
+import binascii
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .archive import archive_cutoff
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(message, newer=False):
+    """Opaque cursor pointing just past `message` in (timestamp, id) order"""
+    raw = f"{'n' if newer else 'o'}|{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (newer, timestamp, id) for a cursor made by encode_cursor"""
+    try:
+        direction, timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        if direction not in ('n', 'o'):
+            raise ValueError(direction)
+        return direction == 'n', datetime.fromisoformat(timestamp), int(message_id)
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def _seek(queryset, position, newer, count):
+    """Up to `count` messages strictly after/before `position` (timestamp, id), nearest first"""
+    if position:
+        timestamp, message_id = position
+        if newer:
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+            )
+        else:
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+            )
+    ordering = ('timestamp', 'id') if newer else ('-timestamp', '-id')
+    return list(queryset.order_by(*ordering)[:count])
+
+
+def keyset_page(queryset, cursor=None, limit=50, archive=None):
+    """
+    One page of messages by keyset on (timestamp, id) rather than OFFSET.
+
+    Without a cursor this is the newest `limit` messages. An "older" cursor
+    continues strictly before its message and a "newer" cursor strictly
+    after it, so rows inserted while a client scrolls never shift a page.
+    With the queryset filtered to one room, the seek is a range scan on the
+    (room, timestamp) index. Returns (messages newest first, next cursor for
+    older messages or None, previous cursor for newer messages or None).
+
+    `archive` is the same filter over ArchivedMessage. It is only read for
+    pages reaching past the archive cutoff, and merged in by the same key,
+    so cursors carry on across both tables.
+    """
+    newer = False
+    position = None
+    if cursor:
+        newer, timestamp, message_id = decode_cursor(cursor)
+        position = (timestamp, message_id)
+
+    messages = _seek(queryset, position, newer, limit + 1)
+
+    if archive is not None:
+        cutoff = archive_cutoff()
+        if newer:
+            reaches_archive = position[0] < cutoff
+        else:
+            reaches_archive = len(messages) <= limit or messages[-1].timestamp < cutoff
+        if reaches_archive:
+            messages += _seek(archive, position, newer, limit + 1)
+            messages.sort(key=lambda m: (m.timestamp, m.id), reverse=not newer)
+            messages = messages[:limit + 1]
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    if newer:
+        messages.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = bool(cursor), has_more
+
+    if not messages:
+        # Nothing past the cursor in this direction; hand the same position back
+        # so a client polling for newer messages can keep using it
+        return messages, None, cursor if newer else None
+
+    next_cursor = encode_cursor(messages[-1]) if has_older else None
+    previous_cursor = encode_cursor(messages[0], newer=True) if has_newer else None
+    return messages, next_cursor, previous_cursor
+
+
+def encode_search_cursor(message):
+    """Cursor just past `message` in (rank, id) order; rank comes from Message.objects.search"""
+    raw = f"{message.rank!r}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def search_page(queryset, cursor=None, limit=50):
+    """
+    Keyset page of ranked search results, best match first.
+
+    Ranks are recomputed identically on every request, so (rank, id) is a
+    stable key and later pages never repeat or skip rows. Returns
+    (messages, next cursor or None).
+    """
+    if cursor:
+        try:
+            rank, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            rank, message_id = float(rank), int(message_id)
+        except (binascii.Error, UnicodeError, ValueError) as e:
+            raise InvalidCursor(cursor) from e
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=message_id))
+
+    messages = list(queryset.order_by('-rank', '-id')[:limit + 1])
+    next_cursor = encode_search_cursor(messages[limit - 1]) if len(messages) > limit else None
+    return messages[:limit], next_cursor
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination for message history (see keyset_page).
+
+    Pages run newest first; `next` walks back in time and `previous` towards
+    the present. Requests that pass `offset` keep the old LimitOffset
+    behaviour so existing clients still work, and so do list requests with
+    `ordering` on views with an OrderingFilter: keyset pages can only run
+    newest first, which would silently ignore it.
+    """
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None, archive=None):
+        """`archive`: matching ArchivedMessage queryset to read through to (see keyset_page)"""
+        if 'offset' in request.query_params or self.ordering_requested(request, view):
+            self.legacy = LimitOffsetPagination()
+            return self.legacy.paginate_queryset(queryset, request, view)
+        self.legacy = None
+
+        self.request = request
+        try:
+            self.messages, self.next_cursor, self.previous_cursor = keyset_page(
+                queryset,
+                cursor=request.query_params.get(self.cursor_query_param),
+                limit=self.get_page_size(request),
+                archive=archive,
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.messages
+
+    @staticmethod
+    def ordering_requested(request, view):
+        """Whether the view's OrderingFilter applied a client-chosen ?ordering= to the queryset"""
+        if view is None or getattr(view, 'action', None) != 'list':
+            return False
+        if not any(issubclass(backend, OrderingFilter) for backend in getattr(view, 'filter_backends', [])):
+            return False
+        return bool(request.query_params.get(OrderingFilter.ordering_param))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'offset')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_link(self.next_cursor)),
+            ('previous', self.get_link(self.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,106 @@
+# chat/presence.py
+import time
+
+from django.conf import settings
+
+# Presence lives in redis as sorted sets scored by an expiry deadline (unix
+# seconds). Every open socket refreshes its deadline on a heartbeat, so a
+# worker that dies without running disconnect() simply stops refreshing and
+# its sockets age out after CHAT_PRESENCE_TTL instead of staying "online".
+#
+#   presence:room:<room_id>                user_id -> deadline
+#   presence:room:<room_id>:user:<user_id> channel -> deadline (the user's sockets in the room)
+#   presence:user:<user_id>                "<room_id>:<channel>" -> deadline (all of the user's sockets)
+#
+# Counting a room is a ZCOUNT over live deadlines, independent of how many
+# users have ever been in it.
+
+
+def presence_ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+
+
+def heartbeat_interval():
+    return getattr(settings, 'CHAT_PRESENCE_HEARTBEAT_INTERVAL', 20)
+
+
+def _room_key(room_id):
+    return f"presence:room:{room_id}"
+
+
+def _room_user_key(room_id, user_id):
+    return f"presence:room:{room_id}:user:{user_id}"
+
+
+def _user_key(user_id):
+    return f"presence:user:{user_id}"
+
+
+async def _refresh(redis, room_id, user_id, channel_name, now):
+    ttl = presence_ttl()
+    deadline = now + ttl
+    # Key expiry is a backstop for rooms and users nobody touches again
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zadd(_room_user_key(room_id, user_id), {channel_name: deadline})
+        pipe.expire(_room_user_key(room_id, user_id), ttl)
+        pipe.zadd(_room_key(room_id), {str(user_id): deadline})
+        pipe.expire(_room_key(room_id), ttl)
+        pipe.zadd(_user_key(user_id), {f"{room_id}:{channel_name}": deadline})
+        pipe.expire(_user_key(user_id), ttl)
+        await pipe.execute()
+
+
+async def join(redis, room_id, user_id, channel_name):
+    """
+    Register a socket. Returns (joined_room, came_online): whether this is the
+    user's first live socket in the room, and anywhere at all.
+    """
+    now = time.time()
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zcount(_room_user_key(room_id, user_id), now, '+inf')
+        pipe.zcount(_user_key(user_id), now, '+inf')
+        in_room, anywhere = await pipe.execute()
+
+    await _refresh(redis, room_id, user_id, channel_name, now)
+    return not in_room, not anywhere
+
+
+async def heartbeat(redis, room_id, user_id, channel_name):
+    """Push a live socket's deadline forward and drop expired entries in the room"""
+    now = time.time()
+    await _refresh(redis, room_id, user_id, channel_name, now)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zremrangebyscore(_room_key(room_id), '-inf', now)
+        pipe.zremrangebyscore(_room_user_key(room_id, user_id), '-inf', now)
+        pipe.zremrangebyscore(_user_key(user_id), '-inf', now)
+        await pipe.execute()
+
+
+async def leave(redis, room_id, user_id, channel_name):
+    """
+    Unregister a socket. Returns (left_room, went_offline) for the user's last
+    live socket in the room and anywhere.
+
+    Not atomic: a socket joining concurrently from another tab may be dropped
+    from the room set, and reappears on its next heartbeat.
+    """
+    now = time.time()
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zrem(_room_user_key(room_id, user_id), channel_name)
+        pipe.zrem(_user_key(user_id), f"{room_id}:{channel_name}")
+        pipe.zcount(_room_user_key(room_id, user_id), now, '+inf')
+        pipe.zcount(_user_key(user_id), now, '+inf')
+        _, _, in_room, anywhere = await pipe.execute()
+
+    if not in_room:
+        await redis.zrem(_room_key(room_id), str(user_id))
+    return not in_room, not anywhere
+
+
+async def online_count(redis, room_id):
+    """Users with at least one live socket in the room"""
+    return await redis.zcount(_room_key(room_id), time.time(), '+inf')
+
+
+async def online_user_ids(redis, room_id):
+    return await redis.zrangebyscore(_room_key(room_id), time.time(), '+inf')
@@ -0,0 +1,204 @@
+# chat/rate_limit.py
+import logging
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from django.conf import settings
+
+from .redis_client import InMemoryRedis, RedisError, get_redis, get_sync_redis
+
+logger = logging.getLogger('websockets')
+
+# Token buckets shared by the WebSocket consumer and the REST views. A bucket
+# holds up to `capacity` tokens and refills at `refill_rate` tokens per
+# second; an action costs one token from every bucket it touches. A check
+# over several buckets (user, room, slow mode) is all-or-nothing: if any
+# bucket is short, none is charged, so a message rejected by slow mode does
+# not also eat into the user's per-minute allowance.
+#
+#   ratelimit:send:user:<user_id>            messages sent anywhere
+#   ratelimit:send:room:<room_id>            messages sent to the room by anyone
+#   ratelimit:slow:<room_id>:<user_id>       one message per slow_mode seconds
+#   ratelimit:socket:user:<user_id>          WebSocket frames of any type
+#   ratelimit:connect:user:<user_id>         WebSocket connection attempts
+#   throttle_<scope>_<user_id>               DRF throttles (see chat.throttles)
+#
+# With redis the check is one Lua script, using the server clock so workers
+# agree on refill times. The in-memory fallback keeps buckets per process.
+
+Bucket = namedtuple('Bucket', ['key', 'capacity', 'refill_rate'])
+Decision = namedtuple('Decision', ['allowed', 'retry_after'])
+
+ALLOWED = Decision(True, 0.0)
+
+# KEYS: bucket keys; ARGV: cost, then capacity and refill rate for each key
+TAKE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = capacity
+    if state[1] then
+        tokens = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+    end
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+
+if wait > 0 then
+    return {0, tostring(wait)}
+end
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local tokens = levels[i] - cost
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    -- A bucket that has refilled is the same as a missing one
+    redis.call('PEXPIRE', key, math.ceil((capacity - tokens) / rate * 1000) + 1000)
+end
+return {1, '0'}
+"""
+
+_scripts = weakref.WeakKeyDictionary()
+
+
+class _MemoryBuckets:
+    """Process-local buckets behind a lock, shared by async and sync callers"""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated, full_at)
+
+    def take(self, buckets, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for bucket in buckets:
+                tokens, updated, _ = self._buckets.get(bucket.key, (bucket.capacity, now, now))
+                tokens = min(bucket.capacity, tokens + (now - updated) * bucket.refill_rate)
+                levels.append(tokens)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / bucket.refill_rate)
+            if wait:
+                return Decision(False, wait)
+
+            for bucket, tokens in zip(buckets, levels):
+                tokens -= cost
+                full_at = now + (bucket.capacity - tokens) / bucket.refill_rate
+                self._buckets[bucket.key] = (tokens, now, full_at)
+
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        return ALLOWED
+
+
+_memory_buckets = _MemoryBuckets()
+
+
+def _script_args(buckets, cost):
+    args = [cost]
+    for bucket in buckets:
+        args.extend((bucket.capacity, bucket.refill_rate))
+    return [bucket.key for bucket in buckets], args
+
+
+def _script_for(client):
+    script = _scripts.get(client)
+    if script is None:
+        script = client.register_script(TAKE_SCRIPT)
+        _scripts[client] = script
+    return script
+
+
+async def take(buckets, cost=1):
+    """Charge `cost` tokens from every bucket, or from none. Fails open on redis errors."""
+    if not buckets:
+        return ALLOWED
+
+    client = get_redis()
+    if isinstance(client, InMemoryRedis):
+        return _memory_buckets.take(buckets, cost)
+
+    keys, args = _script_args(buckets, cost)
+    try:
+        allowed, wait = await _script_for(client)(keys=keys, args=args)
+    except RedisError as e:
+        logger.warning(f"Rate limit check failed, allowing: {e}")
+        return ALLOWED
+    return Decision(bool(int(allowed)), float(wait))
+
+
+def take_sync(buckets, cost=1):
+    """Blocking variant of take() for DRF views and serializers"""
+    if not buckets:
+        return ALLOWED
+
+    client = get_sync_redis()
+    if client is None:
+        return _memory_buckets.take(buckets, cost)
+
+    keys, args = _script_args(buckets, cost)
+    try:
+        allowed, wait = _script_for(client)(keys=keys, args=args)
+    except RedisError as e:
+        logger.warning(f"Rate limit check failed, allowing: {e}")
+        return ALLOWED
+    return Decision(bool(int(allowed)), float(wait))
+
+
+def per_minute(key, limit, burst):
+    """Bucket allowing `limit` actions per minute with bursts of up to `burst`"""
+    return Bucket(key, max(burst, 1), limit / 60.0)
+
+
+def message_buckets(user_id, room_id, slow_mode=0, is_moderator=False):
+    """Buckets charged for sending one message, over WebSocket or REST"""
+    buckets = [
+        per_minute(
+            f"ratelimit:send:user:{user_id}",
+            getattr(settings, 'CHAT_RATE_LIMIT', 30),
+            getattr(settings, 'CHAT_RATE_LIMIT_BURST', 10),
+        ),
+        per_minute(
+            f"ratelimit:send:room:{room_id}",
+            getattr(settings, 'CHAT_ROOM_RATE_LIMIT', 300),
+            getattr(settings, 'CHAT_ROOM_RATE_LIMIT_BURST', 50),
+        ),
+    ]
+    # Moderators are exempt from slow mode, as they were from the old throttle
+    if slow_mode and slow_mode > 0 and not is_moderator:
+        buckets.append(Bucket(f"ratelimit:slow:{room_id}:{user_id}", 1, 1.0 / slow_mode))
+    return buckets
+
+
+def socket_event_buckets(user_id):
+    """Bucket charged for every WebSocket frame (typing, receipts, history, ...)"""
+    return [per_minute(
+        f"ratelimit:socket:user:{user_id}",
+        getattr(settings, 'CHAT_SOCKET_EVENT_RATE_LIMIT', 120),
+        getattr(settings, 'CHAT_SOCKET_EVENT_BURST', 30),
+    )]
+
+
+def connection_buckets(user_id):
+    limit = getattr(settings, 'CHAT_CONNECTION_RATE_LIMIT', 10)
+    return [per_minute(f"ratelimit:connect:user:{user_id}", limit, limit)]
+
+
+def retry_message(decision):
+    """User-facing error for a rejected action"""
+    return f"Rate limit exceeded. Try again in {max(1, round(decision.retry_after))} seconds"
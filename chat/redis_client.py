@@ -0,0 +1,242 @@
+# chat/redis_client.py
+import asyncio
+import logging
+import time
+import weakref
+
+from django.conf import settings
+
+try:
+    import redis
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # redis is optional in local development
+    redis = None
+    aioredis = None
+
+    class RedisError(Exception):
+        pass
+
+logger = logging.getLogger('websockets')
+
+# One client (and therefore one connection pool) per event loop. Async redis
+# connections are bound to the loop that created them, so a plain module
+# global would break under test runners that spin up a fresh loop per test.
+_clients = weakref.WeakKeyDictionary()
+_memory_client = None
+_sync_client = None
+_override = None
+
+
+class _InMemoryPipeline:
+    """Queues commands and runs them in order on execute(), like a non-transactional pipeline"""
+
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        calls, self._calls = self._calls, []
+        return [await method(*args, **kwargs) for method, args, kwargs in calls]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._calls = []
+
+
+class InMemoryRedis:
+    """
+    Minimal in-process stand-in for the async redis client.
+
+    Implements only the commands the chat app uses. State is per process, so
+    it is suitable for tests and single-worker development only.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+
+    def _purge(self, key):
+        deadline = self._expiry.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+
+    def _get(self, key, default=None):
+        self._purge(key)
+        return self._data.get(key, default)
+
+    async def ping(self):
+        return True
+
+    async def get(self, key):
+        return self._get(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and self._get(key) is not None:
+            return None
+        self._data[key] = value
+        self._expiry.pop(key, None)
+        if ex:
+            self._expiry[key] = time.monotonic() + ex
+        return True
+
+    async def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._get(key) is not None:
+                removed += 1
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return removed
+
+    async def incr(self, key, amount=1):
+        value = int(self._get(key, 0)) + amount
+        self._data[key] = value
+        return value
+
+    async def expire(self, key, seconds):
+        if self._get(key) is None:
+            return False
+        self._expiry[key] = time.monotonic() + seconds
+        return True
+
+    async def sadd(self, key, *members):
+        self._purge(key)
+        current = self._data.setdefault(key, set())
+        before = len(current)
+        current.update(str(m) for m in members)
+        return len(current) - before
+
+    async def srem(self, key, *members):
+        current = self._get(key)
+        if not current:
+            return 0
+        before = len(current)
+        current.difference_update(str(m) for m in members)
+        return before - len(current)
+
+    async def scard(self, key):
+        return len(self._get(key) or ())
+
+    async def smembers(self, key):
+        return set(self._get(key) or ())
+
+    async def zadd(self, key, mapping):
+        self._purge(key)
+        current = self._data.setdefault(key, {})
+        added = sum(1 for member in mapping if str(member) not in current)
+        current.update((str(member), float(score)) for member, score in mapping.items())
+        return added
+
+    async def zrem(self, key, *members):
+        current = self._get(key)
+        if not current:
+            return 0
+        return sum(1 for member in members if current.pop(str(member), None) is not None)
+
+    async def zscore(self, key, member):
+        return (self._get(key) or {}).get(str(member))
+
+    async def zcard(self, key):
+        return len(self._get(key) or ())
+
+    async def zcount(self, key, min, max):
+        low, high = float(min), float(max)
+        return sum(1 for score in (self._get(key) or {}).values() if low <= score <= high)
+
+    async def zrangebyscore(self, key, min, max):
+        low, high = float(min), float(max)
+        items = sorted((score, member) for member, score in (self._get(key) or {}).items())
+        return [member for score, member in items if low <= score <= high]
+
+    async def zremrangebyscore(self, key, min, max):
+        current = self._get(key)
+        if not current:
+            return 0
+        low, high = float(min), float(max)
+        doomed = [member for member, score in current.items() if low <= score <= high]
+        for member in doomed:
+            del current[member]
+        return len(doomed)
+
+    def pipeline(self, transaction=True):
+        return _InMemoryPipeline(self)
+
+    async def close(self):
+        return None
+
+
+def _use_memory():
+    url = getattr(settings, 'CHAT_REDIS_URL', '')
+    return not url or url.startswith('memory://') or aioredis is None
+
+
+def _pool_options():
+    # Blocking pools: when all connections are busy a caller waits up to
+    # `timeout` for one to come back (then gets a ConnectionError, a
+    # RedisError) instead of failing at once with "Too many connections"
+    return {
+        'max_connections': getattr(settings, 'CHAT_REDIS_MAX_CONNECTIONS', 50),
+        'timeout': getattr(settings, 'CHAT_REDIS_POOL_TIMEOUT', 5),
+        'decode_responses': True,
+        'socket_connect_timeout': 5,
+        'socket_timeout': 5,
+    }
+
+
+def _build_client():
+    pool = aioredis.BlockingConnectionPool.from_url(settings.CHAT_REDIS_URL, **_pool_options())
+    return aioredis.Redis(connection_pool=pool)
+
+
+def get_redis():
+    """Return the shared async redis client for the running event loop"""
+    global _memory_client
+    if _override is not None:
+        return _override
+
+    if _use_memory():
+        if _memory_client is None:
+            if aioredis is None:
+                logger.warning("redis package not installed, using in-memory storage")
+            _memory_client = InMemoryRedis()
+        return _memory_client
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _build_client()
+        _clients[loop] = client
+    return client
+
+
+def get_sync_redis():
+    """
+    Return the shared blocking redis client for code outside the event loop
+    (DRF views), or None when the chat app runs on the in-memory fallback.
+    """
+    global _sync_client
+    if _override is not None or _use_memory():
+        return None
+
+    if _sync_client is None:
+        pool = redis.BlockingConnectionPool.from_url(settings.CHAT_REDIS_URL, **_pool_options())
+        _sync_client = redis.Redis(connection_pool=pool)
+    return _sync_client
+
+
+def set_redis_client(client):
+    """Install a process-wide client (e.g. InMemoryRedis in tests); None restores the default"""
+    global _override
+    _override = client
@@ -2,7 +2,9 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.core.cache import cache
+from rest_framework.exceptions import Throttled
 from .models import *
+from . import rate_limit
 
 User = get_user_model()
 
@@ -70,7 +72,12 @@ class ChatRoomSerializer(DynamicFieldsModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'last_activity']
     
+    # The get_* methods below read annotations from
+    # ChatRoomQuerySet.with_member_info when present (list views) and only
+    # fall back to per-room queries for bare instances.
     def get_member_count(self, obj):
+        if hasattr(obj, 'member_count'):
+            return obj.member_count
         try:
             return obj.roommembership_set.filter(is_banned=False).count()
         except Exception:
@@ -83,6 +90,8 @@ class ChatRoomSerializer(DynamicFieldsModelSerializer):
             return 0
     
     def get_user_role(self, obj):
+        if hasattr(obj, 'user_role'):
+            return obj.user_role
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             try:
@@ -93,6 +102,8 @@ class ChatRoomSerializer(DynamicFieldsModelSerializer):
         return None
     
     def get_is_member(self, obj):
+        if hasattr(obj, 'is_member'):
+            return obj.is_member
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             try:
@@ -102,28 +113,31 @@ class ChatRoomSerializer(DynamicFieldsModelSerializer):
         return False
     
     def get_unread_count(self, obj):
+        # Annotated by ChatRoomQuerySet.with_unread_count in list views
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             try:
-                # Cache this for performance
-                cache_key = f"unread_{obj.id}_{request.user.id}"
-                unread = cache.get(cache_key)
-                if unread is None:
-                    # Use a safe default for last_login
-                    last_login = request.user.last_login or timezone.now() - timedelta(days=365)
-                    unread = Message.objects.filter(
-                        room=obj,
-                        timestamp__gt=last_login,
-                    ).exclude(
-                        read_receipts__user=request.user
-                    ).exclude(user=request.user).count()
-                    cache.set(cache_key, unread, 60)  # Cache for 1 minute
-                return unread
+                return ChatRoom.objects.filter(pk=obj.pk).with_unread_count(
+                    request.user
+                ).values_list('unread_count', flat=True).first() or 0
             except Exception:
                 return 0
         return 0
     
     def get_last_message(self, obj):
+        if hasattr(obj, 'last_message_timestamp'):
+            if obj.last_message_timestamp is None:
+                return None
+            content = obj.last_message_content or ''
+            user_name = f"{obj.last_message_first_name or ''} {obj.last_message_last_name or ''}".strip()
+            return {
+                'content': content[:100] + '...' if len(content) > 100 else content,
+                'timestamp': obj.last_message_timestamp,
+                'user_name': user_name,
+                'message_type': obj.last_message_type
+            }
         try:
             last_msg = obj.messages.filter(is_deleted=False).order_by('-timestamp').first()
             if last_msg:
@@ -217,21 +231,34 @@ class MessageSerializer(DynamicFieldsModelSerializer):
     reactions_summary = serializers.SerializerMethodField()
     can_edit = serializers.SerializerMethodField()
     can_delete = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = [
             'id', 'room', 'room_name', 'room_title', 'user', 'content', 'message_type',
-            'file_url', 'file_name', 'file_size', 'file_type', 'reply_to',
+            'file_url', 'file_name', 'file_size', 'file_type', 'image_width',
+            'image_height', 'thumbnails', 'reply_to',
             'reply_to_data', 'is_edited', 'edited_at', 'is_deleted', 'deleted_at',
             'timestamp', 'is_read', 'show_sender_info', 'is_own_message',
             'reactions_summary', 'can_edit', 'can_delete'
         ]
         read_only_fields = ['id', 'timestamp', 'is_read', 'show_sender_info', 'is_own_message']
 
+    # Per-message fields are computed from data loaded by
+    # Message.objects.for_serializer(user) and a single membership lookup
+    # cached in the serializer context, so a page costs a fixed number of
+    # queries. Instances loaded without it fall back to per-message queries.
     def get_is_read(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            # Read receipts are only written for the newest message read;
+            # everything up to the member's read cursor counts as read
+            cursor = self._memberships(request.user).get(obj.room_id, (None, None))[1]
+            if cursor is not None and obj.id <= cursor:
+                return True
+            if hasattr(obj, 'own_read_receipts'):
+                return bool(obj.own_read_receipts)
             try:
                 return obj.read_receipts.filter(user=request.user).exists()
             except Exception:
@@ -241,17 +268,22 @@ class MessageSerializer(DynamicFieldsModelSerializer):
     def get_show_sender_info(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.user != request.user
+            return obj.user_id != request.user.id
         return True
 
     def get_is_own_message(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.user == request.user
+            return obj.user_id == request.user.id
         return False
 
     def get_reactions_summary(self, obj):
         try:
+            if 'reactions' in getattr(obj, '_prefetched_objects_cache', {}):
+                summary = {}
+                for reaction in obj.reactions.all():
+                    summary[reaction.reaction_type] = summary.get(reaction.reaction_type, 0) + 1
+                return summary
             from django.db.models import Count
             reactions = obj.reactions.values('reaction_type').annotate(count=Count('id'))
             return {r['reaction_type']: r['count'] for r in reactions}
@@ -262,7 +294,7 @@ class MessageSerializer(DynamicFieldsModelSerializer):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             # Allow editing within 15 minutes for message owner
-            if obj.user == request.user and not obj.is_deleted:
+            if obj.user_id == request.user.id and not obj.is_deleted:
                 try:
                     time_diff = (timezone.now() - obj.timestamp).total_seconds()
                     return time_diff <= 900  # 15 minutes
@@ -273,16 +305,42 @@ class MessageSerializer(DynamicFieldsModelSerializer):
     def get_can_delete(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            if obj.user == request.user:
+            if obj.user_id == request.user.id:
                 return True
             # Check if user is moderator/admin of the room
-            try:
-                membership = RoomMembership.objects.get(room=obj.room, user=request.user)
-                return membership.role in ['owner', 'admin', 'moderator']
-            except RoomMembership.DoesNotExist:
-                return False
+            role = self._memberships(request.user).get(obj.room_id, (None, None))[0]
+            return role in ['owner', 'admin', 'moderator']
         return False
 
+    def get_thumbnails(self, obj):
+        """{"<size>": url} WebP previews of an image attachment; {} until generated"""
+        if not obj.file_blob_id:
+            return {}
+        return obj.file_blob.thumbnail_urls()
+
+    def _memberships(self, user):
+        """{room_id: (role, last_read_message_id)} for `user`, looked up once per serialization"""
+        # self.context is shared with the parent ListSerializer when many=True
+        memberships = self.context.get('_memberships')
+        if memberships is None:
+            memberships = {
+                room_id: (role, cursor)
+                for room_id, role, cursor in RoomMembership.objects.filter(user=user).values_list(
+                    'room_id', 'role', 'last_read_message_id'
+                )
+            }
+            self.context['_memberships'] = memberships
+        return memberships
+
+def check_send_limits(user, room, role):
+    """Charge the send-rate and slow-mode buckets shared with the WebSocket path (429 when empty)"""
+    decision = rate_limit.take_sync(rate_limit.message_buckets(
+        user.id, room.id, room.slow_mode, role in ['owner', 'admin', 'moderator']
+    ))
+    if not decision.allowed:
+        raise Throttled(wait=decision.retry_after)
+
+
 class CreateMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
@@ -295,24 +353,16 @@ class CreateMessageSerializer(serializers.ModelSerializer):
         if not room:
             raise serializers.ValidationError("Room is required")
         
-        # Check if user is member of room
+        # Check if user is member of room (the role also decides slow mode below)
         try:
-            if not RoomMembership.objects.filter(room=room, user=user, is_banned=False).exists():
-                raise serializers.ValidationError("You are not a member of this room")
+            role = RoomMembership.objects.filter(
+                room=room, user=user, is_banned=False
+            ).values_list('role', flat=True).first()
         except Exception:
+            role = None
+        if role is None:
             raise serializers.ValidationError("You are not a member of this room")
         
-        # Check slow mode
-        if room.slow_mode > 0:
-            try:
-                last_message = Message.objects.filter(room=room, user=user).order_by('-timestamp').first()
-                if last_message:
-                    time_diff = (timezone.now() - last_message.timestamp).total_seconds()
-                    if time_diff < room.slow_mode:
-                        raise serializers.ValidationError(f"Slow mode active. Wait {room.slow_mode - int(time_diff)} seconds")
-            except Exception:
-                pass  # If slow mode check fails, continue anyway
-        
         # Validate reply
         reply_to = attrs.get('reply_to')
         if reply_to:
@@ -325,6 +375,9 @@ class CreateMessageSerializer(serializers.ModelSerializer):
         if attrs.get('message_type') != 'file' and not attrs.get('content', '').strip():
             raise serializers.ValidationError("Message content cannot be empty for non-file messages")
         
+        # Checked last so a rejected message does not use up tokens
+        check_send_limits(user, room, role)
+        
         return attrs
 
 class UpdateMessageSerializer(serializers.ModelSerializer):
@@ -370,6 +423,16 @@ class MessageReadReceiptSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'user_name', 'message', 'read_at']
         read_only_fields = ['id', 'read_at']
 
+class MessageReaderSerializer(serializers.ModelSerializer):
+    """A member who has read a message, from Message.readers()"""
+    user = UserLiteSerializer(read_only=True)
+    user_name = serializers.CharField(source='user.get_full_name', read_only=True)
+    read_at = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = RoomMembership
+        fields = ['user', 'user_name', 'read_at']
+
 class ReactionSerializer(serializers.ModelSerializer):
     user = UserLiteSerializer(read_only=True)
     user_name = serializers.CharField(source='user.get_full_name', read_only=True)
@@ -509,6 +572,14 @@ class CreateMessageSerializer(serializers.ModelSerializer):
     def validate_room(self, value):
         # Ensure user has access to the room
         user = self.context['request'].user
-        if not RoomMembership.objects.filter(room=value, user=user, is_banned=False).exists():
+        self.membership_role = RoomMembership.objects.filter(
+            room=value, user=user, is_banned=False
+        ).values_list('role', flat=True).first()
+        if self.membership_role is None:
             raise serializers.ValidationError("You are not a member of this room")
-        return value
\ No newline at end of file
+        return value
+
+    def validate(self, attrs):
+        # Send limits and slow mode, shared with the WebSocket path
+        check_send_limits(self.context['request'].user, attrs['room'], self.membership_role)
+        return attrs
\ No newline at end of file
@@ -0,0 +1,132 @@
+# chat/snapshots.py
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .redis_client import RedisError, get_redis, get_sync_redis
+
+logger = logging.getLogger('websockets')
+
+# Shared part of the WebSocket initial_data frame: the room's public fields
+# and its most recent messages, identical for every member. It is cached per
+# room and tagged with the room's newest message id, so a new message makes
+# the next connect rebuild it; edits and deletes drop it explicitly (see
+# Message.soft_delete/edit_message). Reactions and room settings may lag by
+# up to CHAT_SNAPSHOT_TTL.
+#
+# The cache is per worker, so dropping an entry would only reach the worker
+# that made the change. Instead each room has a generation counter in the
+# shared redis, part of the cache key: invalidating increments it, and every
+# worker's next connect misses its stale copy. On the in-memory fallback
+# there is only one process and the entry is deleted directly.
+#
+# Messages are stored pre-encoded so a connect splices them into its frame
+# without re-serializing 50 messages per socket.
+
+ROOM_FIELDS = [
+    'id', 'name', 'title', 'description', 'avatar', 'privacy_level',
+    'max_members', 'is_active', 'created_by', 'last_activity', 'member_count',
+    'allow_links', 'allow_files', 'require_approval', 'slow_mode',
+    'created_at', 'updated_at',
+]
+
+# Per-viewer fields (is_read, can_edit, ...) are left out; clients derive
+# ownership from user.id
+MESSAGE_FIELDS = [
+    'id', 'room', 'user', 'content', 'message_type', 'file_url', 'file_name',
+    'file_size', 'file_type', 'image_width', 'image_height', 'thumbnails',
+    'reply_to', 'reply_to_data', 'is_edited',
+    'edited_at', 'is_deleted', 'deleted_at', 'timestamp', 'reactions_summary',
+]
+
+
+def snapshot_cache_key(room_id, generation=0):
+    return f"chat_room_snapshot_{room_id}_{generation}"
+
+
+def generation_key(room_id):
+    return f"chat:room:{room_id}:snapshot_generation"
+
+
+def snapshot_ttl():
+    return getattr(settings, 'CHAT_SNAPSHOT_TTL', 60)
+
+
+def initial_message_limit():
+    return getattr(settings, 'CHAT_INITIAL_MESSAGES', 50)
+
+
+def invalidate_room_snapshot(room_id):
+    """Make every worker rebuild the room's snapshot on its next connect"""
+    client = get_sync_redis()
+    if client is None:
+        cache.delete(snapshot_cache_key(room_id))
+        return
+    try:
+        client.incr(generation_key(room_id))
+    except RedisError as e:
+        logger.warning(f"Snapshot invalidation failed for room {room_id}, it may lag: {e}")
+
+
+async def snapshot_generation(room_id):
+    """The room's current snapshot generation (0 if never invalidated)"""
+    try:
+        return int(await get_redis().get(generation_key(room_id)) or 0)
+    except RedisError as e:
+        logger.warning(f"Snapshot generation lookup failed for room {room_id}: {e}")
+        return 0
+
+
+def latest_message_id(room_id):
+    """Newest message id in the room (0 if empty); an index lookup on (room, id)"""
+    from .models import Message
+    return Message.objects.filter(room_id=room_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def build_room_snapshot(room_id, version, generation=0):
+    """
+    Serialize the shared snapshot for `room_id` and cache it under
+    `generation` (see snapshot_generation). Returns a dict with the
+    room, `messages` as [id, encoded JSON] pairs oldest first, `complete`
+    (True when the room has no older messages) and `version`.
+    """
+    from django.db.models import Prefetch
+    from .models import ChatRoom, Message, Reaction
+    from .serializers import ChatRoomSerializer, MessageSerializer
+
+    limit = initial_message_limit()
+    room = ChatRoom.objects.select_related(
+        'created_by', 'created_by__chat_profile'
+    ).get(id=room_id)
+
+    messages = list(Message.objects.filter(
+        room_id=room_id,
+        is_deleted=False,
+        id__lte=version,
+    ).select_related(
+        'user', 'user__chat_profile', 'file_blob',
+        'reply_to', 'reply_to__user', 'reply_to__user__chat_profile',
+    ).prefetch_related(
+        Prefetch('reactions', queryset=Reaction.objects.only('id', 'message_id', 'reaction_type')),
+    ).defer('search_vector').order_by('-id')[:limit + 1])
+
+    complete = len(messages) <= limit
+    messages = messages[:limit][::-1]  # chronological order
+
+    room_data = json.loads(json.dumps(ChatRoomSerializer(room, fields=ROOM_FIELDS).data, cls=DjangoJSONEncoder))
+    encoded = [
+        [data['id'], json.dumps(data, cls=DjangoJSONEncoder)]
+        for data in MessageSerializer(messages, many=True, fields=MESSAGE_FIELDS).data
+    ]
+
+    snapshot = {
+        'version': version,
+        'room': room_data,
+        'messages': encoded,
+        'complete': complete,
+    }
+    cache.set(snapshot_cache_key(room_id, generation), snapshot, snapshot_ttl())
+    return snapshot
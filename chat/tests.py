@@ -1,3 +1,972 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import shutil
+import tempfile
+import uuid
+import weakref
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import presence, rate_limit, redis_client, thumbnails, typing_indicators, uploads
+from .admin import MessageAdmin
+from .consumers import NotificationConsumer, RobustChatConsumer
+from .events import room_group_name
+from .models import (
+    ArchivedMessage, ArchivedReaction, ArchivedReadReceipt, ChatRoom, FileBlob, Message, MessageReadReceipt,
+    Reaction, RoomMembership, UserProfile,
+)
+from .serializers import MessageSerializer
+from .throttles import TokenBucketThrottle
+from .views import ChatStatisticsAPI
+from .write_buffer import ChatWriteBuffer
+
+User = get_user_model()
+
+
+def make_user(email, **extra):
+    return User.objects.create_user(
+        email=email, password='password', **{'first_name': 'Test', 'last_name': 'User', **extra}
+    )
+
+
+class RedisClientTests(TestCase):
+    def setUp(self):
+        for name, value in (('_clients', weakref.WeakKeyDictionary()), ('_memory_client', None), ('_sync_client', None)):
+            patcher = mock.patch.object(redis_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @override_settings(CHAT_REDIS_URL='redis://localhost:6379/0', CHAT_REDIS_MAX_CONNECTIONS=7, CHAT_REDIS_POOL_TIMEOUT=2)
+    def test_one_blocking_pool_per_event_loop(self):
+        async def clients():
+            return redis_client.get_redis(), redis_client.get_redis()
+
+        first, again = asyncio.run(clients())
+        other, _ = asyncio.run(clients())
+
+        # Consumers on one loop share a client; a new loop gets its own
+        self.assertIs(first, again)
+        self.assertIsNot(first, other)
+        pool = first.connection_pool
+        self.assertIsInstance(pool, redis_client.aioredis.BlockingConnectionPool)
+        self.assertEqual((pool.max_connections, pool.timeout), (7, 2))
+
+        sync = redis_client.get_sync_redis()
+        self.assertIs(sync, redis_client.get_sync_redis())
+        self.assertIsInstance(sync.connection_pool, redis_client.redis.BlockingConnectionPool)
+
+    @override_settings(CHAT_REDIS_URL='memory://')
+    def test_memory_fallback(self):
+        async def client():
+            return redis_client.get_redis()
+
+        first = asyncio.run(client())
+
+        self.assertIsInstance(first, redis_client.InMemoryRedis)
+        self.assertIs(asyncio.run(client()), first)
+        self.assertIsNone(redis_client.get_sync_redis())
+
+        async def round_trip():
+            await first.set('key', 'value', ex=60)
+            return await first.get('key')
+
+        self.assertEqual(asyncio.run(round_trip()), 'value')
+
+
+def redis_available(url):
+    if redis_client.redis is None:
+        return False
+    try:
+        return redis_client.redis.Redis.from_url(url, socket_connect_timeout=0.5).ping()
+    except redis_client.RedisError:
+        return False
+
+
+class ChannelLayerFanoutTests(TestCase):
+    def test_loadtest_refuses_the_in_memory_layer(self):
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            with self.assertRaisesMessage(CommandError, 'CHANNEL_LAYER_BACKEND=redis'):
+                call_command('chat_fanout_loadtest')
+
+    @skipUnless(redis_available(settings.CHANNEL_REDIS_HOSTS[0]), 'needs the channel layer redis')
+    def test_group_send_reaches_every_worker(self):
+        from channels_redis.pubsub import RedisPubSubChannelLayer
+
+        async def fan_out():
+            # One layer per worker process, as each Daphne worker builds its own
+            workers = [
+                RedisPubSubChannelLayer(hosts=settings.CHANNEL_REDIS_HOSTS, prefix='paperless:chat:test')
+                for _ in range(3)
+            ]
+            group = f'room_{uuid.uuid4().hex}'
+            channels = []
+            for layer in workers:
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                channels.append((layer, channel))
+
+            await workers[0].group_send(group, {'type': 'chat.message', 'text': 'hello'})
+
+            try:
+                return await asyncio.wait_for(
+                    asyncio.gather(*(layer.receive(channel) for layer, channel in channels)), 5
+                )
+            finally:
+                for layer, channel in channels:
+                    await layer.group_discard(group, channel)
+                for layer in workers:
+                    await layer.flush()
+
+        received = asyncio.run(fan_out())
+
+        self.assertEqual([message['text'] for message in received], ['hello'] * 3)
+
+
+class BroadcastFrameTests(TestCase):
+    def test_broadcast_is_encoded_once_and_forwarded_verbatim(self):
+        from channels.layers import InMemoryChannelLayer
+
+        sender = RobustChatConsumer()
+        sender.channel_layer = InMemoryChannelLayer()
+        sender.room_name, sender.room_group_name = 'general', 'chat_general'
+        sender.user = make_user('reactor@example.com', first_name='Ada', last_name='Lovelace')
+
+        async def broadcast():
+            channels = [await sender.channel_layer.new_channel() for _ in range(3)]
+            for channel in channels:
+                await sender.channel_layer.group_add(sender.room_group_name, channel)
+            with mock.patch('chat.consumers.json.dumps', wraps=json.dumps) as dumps:
+                await sender.broadcast_reaction('42', 'like')
+            events = [await sender.channel_layer.receive(channel) for channel in channels]
+
+            receiver = RobustChatConsumer()
+            receiver.send = mock.AsyncMock()
+            await receiver.message_reacted(events[0])
+            return dumps.call_count, events, receiver.send.await_args
+
+        dumps_calls, events, sent = asyncio.run(broadcast())
+
+        self.assertEqual(dumps_calls, 1)
+        self.assertEqual({event['frame'] for event in events}, {events[0]['frame']})
+        self.assertEqual(sent, mock.call(text_data=events[0]['frame']))
+        frame = json.loads(events[0]['frame'])
+        self.assertEqual(
+            (frame['type'], frame['message_id'], frame['reaction'], frame['display_name']),
+            ('message_reacted', '42', 'like', 'Ada Lovelace'),
+        )
+
+
+class SaveMessageTests(TestCase):
+    def setUp(self):
+        self.user = make_user('author@example.com')
+        self.room = ChatRoom.objects.create(name='general', title='General', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user)
+        self.original = Message.objects.create(room=self.room, user=self.user, content='original')
+        ChatRoom.objects.filter(id=self.room.id).update(last_activity=timezone.now() - timedelta(days=1))
+
+        self.consumer = RobustChatConsumer()
+        self.consumer.user, self.consumer.room_id, self.consumer.room_name = self.user, self.room.id, self.room.name
+
+    def test_reply_with_attachment_is_one_insert(self):
+        file_data = {'url': '/media/chat/report.pdf', 'name': 'report.pdf', 'size': 2048, 'type': 'application/pdf'}
+
+        # The reply with its sender and profile, the upload lookup for the
+        # attachment's blob, then the INSERT and the last_activity UPDATE
+        # inside a savepoint
+        with self.assertNumQueries(6):
+            message = RobustChatConsumer.save_message.func(
+                self.consumer, 'a reply', 'file', self.original.id, file_data
+            )
+
+        stored = Message.objects.get(id=message.id)
+        self.assertEqual(stored.reply_to_id, self.original.id)
+        self.assertEqual(
+            (stored.file_url, stored.file_name, stored.file_size, stored.file_type),
+            ('/media/chat/report.pdf', 'report.pdf', 2048, 'application/pdf'),
+        )
+        self.room.refresh_from_db()
+        self.assertGreater(self.room.last_activity, timezone.now() - timedelta(minutes=1))
+
+        # The broadcast payload is built from what save_message loaded
+        with self.assertNumQueries(0):
+            reply = self.consumer.get_reply_data(message)
+            attachment = self.consumer.get_file_data(message)
+        self.assertEqual((reply['id'], reply['content']), (self.original.id, 'original'))
+        self.assertEqual(attachment['type'], 'application/pdf')
+
+    def test_reply_to_another_room_is_dropped(self):
+        other = ChatRoom.objects.create(name='other', title='Other', created_by=self.user)
+        elsewhere = Message.objects.create(room=other, user=self.user, content='elsewhere')
+
+        message = RobustChatConsumer.save_message.func(self.consumer, 'hi', 'text', elsewhere.id, None)
+
+        self.assertIsNone(message.reply_to_id)
+        self.assertIsNone(self.consumer.get_file_data(message))
+
+
+class MembershipCacheTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner@example.com')
+        self.member = make_user('member@example.com')
+        self.room = ChatRoom.objects.create(name='cached', title='Cached', created_by=self.owner)
+        self.membership = RoomMembership.objects.create(room=self.room, user=self.member, role='member')
+
+        self.consumer = RobustChatConsumer()
+        self.consumer.user, self.consumer.room_name = self.member, self.room.name
+        self.consumer.room_group_name = f'chat_{self.room.name}'
+        self.consumer.close = mock.AsyncMock()
+
+    def test_permissions_are_answered_from_the_connect_time_lookup(self):
+        self.assertTrue(RobustChatConsumer.validate_room_access.func(self.consumer))
+        self.assertEqual((self.consumer.room_id, self.consumer.membership_role), (self.room.id, 'member'))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(asyncio.run(self.consumer.can_send_message()))
+
+    def test_membership_changed_refreshes_the_cache(self):
+        RobustChatConsumer.validate_room_access.func(self.consumer)
+
+        async def deliver(**event):
+            await self.consumer.membership_changed({'type': 'membership_changed', 'removed': False, **event})
+
+        # Someone else's change leaves this socket alone
+        asyncio.run(deliver(user_id=str(self.owner.id), role=None, is_banned=True))
+        self.assertEqual(self.consumer.membership_role, 'member')
+
+        asyncio.run(deliver(user_id=str(self.member.id), role='moderator', is_banned=False))
+        self.assertEqual(self.consumer.membership_role, 'moderator')
+        self.consumer.close.assert_not_awaited()
+
+        asyncio.run(deliver(user_id=str(self.member.id), role='moderator', is_banned=True))
+        self.assertFalse(asyncio.run(self.consumer.can_send_message()))
+        self.consumer.close.assert_awaited_once_with(code=4003)
+
+    def test_expired_ban_is_not_sent_as_banned(self):
+        from .events import notify_membership_changed
+
+        self.membership.is_banned = True
+        self.membership.banned_until = timezone.now() - timedelta(minutes=1)
+        self.membership.save()
+
+        with mock.patch('chat.events._send_on_commit') as send:
+            notify_membership_changed(self.membership)
+
+        room_event = send.call_args_list[0].args[1]
+        self.assertEqual((room_event['type'], room_event['is_banned']), ('membership_changed', False))
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.user = make_user('searcher@example.com')
+        self.room = ChatRoom.objects.create(name='team', title='Team', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user)
+        elsewhere = ChatRoom.objects.create(name='elsewhere', title='Elsewhere', created_by=self.user)
+
+        self.budget = [
+            Message.objects.create(room=self.room, user=self.user, content='budget report for review'),
+            Message.objects.create(room=self.room, user=self.user, content='budget meeting tomorrow'),
+        ]
+        self.attachment = Message.objects.create(
+            room=self.room, user=self.user, content='', message_type='file', file_name='q3_report.pdf'
+        )
+        Message.objects.create(room=self.room, user=self.user, content='lunch?')
+        Message.objects.create(room=elsewhere, user=self.user, content='budget in a room they are not in')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get('/api/chat/search/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_results_are_paged_by_cursor(self):
+        seen, cursor = [], None
+        for _ in range(len(self.budget)):
+            data = self.search(q='budget', limit=1, **({'cursor': cursor} if cursor else {}))
+            self.assertEqual(data['results_count'], 1)
+            seen.append(data['results'][0]['id'])
+            cursor = data['next_cursor']
+
+        # Only rooms the user is in, and no page repeats a result
+        self.assertIsNone(cursor)
+        self.assertCountEqual(seen, [m.id for m in self.budget])
+
+    def test_file_names_are_searched(self):
+        ids = [m['id'] for m in self.search(q='report')['results']]
+
+        self.assertCountEqual(ids, [self.budget[0].id, self.attachment.id])
+
+    def test_recent_sort_and_bad_cursor(self):
+        ids = [m['id'] for m in self.search(q='budget', sort='recent')['results']]
+        self.assertEqual(ids, [self.budget[1].id, self.budget[0].id])
+
+        response = self.client.get('/api/chat/search/', {'q': 'budget', 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CHAT_PRESENCE_TTL=60)
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.redis = redis_client.InMemoryRedis()
+        self.clock = 1_700_000_000.0
+        clock = mock.patch.object(presence.time, 'time', side_effect=lambda: self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def run_presence(self, call, *args):
+        return asyncio.run(call(self.redis, *args))
+
+    def test_joined_and_left_once_per_user_not_per_tab(self):
+        self.assertEqual(self.run_presence(presence.join, 1, 7, 'tab-a'), (True, True))
+        self.assertEqual(self.run_presence(presence.join, 1, 7, 'tab-b'), (False, False))
+        self.assertEqual(self.run_presence(presence.join, 2, 7, 'tab-c'), (True, False))
+        self.run_presence(presence.join, 1, 8, 'other')
+        self.assertEqual(self.run_presence(presence.online_count, 1), 2)
+
+        self.assertEqual(self.run_presence(presence.leave, 1, 7, 'tab-a'), (False, False))
+        self.assertEqual(self.run_presence(presence.leave, 1, 7, 'tab-b'), (True, False))
+        self.assertEqual(self.run_presence(presence.online_user_ids, 1), ['8'])
+        self.assertEqual(self.run_presence(presence.leave, 2, 7, 'tab-c'), (True, True))
+
+    def test_sockets_that_stop_heartbeating_expire(self):
+        self.run_presence(presence.join, 1, 7, 'crashed-worker')
+        self.run_presence(presence.join, 1, 8, 'live')
+
+        self.clock += 40
+        self.run_presence(presence.heartbeat, 1, 8, 'live')
+        self.clock += 30
+
+        self.assertEqual(self.run_presence(presence.online_user_ids, 1), ['8'])
+        # The dead socket does not count as an earlier tab
+        self.assertEqual(self.run_presence(presence.join, 1, 7, 'reconnected'), (True, True))
+
+    def test_flush_syncs_profiles_and_sweeps_stale_ones(self):
+        online, stale = make_user('online@example.com'), make_user('stale@example.com')
+        UserProfile.objects.create(user=stale, online=True)
+        UserProfile.objects.filter(user=stale).update(last_seen=timezone.now() - timedelta(minutes=5))
+        buffer = ChatWriteBuffer()
+
+        with mock.patch.object(buffer, '_schedule'):
+            buffer.touch_presence(online.id)
+            buffer.flush()
+
+        self.assertTrue(UserProfile.objects.get(user=online).online)
+        self.assertFalse(UserProfile.objects.get(user=stale).online)
+
+
+@override_settings(CHAT_THUMBNAIL_SIZES=[160, 480, 1080], CHAT_THUMBNAIL_WORKERS=0)
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = make_user('photographer@example.com')
+        self.room = ChatRoom.objects.create(name='photos', title='Photos', created_by=self.user)
+
+    def encode(self, size, format='PNG', **options):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 80, 40)).save(buffer, format, **options)
+        return buffer.getvalue()
+
+    def store(self, data, content_type='image/png'):
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = default_storage.save(uploads.blob_name(sha256, 'image.png'), ContentFile(data))
+        blob = FileBlob.objects.create(
+            sha256=sha256, size=len(data), content_type=content_type, path=path, ref_count=1
+        )
+        message = Message.objects.create(
+            room=self.room, user=self.user, content='', message_type='image', file_url=blob.url, file_blob=blob
+        )
+        return blob, message
+
+    def test_buckets_smaller_than_the_image_are_rendered(self):
+        from PIL import Image
+
+        width, height, rendered = thumbnails.render_thumbnails(self.encode((1200, 600)), [160, 480, 1080], 80)
+
+        self.assertEqual((width, height), (1200, 600))
+        self.assertEqual(sorted(rendered), [160, 480, 1080])
+        for size, webp in rendered.items():
+            with Image.open(io.BytesIO(webp)) as thumbnail:
+                self.assertEqual((thumbnail.format, max(thumbnail.size)), ('WEBP', size))
+
+        # Never upscaled
+        self.assertEqual(thumbnails.render_thumbnails(self.encode((100, 50)), [160], 80), (100, 50, {}))
+
+    def test_dimensions_follow_exif_rotation(self):
+        from PIL import Image
+
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        width, height, rendered = thumbnails.render_thumbnails(
+            self.encode((400, 200), 'JPEG', exif=exif), [160], 80
+        )
+
+        self.assertEqual((width, height), (200, 400))
+        with Image.open(io.BytesIO(rendered[160])) as thumbnail:
+            self.assertEqual(thumbnail.size, (80, 160))
+
+    def test_process_blob_records_thumbnails_on_blob_and_messages(self):
+        blob, message = self.store(self.encode((600, 300)))
+
+        thumbnails.process_blob(blob.pk)
+
+        blob.refresh_from_db()
+        message.refresh_from_db()
+        self.assertEqual(sorted(blob.thumbnails), ['160', '480'])
+        self.assertTrue(all(default_storage.exists(path) for path in blob.thumbnails.values()))
+        self.assertEqual((message.image_width, message.image_height), (600, 300))
+        self.assertFalse(thumbnails.needs_thumbnails(blob))
+
+    def test_undecodable_image_is_marked_done(self):
+        blob, _ = self.store(b'not really a png')
+
+        thumbnails.process_blob(blob.pk)
+
+        blob.refresh_from_db()
+        self.assertEqual(blob.thumbnails, {})
+
+
+class NotificationConsumerTests(TestCase):
+    def setUp(self):
+        from channels.layers import InMemoryChannelLayer
+
+        self.user = make_user('everywhere@example.com')
+        other = make_user('chatty@example.com')
+        rooms = {
+            name: ChatRoom.objects.create(name=name, title=name.title(), created_by=other)
+            for name in ('general', 'banned', 'expired', 'closed')
+        }
+        RoomMembership.objects.create(room=rooms['general'], user=self.user)
+        RoomMembership.objects.create(
+            room=rooms['banned'], user=self.user, is_banned=True, banned_until=timezone.now() + timedelta(days=1)
+        )
+        RoomMembership.objects.create(
+            room=rooms['expired'], user=self.user, is_banned=True, banned_until=timezone.now() - timedelta(days=1)
+        )
+        RoomMembership.objects.create(room=rooms['closed'], user=self.user)
+        ChatRoom.objects.filter(name='closed').update(is_active=False)
+        for room in rooms.values():
+            Message.objects.create(room=room, user=other, content='unread')
+        Message.objects.create(room=rooms['general'], user=other, content='also unread')
+
+        self.consumer = NotificationConsumer()
+        self.consumer.user = self.user
+        self.consumer.channel_layer = InMemoryChannelLayer()
+        self.consumer.send = mock.AsyncMock()
+
+    def sent(self):
+        return [json.loads(call.kwargs['text_data']) for call in self.consumer.send.await_args_list]
+
+    def test_rooms_and_unread_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            rooms = NotificationConsumer.get_rooms.func(self.consumer)
+
+        self.assertEqual(rooms, {'general': 2, 'expired': 1})
+
+    def test_follows_rooms_as_membership_changes(self):
+        layer, group = self.consumer.channel_layer, room_group_name('general')
+        chat_message = {'type': 'chat_message', 'room': 'general', 'frame': json.dumps({'type': 'chat_message', 'content': 'hi'})}
+
+        async def scenario():
+            self.consumer.channel_name = await layer.new_channel()
+            await self.consumer.room_membership({'room': 'general', 'role': 'member', 'removed': False, 'is_banned': False})
+            await layer.group_send(group, chat_message)
+            event = await layer.receive(self.consumer.channel_name)
+            await getattr(self.consumer, event['type'])(event)
+
+            await self.consumer.room_membership({'room': 'general', 'role': 'member', 'removed': False, 'is_banned': True})
+            await layer.group_send(group, chat_message)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(self.consumer.channel_name), 0.1)
+
+        asyncio.run(scenario())
+
+        self.assertEqual(self.sent(), [
+            {'type': 'room_joined', 'room': 'general', 'role': 'member'},
+            {'type': 'room_event', 'room': 'general', 'event': {'type': 'chat_message', 'content': 'hi'}},
+            {'type': 'room_left', 'room': 'general'},
+        ])
+        self.assertEqual(self.consumer.rooms, set())
+
+    def test_app_notifications_reach_the_users_sockets(self):
+        from .events import send_user_notification, user_group_name
+
+        layer = self.consumer.channel_layer
+        channel = asyncio.run(layer.new_channel())
+        asyncio.run(layer.group_add(user_group_name(self.user.id), channel))
+
+        with mock.patch('chat.events.get_channel_layer', return_value=layer):
+            with self.captureOnCommitCallbacks(execute=True):
+                send_user_notification(self.user.id, 'approval_pending', {'flow_id': 3})
+
+        asyncio.run(self.consumer.user_notification(asyncio.run(layer.receive(channel))))
+        frame = self.sent()[0]
+        self.assertEqual(
+            (frame['type'], frame['category'], frame['data']),
+            ('notification', 'approval_pending', {'flow_id': 3}),
+        )
+
+
+@override_settings(CHAT_ARCHIVE_AFTER_DAYS=90)
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        self.user = make_user('historian@example.com')
+        self.room = ChatRoom.objects.create(name='history', title='History', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user, role='owner')
+        self.messages = [
+            Message.objects.create(room=self.room, user=self.user, content=f'message {i}') for i in range(6)
+        ]
+        # Four messages past the window; the last of them is still the
+        # target of a hot reply, so it stays in chat_message
+        for i, message in enumerate(self.messages[:4]):
+            Message.objects.filter(pk=message.pk).update(timestamp=timezone.now() - timedelta(days=120 - i))
+        Message.objects.filter(pk=self.messages[5].pk).update(reply_to=self.messages[3])
+        Reaction.objects.create(message=self.messages[0], user=self.user, reaction_type='like')
+        MessageReadReceipt.objects.create(message=self.messages[0], user=self.user)
+
+    def archive(self):
+        call_command('chat_archive_messages', batch_size=2, stdout=io.StringIO())
+
+    def test_old_messages_move_with_their_rows(self):
+        self.archive()
+
+        ids = [m.id for m in self.messages]
+        self.assertCountEqual(Message.objects.values_list('id', flat=True), ids[3:])
+        self.assertCountEqual(ArchivedMessage.objects.values_list('id', flat=True), ids[:3])
+        self.assertEqual(ArchivedReaction.objects.get().message_id, ids[0])
+        self.assertEqual(ArchivedReadReceipt.objects.get().message_id, ids[0])
+        self.assertFalse(Reaction.objects.exists())
+
+    def test_history_pages_read_through_to_the_archive(self):
+        self.archive()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        seen, url = [], f'/api/chat/rooms/{self.room.pk}/messages/?limit=2'
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            seen += [m['id'] for m in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, [m.id for m in reversed(self.messages)])
+
+
+class FileUploadAPITests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = make_user('uploader@example.com')
+
+    def test_upload_with_session_authentication(self):
+        # SessionAuthentication's CSRF check reads request.POST, which parses
+        # the multipart body before the view runs
+        client = APIClient(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        token = 'a' * 32
+        client.cookies['csrftoken'] = token
+        content = b'hello, chat\n' * 100
+
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = client.post(
+                '/api/chat/upload/',
+                {'file': SimpleUploadedFile('notes.txt', content, content_type='text/plain')},
+                format='multipart',
+                HTTP_X_CSRFTOKEN=token,
+            )
+
+        self.assertEqual(response.status_code, 201, response.content)
+        sha256 = hashlib.sha256(content).hexdigest()
+        self.assertEqual(response.data['file_info']['sha256'], sha256)
+        self.assertTrue(FileBlob.objects.filter(sha256=sha256, size=len(content)).exists())
+
+        # Only the uploader can attach it to a message by URL
+        url = response.data['file_info']['url']
+        self.assertEqual(uploads.blob_for_upload(self.user, url).sha256, sha256)
+        self.assertIsNone(uploads.blob_for_upload(make_user('other@example.com'), url))
+
+    def test_upload_without_csrf_token_is_rejected(self):
+        client = APIClient(enforce_csrf_checks=True)
+        client.force_login(self.user)
+
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = client.post(
+                '/api/chat/upload/',
+                {'file': SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain')},
+                format='multipart',
+            )
+
+        self.assertEqual(response.status_code, 403)
+
+
+class ReadCursorTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('owner@example.com')
+        self.member = make_user('member@example.com')
+        self.room = ChatRoom.objects.create(name='general', title='General', created_by=self.owner)
+        RoomMembership.objects.create(room=self.room, user=self.owner, role='owner')
+        self.history = [
+            Message.objects.create(room=self.room, user=self.owner, content=f'message {i}')
+            for i in range(5)
+        ]
+
+    def unread_count(self, user):
+        return ChatRoom.objects.with_unread_count(user).get(pk=self.room.pk).unread_count
+
+    def test_new_membership_starts_with_history_read(self):
+        membership = RoomMembership.objects.create(room=self.room, user=self.member)
+
+        self.assertEqual(membership.last_read_message_id, self.history[-1].id)
+        self.assertEqual(self.unread_count(self.member), 0)
+
+        Message.objects.create(room=self.room, user=self.owner, content='after joining')
+        self.assertEqual(self.unread_count(self.member), 1)
+
+    def test_join_starts_with_history_read(self):
+        client = APIClient()
+        client.force_authenticate(self.member)
+
+        response = client.post(f'/api/chat/rooms/{self.room.pk}/join/')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        # The "joined the room" message is the member's own
+        self.assertEqual(self.unread_count(self.member), 0)
+
+    def test_rejoin_after_ban_skips_messages_sent_meanwhile(self):
+        membership = RoomMembership.objects.create(
+            room=self.room, user=self.member, is_banned=True,
+            banned_until=timezone.now() - timedelta(minutes=1),
+        )
+        Message.objects.create(room=self.room, user=self.owner, content='while banned')
+        client = APIClient()
+        client.force_authenticate(self.member)
+
+        response = client.post(f'/api/chat/rooms/{self.room.pk}/join/')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        membership.refresh_from_db()
+        self.assertFalse(membership.is_banned)
+        self.assertEqual(self.unread_count(self.member), 0)
+
+
+class RoomListQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = make_user('viewer@example.com')
+        self.others = [make_user(f'member{i}@example.com') for i in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_rooms(self, count):
+        for _ in range(count):
+            index = ChatRoom.objects.count()
+            room = ChatRoom.objects.create(name=f'room-{index}', title=f'Room {index}', created_by=self.user)
+            RoomMembership.objects.create(room=room, user=self.user, role='owner')
+            for other in self.others:
+                RoomMembership.objects.create(room=room, user=other)
+                Message.objects.create(room=room, user=other, content=f'hello from {other.email}')
+
+    def test_room_list_query_count_does_not_grow_with_rooms(self):
+        # Member counts, the viewer's role, unread counts and last messages
+        # are annotated: one COUNT and one SELECT per page, where loading
+        # them per room took at least 2N queries for N rooms
+        for total in (3, 20):
+            self.add_rooms(total - ChatRoom.objects.count())
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/chat/rooms/', {'limit': 25})
+
+            self.assertEqual(response.status_code, 200)
+            rooms = response.data['results']
+            self.assertEqual(len(rooms), total)
+            for room in rooms:
+                self.assertEqual(room['member_count'], 1 + len(self.others))
+                self.assertEqual(room['unread_count'], len(self.others))
+                self.assertEqual(room['user_role'], 'owner')
+                self.assertIsNotNone(room['last_message'])
+
+
+class MessagePageQueryCountTests(TestCase):
+    def setUp(self):
+        self.viewer = make_user('viewer@example.com')
+        self.others = [make_user(f'sender{i}@example.com') for i in range(3)]
+        self.room = ChatRoom.objects.create(name='busy', title='Busy', created_by=self.viewer)
+        for user in [self.viewer] + self.others:
+            RoomMembership.objects.create(room=self.room, user=user)
+
+    def add_messages(self, count):
+        reactions = ['like', 'love', 'laugh']
+        for i in range(count):
+            sender = self.others[i % len(self.others)]
+            previous = Message.objects.filter(room=self.room).order_by('-id').first()
+            message = Message.objects.create(
+                room=self.room, user=sender, content=f'message {i}', reply_to=previous
+            )
+            for user, reaction in zip([self.viewer] + self.others, reactions):
+                Reaction.objects.create(message=message, user=user, reaction_type=reaction)
+                MessageReadReceipt.objects.create(message=message, user=user)
+
+    def serialize_page(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.viewer
+        page = Message.objects.filter(room=self.room).for_serializer(self.viewer).order_by('-timestamp', '-id')[:50]
+        return MessageSerializer(page, many=True, context={'request': request}).data
+
+    def test_message_page_query_count_is_fixed(self):
+        # Messages with sender, room and reply (one query), reactions and the
+        # viewer's own receipts (one prefetch each), and the viewer's
+        # memberships, for roles and read cursors (once per page)
+        for total in (10, 60):
+            self.add_messages(total - Message.objects.filter(room=self.room).count())
+            with self.assertNumQueries(4):
+                data = self.serialize_page()
+
+            self.assertEqual(len(data), min(total, 50))
+            for message in data:
+                self.assertTrue(message['is_read'])
+                self.assertEqual(sum(message['reactions_summary'].values()), 3)
+                self.assertFalse(message['can_delete'])
+            self.assertIsNotNone(data[0]['reply_to_data'])
+
+
+class WriteBufferTests(TestCase):
+    def setUp(self):
+        self.reader = make_user('reader@example.com')
+        self.sender = make_user('sender@example.com')
+        self.room = ChatRoom.objects.create(name='buffered', title='Buffered', created_by=self.sender)
+        RoomMembership.objects.create(room=self.room, user=self.sender, role='owner')
+        self.membership = RoomMembership.objects.create(room=self.room, user=self.reader)
+        self.messages = [
+            Message.objects.create(room=self.room, user=self.sender, content=f'message {i}')
+            for i in range(5)
+        ]
+        self.buffer = ChatWriteBuffer()
+        # Flushed explicitly by each test, not from a background thread
+        schedule = mock.patch.object(self.buffer, '_schedule')
+        schedule.start()
+        self.addCleanup(schedule.stop)
+
+    def test_read_reports_coalesce_to_the_newest_message(self):
+        for message in self.messages[:3] + self.messages[:2]:
+            self.buffer.mark_read(self.room.id, self.reader.id, message.id)
+
+        self.buffer.flush()
+
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.last_read_message_id, self.messages[2].id)
+        receipts = MessageReadReceipt.objects.filter(user=self.reader)
+        self.assertEqual(list(receipts.values_list('message_id', flat=True)), [self.messages[2].id])
+
+        request = APIRequestFactory().get('/')
+        request.user = self.reader
+        data = MessageSerializer(
+            Message.objects.filter(room=self.room).for_serializer(self.reader).order_by('id'),
+            many=True, context={'request': request},
+        ).data
+        self.assertEqual([message['is_read'] for message in data], [True, True, True, False, False])
+
+    def test_readers_and_unread_statistics_follow_the_read_cursor(self):
+        self.buffer.mark_read(self.room.id, self.reader.id, self.messages[2].id)
+        self.buffer.flush()
+        client = APIClient()
+        client.force_authenticate(self.sender)
+
+        # Only messages[2] has a receipt, but everything before it was read too
+        for message, expected in zip(self.messages, [[self.reader.id]] * 3 + [[]] * 2):
+            response = client.get(f'/api/chat/messages/{message.id}/readers/')
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual([reader['user']['id'] for reader in response.data], expected)
+            for reader in response.data:
+                self.assertIsNotNone(reader['read_at'])
+
+        stats = ChatStatisticsAPI().get_user_statistics(self.reader, timezone.now() - timedelta(days=7))
+        self.assertEqual(stats['unread_messages'], 2)
+
+    def test_reaction_removed_during_flush_stays_removed(self):
+        message = self.messages[0]
+        self.buffer.set_reaction(self.room.id, message.id, self.reader.id, 'like')
+        bulk_create = Reaction.objects.bulk_create
+
+        def remove_while_flushing(*args, **kwargs):
+            rows = bulk_create(*args, **kwargs)
+            self.assertTrue(self.buffer.discard_reaction(message.id, self.reader.id, 'like'))
+            return rows
+
+        with mock.patch.object(Reaction.objects, 'bulk_create', side_effect=remove_while_flushing):
+            self.buffer.flush()
+
+        self.assertFalse(Reaction.objects.filter(message=message, user=self.reader).exists())
+        self.assertFalse(self.buffer.discard_reaction(message.id, self.reader.id, 'like'))
+
+
+class MessageEditSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = make_user('editor@example.com')
+        self.room = ChatRoom.objects.create(name='edited', title='Edited', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user, role='owner')
+        self.message = Message.objects.create(room=self.room, user=self.user, content='original')
+
+    def test_rest_edit_records_history_and_drops_the_room_snapshot(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with mock.patch('chat.snapshots.invalidate_room_snapshot') as invalidate:
+            response = client.patch(f'/api/chat/messages/{self.message.pk}/', {'content': 'edited'}, format='json')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        invalidate.assert_called_once_with(self.room.pk)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.content, 'edited')
+        self.assertTrue(self.message.is_edited)
+        self.assertEqual(self.message.edit_history.get().old_content, 'original')
+
+    def test_admin_restore_drops_the_room_snapshot(self):
+        self.message.soft_delete(deleted_by=self.user)
+        request = RequestFactory().post('/')
+        request.user = self.user
+        request._messages = mock.Mock()
+
+        with mock.patch('chat.admin.invalidate_room_snapshot') as invalidate:
+            MessageAdmin(Message, admin.site).restore_messages(request, Message.objects.filter(pk=self.message.pk))
+
+        invalidate.assert_called_once_with(self.room.pk)
+        self.message.refresh_from_db()
+        self.assertFalse(self.message.is_deleted)
+
+
+class MessageListOrderingTests(TestCase):
+    def setUp(self):
+        self.user = make_user('reader@example.com')
+        room = ChatRoom.objects.create(name='ordered', title='Ordered', created_by=self.user)
+        RoomMembership.objects.create(room=room, user=self.user, role='owner')
+        self.messages = [
+            Message.objects.create(room=room, user=self.user, content=f'message {i}') for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_default_list_is_keyset_paged_newest_first(self):
+        response = self.client.get('/api/chat/messages/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertEqual([m['id'] for m in response.data['results']], [m.id for m in reversed(self.messages)])
+
+    def test_ordering_keeps_offset_paging(self):
+        response = self.client.get('/api/chat/messages/', {'ordering': 'id'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], len(self.messages))
+        self.assertEqual([m['id'] for m in response.data['results']], [m.id for m in self.messages])
+
+
+class TypingSnapshotTests(TestCase):
+    def test_snapshot_entries_keep_per_user_fields(self):
+        class Layer:
+            sent = []
+
+            async def group_send(self, group, message):
+                self.sent.append(message)
+
+        typist = make_user('typist@example.com', first_name='Ada', last_name='Lovelace')
+        layer = Layer()
+        asyncio.run(typing_indicators.send_snapshot(layer, 'general', [typing_indicators._member(typist)]))
+
+        frame = json.loads(layer.sent[0]['frame'])
+        self.assertEqual(frame['type'], 'typing_indicator')
+        self.assertEqual(frame['users'], [{
+            'user_id': str(typist.id),
+            'username': typist.username,
+            'display_name': 'Ada Lovelace',
+        }])
+
+
+@override_settings(CHAT_REDIS_URL='memory://')
+class RateLimitTests(TestCase):
+    def setUp(self):
+        buckets = mock.patch.object(rate_limit, '_memory_buckets', rate_limit._MemoryBuckets())
+        buckets.start()
+        self.addCleanup(buckets.stop)
+        self.clock = 1000.0
+        monotonic = mock.patch.object(rate_limit.time, 'monotonic', side_effect=lambda: self.clock)
+        monotonic.start()
+        self.addCleanup(monotonic.stop)
+
+    def test_bucket_allows_a_burst_then_refills(self):
+        bucket = rate_limit.per_minute('ratelimit:test', 60, 3)
+
+        for _ in range(3):
+            self.assertTrue(rate_limit.take_sync([bucket]).allowed)
+        decision = rate_limit.take_sync([bucket])
+        self.assertFalse(decision.allowed)
+        self.assertAlmostEqual(decision.retry_after, 1.0)
+
+        self.clock += 1.0
+        self.assertTrue(rate_limit.take_sync([bucket]).allowed)
+        self.assertFalse(rate_limit.take_sync([bucket]).allowed)
+
+        # Refilling stops at capacity
+        self.clock += 60
+        self.assertEqual(sum(rate_limit.take_sync([bucket]).allowed for _ in range(5)), 3)
+
+    def test_rejected_check_charges_no_bucket(self):
+        roomy = rate_limit.Bucket('ratelimit:roomy', 10, 1.0)
+        empty = rate_limit.Bucket('ratelimit:empty', 1, 1.0)
+        rate_limit.take_sync([empty])
+
+        self.assertFalse(rate_limit.take_sync([roomy, empty]).allowed)
+
+        self.assertEqual(sum(rate_limit.take_sync([roomy]).allowed for _ in range(12)), 10)
+
+    @override_settings(CHAT_RATE_LIMIT=6, CHAT_RATE_LIMIT_BURST=2)
+    def test_websocket_and_rest_sends_share_a_bucket(self):
+        user = make_user('sender@example.com')
+        room = ChatRoom.objects.create(name='limited', title='Limited', created_by=user)
+        RoomMembership.objects.create(room=room, user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        # What ChatConsumer charges for each message it receives
+        for _ in range(2):
+            decision = asyncio.run(rate_limit.take(rate_limit.message_buckets(user.id, room.id)))
+            self.assertTrue(decision.allowed)
+
+        response = client.post('/api/chat/messages/', {'room': room.id, 'content': 'over the limit'}, format='json')
+        self.assertEqual(response.status_code, 429, response.content)
+
+        self.clock += 10
+        response = client.post('/api/chat/messages/', {'room': room.id, 'content': 'refilled'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertFalse(asyncio.run(rate_limit.take(rate_limit.message_buckets(user.id, room.id))).allowed)
+
+    def test_drf_throttle_uses_the_scope_rate_as_a_bucket(self):
+        class Throttle(TokenBucketThrottle):
+            scope = 'test'
+            rate = '2/min'
+
+        request = APIRequestFactory().get('/')
+        request.user = make_user('throttled@example.com')
+
+        self.assertTrue(Throttle().allow_request(request, None))
+        self.assertTrue(Throttle().allow_request(request, None))
+        throttle = Throttle()
+        self.assertFalse(throttle.allow_request(request, None))
+        self.assertAlmostEqual(throttle.wait(), 30.0)
@@ -1,22 +1,58 @@
+from django.core.cache import cache
 from rest_framework.throttling import UserRateThrottle
 
-class MessageRateThrottle(UserRateThrottle):
+from . import rate_limit
+
+
+class TokenBucketThrottle(UserRateThrottle):
+    """
+    UserRateThrottle on the chat token-bucket engine: the scope's rate
+    ('100/hour') becomes a bucket of that capacity refilling evenly over the
+    period, shared across workers through redis instead of the cache.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        bucket = rate_limit.Bucket(self.key, self.num_requests, self.num_requests / self.duration)
+        self.decision = rate_limit.take_sync([bucket])
+        return self.decision.allowed
+
+    def wait(self):
+        return self.decision.retry_after
+
+
+class MessageRateThrottle(TokenBucketThrottle):
     scope = 'message'
-    
+
+    # How long a user's moderator status is trusted before re-checking
+    MODERATOR_CACHE_TTL = 300
+
     def allow_request(self, request, view):
         # Allow unlimited messages for moderators
         if hasattr(request, 'user') and request.user.is_authenticated:
-            # Check if user is moderator in any room
+            if self.is_moderator(request.user):
+                return True
+
+        return super().allow_request(request, view)
+
+    def is_moderator(self, user):
+        """Whether the user moderates any room, cached so it is not queried per request"""
+        key = f"chat_is_moderator_{user.id}"
+        is_moderator = cache.get(key)
+        if is_moderator is None:
             from .models import RoomMembership
             is_moderator = RoomMembership.objects.filter(
-                user=request.user,
+                user=user,
                 role__in=['owner', 'admin', 'moderator']
             ).exists()
-            
-            if is_moderator:
-                return True
-        
-        return super().allow_request(request, view)
+            cache.set(key, is_moderator, self.MODERATOR_CACHE_TTL)
+        return is_moderator
 
 class FileUploadThrottle(UserRateThrottle):
     scope = 'file_upload'
@@ -24,4 +60,4 @@ class FileUploadThrottle(UserRateThrottle):
 
 class RoomCreationThrottle(UserRateThrottle):
     scope = 'room_creation'
-    rate = '5/day'
\ No newline at end of file
+    rate = '5/day'
@@ -0,0 +1,166 @@
+# chat/thumbnails.py
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# WebP previews of image attachments, one per size bucket (longest edge in
+# pixels, never upscaled). They are generated per FileBlob, so an image
+# shared in many rooms is thumbnailed once, and stored content-addressed
+# next to it as chat_thumbs/<sha[:2]>/<sha>_<size>.webp.
+#
+# Uploads schedule a blob after their transaction commits; a small thread
+# pool in the web process does the work (Pillow releases the GIL while
+# decoding, resampling and encoding). `manage.py chat_thumbnails` processes
+# anything left over, e.g. after a restart, with a process pool.
+
+THUMBNAIL_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/webp']
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+_executor = None
+
+
+def thumbnail_sizes():
+    return sorted(getattr(settings, 'CHAT_THUMBNAIL_SIZES', [160, 480, 1080]))
+
+
+def thumbnail_quality():
+    return getattr(settings, 'CHAT_THUMBNAIL_QUALITY', 80)
+
+
+def thumbnail_workers():
+    return getattr(settings, 'CHAT_THUMBNAIL_WORKERS', 2)
+
+
+def thumbnail_name(sha256, size):
+    return f"chat_thumbs/{sha256[:2]}/{sha256}_{size}.webp"
+
+
+def render_thumbnails(data, sizes, quality):
+    """
+    Decode an image and encode a WebP for each size bucket smaller than it.
+    Returns (width, height, {size: webp bytes}) with the displayed (EXIF
+    rotated) dimensions. Pure CPU work, so it can run in another process.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+        wanted = [size for size in sizes if size < max(width, height)]
+        if not wanted:
+            return width, height, {}
+
+        # JPEGs can be decoded directly at 1/2, 1/4 or 1/8 scale, which is
+        # most of the saving for phone photos
+        image.draft('RGB', (max(wanted), max(wanted)))
+        current = ImageOps.exif_transpose(image)
+
+        if current.mode not in ('RGB', 'RGBA'):
+            has_alpha = current.mode in ('RGBA', 'LA', 'PA') or 'transparency' in current.info
+            current = current.convert('RGBA' if has_alpha else 'RGB')
+
+        # Largest first, each bucket resampled from the previous one
+        rendered = {}
+        for size in sorted(wanted, reverse=True):
+            current = current.copy()
+            current.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            current.save(buffer, 'WEBP', quality=quality, method=4)
+            rendered[size] = buffer.getvalue()
+        return width, height, rendered
+
+
+def needs_thumbnails(blob):
+    return blob.content_type in THUMBNAIL_CONTENT_TYPES and blob.thumbnails is None
+
+
+def read_blob(blob):
+    with default_storage.open(blob.path, 'rb') as stored:
+        return stored.read()
+
+
+def save_thumbnails(blob, width, height, rendered):
+    """Store rendered thumbnails and record them (and the dimensions) on the blob and its messages"""
+    from .models import FileBlob, Message
+    from .snapshots import invalidate_room_snapshot
+
+    paths = {}
+    for size, content in rendered.items():
+        name = thumbnail_name(blob.sha256, size)
+        # Content-addressed: an existing file is the same thumbnail
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(content))
+        paths[str(size)] = name
+
+    FileBlob.objects.filter(pk=blob.pk).update(width=width, height=height, thumbnails=paths)
+    messages = Message.objects.filter(file_blob_id=blob.pk)
+    room_ids = set(messages.values_list('room_id', flat=True))
+    messages.update(image_width=width, image_height=height)
+
+    # Cached connect snapshots hold the messages without thumbnails
+    for room_id in room_ids:
+        invalidate_room_snapshot(room_id)
+
+
+def mark_failed(blob, error):
+    from .models import FileBlob
+
+    logger.warning(f"Could not thumbnail blob {blob.sha256}: {error}")
+    FileBlob.objects.filter(pk=blob.pk).update(thumbnails={})
+
+
+def process_blob(blob_id):
+    """Generate and record thumbnails for one blob, if it still needs them"""
+    from .models import FileBlob
+
+    blob = FileBlob.objects.filter(pk=blob_id).first()
+    if blob is None or not needs_thumbnails(blob):
+        return
+
+    try:
+        width, height, rendered = render_thumbnails(read_blob(blob), thumbnail_sizes(), thumbnail_quality())
+    except Exception as e:
+        # Corrupt, truncated or oversized images (DecompressionBombError)
+        mark_failed(blob, e)
+        return
+    save_thumbnails(blob, width, height, rendered)
+
+
+def _run(blob_id):
+    try:
+        process_blob(blob_id)
+    except Exception as e:
+        logger.error(f"Thumbnail job for blob {blob_id} failed: {e}")
+    finally:
+        # Pool threads otherwise keep a database connection each
+        connection.close()
+
+
+def get_pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=thumbnail_workers(), thread_name_prefix='chat-thumbnails')
+    return _executor
+
+
+def schedule(blob):
+    """Queue thumbnail generation for `blob` once the current transaction commits"""
+    if not needs_thumbnails(blob):
+        return
+
+    if thumbnail_workers() <= 0:
+        # Inline (tests, management shells)
+        transaction.on_commit(lambda: process_blob(blob.pk))
+        return
+    transaction.on_commit(lambda: get_pool().submit(_run, blob.pk))
@@ -0,0 +1,120 @@
+# chat/typing_indicators.py
+import asyncio
+import json
+import logging
+import math
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+from .events import room_group_name
+
+logger = logging.getLogger('websockets')
+
+# Typing state is coalesced per room instead of broadcast per keystroke
+# burst. Typists are kept in a redis sorted set scored by when their
+# indicator lapses; whichever worker first sees typing activity in a quiet
+# room takes the room's flush lock and, every CHAT_TYPING_INTERVAL, sends a
+# single snapshot of everyone typing, but only when that list has changed.
+# The loop keeps running while anyone is typing so lapsed typists drop out
+# of the next snapshot without an explicit typing_stop.
+#
+#   typing:room:<room_name>        '["<user_id>", username, "<display name>"]' -> lapse time
+#   typing:room:<room_name>:last   last snapshot sent (JSON), kept while the loop runs
+#   typing:room:<room_name>:flush  flush lock, expires if its worker dies
+
+
+def typing_interval():
+    return getattr(settings, 'CHAT_TYPING_INTERVAL', 1.0)
+
+
+def typing_ttl():
+    return getattr(settings, 'CHAT_TYPING_TTL', 3)
+
+
+def _snapshot_ttl(lock_ttl):
+    # Longer than a typist's indicator lasts: an unchanged snapshot is not
+    # sent again, and a loop restarted after its worker died still knows
+    # what clients were last shown, so it clears lapsed typists
+    return max(lock_ttl, math.ceil(typing_ttl()) * 2)
+
+
+def _key(room_name):
+    return f"typing:room:{room_name}"
+
+
+def _member(user):
+    # JSON, since usernames and display names may contain any separator
+    return json.dumps([str(user.id), user.username, user.get_full_name()])
+
+
+async def start(redis, channel_layer, room_name, user):
+    """Mark `user` as typing and make sure a flush loop is running for the room"""
+    await redis.zadd(_key(room_name), {_member(user): time.time() + typing_ttl()})
+    await _ensure_flusher(redis, channel_layer, room_name)
+
+
+async def stop(redis, channel_layer, room_name, user):
+    """Clear `user`'s indicator; the next snapshot reflects it"""
+    if await redis.zrem(_key(room_name), _member(user)):
+        await _ensure_flusher(redis, channel_layer, room_name)
+
+
+async def _ensure_flusher(redis, channel_layer, room_name):
+    lock_ttl = max(1, int(typing_interval() * 3))
+    if await redis.set(f"{_key(room_name)}:flush", '1', ex=lock_ttl, nx=True):
+        # Not tied to the calling consumer: the snapshot still goes out if
+        # that socket disconnects before the interval elapses
+        asyncio.ensure_future(_flush_loop(redis, channel_layer, room_name))
+
+
+async def _flush_loop(redis, channel_layer, room_name):
+    key = _key(room_name)
+    lock_ttl = max(1, int(typing_interval() * 3))
+    snapshot_ttl = _snapshot_ttl(lock_ttl)
+    try:
+        while True:
+            await asyncio.sleep(typing_interval())
+            now = time.time()
+            await redis.zremrangebyscore(key, '-inf', now)
+            members = await redis.zrangebyscore(key, now, '+inf')
+
+            snapshot = json.dumps(sorted(members))
+            if snapshot != (await redis.get(f"{key}:last") or '[]'):
+                await redis.set(f"{key}:last", snapshot, ex=snapshot_ttl)
+                await send_snapshot(channel_layer, room_name, members)
+
+            if members:
+                await redis.expire(f"{key}:flush", lock_ttl)
+                await redis.expire(f"{key}:last", snapshot_ttl)
+                continue
+
+            await redis.delete(f"{key}:flush")
+            # Someone may have started typing after the read above, while
+            # the lock still blocked them from starting a loop of their own
+            if not await redis.zcount(key, time.time(), '+inf'):
+                return
+            if not await redis.set(f"{key}:flush", '1', ex=lock_ttl, nx=True):
+                return
+    except Exception as e:
+        # The lock expires on its own; the next typing event restarts the loop
+        logger.error(f"Typing flush failed for room {room_name}: {e}")
+
+
+async def send_snapshot(channel_layer, room_name, members):
+    # Each entry has the fields the per-user typing_indicator frames had
+    users = []
+    for member in sorted(members):
+        user_id, username, display_name = json.loads(member)
+        users.append({'user_id': user_id, 'username': username, 'display_name': display_name})
+
+    await channel_layer.group_send(room_group_name(room_name), {
+        'type': 'typing_indicator',
+        'room': room_name,
+        'frame': json.dumps({
+            'type': 'typing_indicator',
+            'users': users,
+            'timestamp': datetime.now().isoformat(),
+        }),
+    })
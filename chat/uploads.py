@@ -0,0 +1,184 @@
+# chat/uploads.py
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+
+# Attachments are never read into memory whole. A single-request upload is
+# hashed by HashingUploadHandler while Django spools the body to its temp
+# file, then handed to storage, which copies it chunk by chunk. A resumable
+# upload (FileUpload) appends each chunk to a staging file on disk and is
+# hashed and stored in one streaming pass when the client completes it.
+#
+# Staging files live under CHAT_UPLOAD_STAGING_DIR, which must be shared by
+# every worker that can receive a chunk.
+#
+# Stored bytes are content-addressed: chat_blobs/<sha[:2]>/<sha><ext>, one
+# FileBlob row per distinct file. An upload whose hash is already stored
+# writes nothing, and a resumable upload declaring a known hash the user can
+# already see skips sending the body altogether.
+
+ALLOWED_FILE_TYPES = [
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'application/pdf',
+    'text/plain', 'text/csv',
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.ms-excel',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/zip', 'application/x-zip-compressed'
+]
+
+# Copy/hash block size; independent of the client's chunk size
+BLOCK_SIZE = 64 * 1024
+
+
+def max_file_size():
+    return getattr(settings, 'CHAT_MAX_FILE_SIZE', 10 * 1024 * 1024)
+
+
+def chunk_size():
+    return getattr(settings, 'CHAT_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+
+def staging_dir():
+    return getattr(settings, 'CHAT_UPLOAD_STAGING_DIR', os.path.join(settings.MEDIA_ROOT, 'chat_uploads'))
+
+
+def validate_file(name, size, content_type):
+    """Return an error message for a file we won't accept, or None"""
+    if not name:
+        return 'File name is required'
+    if size is None or size <= 0:
+        return 'File is empty'
+    if size > max_file_size():
+        return f'File size exceeds {max_file_size() // (1024 * 1024)}MB limit'
+    if content_type not in ALLOWED_FILE_TYPES:
+        return f'File type {content_type} not allowed'
+    return None
+
+
+def blob_name(sha256, file_name):
+    # The extension only helps storage serve a sensible Content-Type
+    extension = os.path.splitext(file_name)[1].lower()[:10]
+    return f"chat_blobs/{sha256[:2]}/{sha256}{extension}"
+
+
+def store_blob(fileobj, sha256, size, content_type, file_name):
+    """
+    Return the FileBlob holding this content, streaming `fileobj` into
+    default_storage only if the hash is new. The caller takes a reference.
+    """
+    from .models import FileBlob
+
+    blob = FileBlob.objects.filter(sha256=sha256).first()
+    if blob is not None:
+        return blob
+
+    saved_path = default_storage.save(blob_name(sha256, file_name), File(fileobj))
+    blob, created = FileBlob.objects.get_or_create(sha256=sha256, defaults={
+        'size': size,
+        'content_type': content_type,
+        'path': saved_path,
+    })
+    if not created and blob.path != saved_path:
+        # Lost a race with a concurrent upload of the same bytes
+        default_storage.delete(saved_path)
+    return blob
+
+
+def blob_for_upload(user, url):
+    """
+    The FileBlob behind `url` if it was handed out by one of `user`'s own
+    completed uploads. A URL alone proves nothing: blob URLs are derived
+    from the content hash and may have been seen in any room.
+    """
+    from .models import FileBlob, FileUpload
+
+    if not url:
+        return None
+    sha256 = FileUpload.objects.filter(
+        user=user, status='complete', file_url=url
+    ).exclude(sha256='').values_list('sha256', flat=True).first()
+    if sha256 is None:
+        return None
+    return FileBlob.objects.filter(sha256=sha256).first()
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes the SHA-256 of each uploaded file as the request body streams
+    in, then passes the data on to the next handler unchanged. Install it at
+    the front of request.upload_handlers before request.FILES is accessed.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self._hash = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hash.hexdigest()
+        return None
+
+
+def staging_path(upload):
+    return os.path.join(staging_dir(), f"{upload.upload_id}.part")
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Copy `length` bytes from `stream` into the staging file at `offset`.
+    Returns the number of bytes written, which is short if the client
+    disconnected mid-chunk.
+    """
+    path = staging_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    written = 0
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as staged:
+        staged.seek(offset)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            staged.write(block)
+            written += len(block)
+        # Drop anything past the new end left over from an earlier attempt
+        staged.truncate(offset + written)
+    return written
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as staged:
+        for block in iter(lambda: staged.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def uploaded_file_sha256(uploaded_file):
+    """Hash an UploadedFile in blocks, leaving it rewound for storing"""
+    digest = hashlib.sha256()
+    for block in uploaded_file.chunks(BLOCK_SIZE):
+        digest.update(block)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def discard_staging(upload):
+    try:
+        os.remove(staging_path(upload))
+    except FileNotFoundError:
+        pass
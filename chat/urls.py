@@ -15,6 +15,9 @@ urlpatterns = [
     path('statistics/', views.ChatStatisticsAPI.as_view(), name='chat-statistics'),
     path('search/', views.MessageSearchAPI.as_view(), name='message-search'),
     path('upload/', views.FileUploadAPI.as_view(), name='file-upload'),
+    path('uploads/', views.ChunkedUploadAPI.as_view(), name='chunked-upload'),
+    path('uploads/<uuid:upload_id>/', views.ChunkedUploadDetailAPI.as_view(), name='chunked-upload-detail'),
+    path('uploads/<uuid:upload_id>/complete/', views.ChunkedUploadCompleteAPI.as_view(), name='chunked-upload-complete'),
     path('presence/', views.UserPresenceAPI.as_view(), name='user-presence'),
     path('user-suggestions/', views.user_suggestions, name='user-suggestions'),
     path('room-suggestions/', views.room_suggestions, name='room-suggestions'),
@@ -2,6 +2,7 @@ from rest_framework import viewsets, status, permissions, mixins
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
 from django_filters.rest_framework import DjangoFilterBackend
@@ -10,13 +11,15 @@ from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth import get_user_model
 User = get_user_model()
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.db.models import Q, Count, F, Subquery, OuterRef, Prefetch
+from django.db.models import BigIntegerField, Q, Count, F, Subquery, OuterRef, Prefetch, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.cache import cache
 from django.conf import settings
 from django.db import transaction, DatabaseError
 from django.core.files.base import ContentFile
 import logging
+import os
 from datetime import timedelta, datetime
 import json
 from django.core.files.storage import default_storage
@@ -26,6 +29,10 @@ from .serializers import *
 from . import serializers as chat_serializers
 from .serializers import RoomMembershipSerializer, UserProfileSerializer
 from .permissions import IsRoomMember, IsRoomAdmin
+from .events import notify_membership_changed, notify_room_settings_changed
+from .pagination import InvalidCursor, MessageCursorPagination, keyset_page, search_page
+from .write_buffer import get_write_buffer
+from . import thumbnails, uploads
 
 # Provide a fallback alias in case a module-local MessageRateThrottle isn't defined.
 from rest_framework.throttling import UserRateThrottle, ScopedRateThrottle
@@ -96,26 +103,19 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         return getattr(chat_serializers, 'ChatRoomSerializer', ChatRoomSerializer)
     
     def get_queryset(self):
-        """FIXED: Simple queryset without problematic annotations"""
+        """Visible rooms, annotated so ChatRoomSerializer needs no per-room queries"""
         user = self.request.user
         
-        # Simple base query - remove all complex annotations that were causing the error
         base_qs = ChatRoom.objects.filter(
             Q(privacy_level='public') |
             Q(roommembership__user=user, roommembership__is_banned=False) |
             Q(created_by=user)
         ).distinct()
         
-        # FIX: Remove ALL Subquery annotations that were causing "Cannot use None as query value"
-        # Just use simple count annotations
-        base_qs = base_qs.annotate(
-            member_count=Count('roommembership', filter=Q(roommembership__is_banned=False))
-        )
-        
-        return base_qs.select_related('created_by').prefetch_related(
-            Prefetch('roommembership_set', 
-                    queryset=RoomMembership.objects.filter(is_banned=False),
-                    to_attr='active_members')
+        # Per-room values come from correlated subqueries rather than joins on
+        # roommembership, which the visibility filter above already uses
+        return base_qs.with_member_info(user).with_unread_count(user).select_related(
+            'created_by', 'created_by__chat_profile'
         )
     
     @transaction.atomic
@@ -124,14 +124,20 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         room = serializer.save(created_by=self.request.user)
         
         # Auto-join as owner
-        RoomMembership.objects.create(
+        membership = RoomMembership.objects.create(
             room=room,
             user=self.request.user,
             role='owner'
         )
+        notify_membership_changed(membership)
         
         logger.info(f"Room created: {room.name} by {self.request.user.email}")
     
+    def perform_update(self, serializer):
+        room = serializer.save()
+        # Connected sockets cache slow_mode for their send limits
+        notify_room_settings_changed(room)
+    
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def join(self, request, pk=None):
         """
@@ -152,14 +158,19 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 
                 existing_membership = RoomMembership.objects.filter(room=room, user=user).first()
                 if existing_membership:
+                    was_banned = existing_membership.is_banned
                     if existing_membership.is_banned_currently():
                         return Response(
                             {'error': 'You are banned from this room'}, 
                             status=status.HTTP_403_FORBIDDEN
                         )
+                    if was_banned:
+                        # Back after an expired ban; what was sent meanwhile isn't unread
+                        existing_membership.mark_history_read()
                     existing_membership.is_banned = False
                     existing_membership.banned_until = None
                     existing_membership.save()
+                    notify_membership_changed(existing_membership)
                     return Response({'status': 'rejoined room'})
                 
                 current_members = RoomMembership.objects.filter(room=room, is_banned=False).count()
@@ -178,6 +189,7 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                     user=user,
                     role=role
                 )
+                notify_membership_changed(membership)
                 
                 if not room.require_approval:
                     Message.objects.create(
@@ -215,6 +227,7 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 )
             
             membership.delete()
+            notify_membership_changed(membership, removed=True)
             
             Message.objects.create(
                 room=room,
@@ -264,36 +277,34 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             return self.create_message(request, room)
         
         # Original GET logic for listing messages
-        messages = Message.objects.filter(
-            room=room,
-            is_deleted=False
-        ).select_related('user', 'reply_to').prefetch_related('reactions', 'read_receipts')
+        filters = {'room': room, 'is_deleted': False}
         
         # Apply filters
         message_type = request.query_params.get('message_type')
         if message_type:
-            messages = messages.filter(message_type=message_type)
+            filters['message_type'] = message_type
         
         user_id = request.query_params.get('user_id')
         if user_id:
-            messages = messages.filter(user_id=user_id)
+            filters['user_id'] = user_id
         
         date_from = request.query_params.get('date_from')
         if date_from:
-            messages = messages.filter(timestamp__date__gte=date_from)
+            filters['timestamp__date__gte'] = date_from
         
         date_to = request.query_params.get('date_to')
         if date_to:
-            messages = messages.filter(timestamp__date__lte=date_to)
+            filters['timestamp__date__lte'] = date_to
         
-        # Pagination
-        page = self.paginate_queryset(messages.order_by('-timestamp'))
-        if page is not None:
-            serializer = MessageSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
+        messages = Message.objects.filter(**filters).for_serializer(request.user)
+        archived = ArchivedMessage.objects.filter(**filters).for_serializer(request.user)
         
-        serializer = MessageSerializer(messages.order_by('-timestamp')[:50], many=True, context={'request': request})
-        return Response(serializer.data)
+        # Keyset pagination on (timestamp, id), reading through to archived
+        # history; ?offset= keeps the old paging
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(messages, request, view=self, archive=archived)
+        serializer = MessageSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
     
     def create_message(self, request, room):
         """Create a new message in the room"""
@@ -372,6 +383,9 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 new_owner_membership.role = 'owner'
                 new_owner_membership.save()
                 
+                notify_membership_changed(current_owner_membership)
+                notify_membership_changed(new_owner_membership)
+                
                 room.created_by_id = new_owner_id
                 room.save()
                 
@@ -441,6 +455,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     throttle_classes = [MessageRateThrottle]
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_class = MessageFilter
+    pagination_class = MessageCursorPagination
     ordering_fields = ['timestamp', 'id']
     ordering = ['-timestamp']
     
@@ -457,15 +472,8 @@ class MessageViewSet(viewsets.ModelViewSet):
             room__roommembership__user=self.request.user,
             room__roommembership__is_banned=False,
             is_deleted=False
-        ).select_related(
-            'user', 'user__chat_profile', 'reply_to', 'reply_to__user', 'room'
-        ).prefetch_related(
-            'read_receipts', 'reactions', 'edit_history'
-        ).only(
-            'id', 'room_id', 'user_id', 'content', 'message_type',
-            'file_url', 'file_name', 'file_size', 'file_type',
-            'reply_to_id', 'is_edited', 'edited_at', 'is_deleted',
-            'timestamp', 'user__username', 'user__email', 'user__first_name', 'user__last_name'
+        ).for_serializer(self.request.user).prefetch_related(
+            'edit_history'
         )
     
     @transaction.atomic
@@ -555,7 +563,9 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        if 'content' in serializer.validated_data:
+            # Records the edit and drops the cached room snapshot
+            instance.edit_message(serializer.validated_data['content'])
         
         return Response(serializer.data)
     
@@ -656,18 +666,13 @@ class MessageViewSet(viewsets.ModelViewSet):
         """Mark message as read"""
         message = self.get_object()
         
-        receipt, created = MessageReadReceipt.objects.get_or_create(
-            message=message,
-            user=request.user
-        )
-        
-        # Clear unread count cache
-        cache_key = f"unread_{message.room_id}_{request.user.id}"
-        cache.delete(cache_key)
+        # Buffered; the write buffer bulk-inserts receipts, advances the
+        # member's read cursor and clears the unread cache on flush
+        get_write_buffer().mark_read(message.room_id, request.user.id, message.id)
         
         return Response({
             'status': 'message marked as read',
-            'read_at': receipt.read_at
+            'read_at': timezone.now()
         })
     
     @action(detail=True, methods=['post'])
@@ -689,19 +694,8 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            # Remove existing reaction if exists
-            Reaction.objects.filter(
-                message=message,
-                user=request.user
-            ).delete()
-            
-            # Add new reaction
-            reaction = Reaction.objects.create(
-                message=message,
-                user=request.user,
-                reaction_type=reaction_type
-            )
+        # Buffered upsert (one reaction per user per message)
+        get_write_buffer().set_reaction(message.room_id, message.id, request.user.id, reaction_type)
         
         return Response({
             'status': 'reaction added',
@@ -721,13 +715,14 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        discarded = get_write_buffer().discard_reaction(message.id, request.user.id, reaction_type)
         deleted_count, _ = Reaction.objects.filter(
             message=message,
             user=request.user,
             reaction_type=reaction_type
         ).delete()
         
-        if deleted_count > 0:
+        if deleted_count > 0 or discarded:
             return Response({'status': 'reaction removed'})
         else:
             return Response(
@@ -739,9 +734,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     def readers(self, request, pk=None):
         """Get users who have read this message"""
         message = self.get_object()
-        readers = message.read_receipts.select_related('user').order_by('-read_at')
-        
-        serializer = MessageReadReceiptSerializer(readers, many=True)
+        serializer = MessageReaderSerializer(message.readers(), many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
@@ -815,6 +808,7 @@ class RoomMembershipViewSet(viewsets.ModelViewSet):
         membership.is_banned = True
         membership.banned_until = timezone.now() + timedelta(days=duration_days)
         membership.save()
+        notify_membership_changed(membership)
         
         # Log ban
         BanHistory.objects.create(
@@ -852,6 +846,7 @@ class RoomMembershipViewSet(viewsets.ModelViewSet):
         membership.is_banned = False
         membership.banned_until = None
         membership.save()
+        notify_membership_changed(membership)
         
         Message.objects.create(
             room=membership.room,
@@ -882,6 +877,7 @@ class RoomMembershipViewSet(viewsets.ModelViewSet):
         
         membership.role = new_role
         membership.save()
+        notify_membership_changed(membership)
         
         return Response({
             'status': 'user promoted',
@@ -908,6 +904,7 @@ class RoomMembershipViewSet(viewsets.ModelViewSet):
         
         membership.role = 'member'
         membership.save()
+        notify_membership_changed(membership)
         
         return Response({'status': 'user demoted to member'})
     
@@ -1048,13 +1045,17 @@ class ChatStatisticsAPI(APIView):
                 user=user,
                 timestamp__gte=start_date
             ).count(),
+            # Past the read cursor of the same membership, as in
+            # ChatRoom.objects.with_unread_count()
             'unread_messages': Message.objects.filter(
                 room__roommembership__user=user,
                 room__roommembership__is_banned=False,
-                timestamp__gte=start_date
-            ).exclude(
-                read_receipts__user=user
-            ).count(),
+                id__gt=Coalesce(
+                    'room__roommembership__last_read_message_id', Value(0), output_field=BigIntegerField()
+                ),
+                timestamp__gte=start_date,
+                is_deleted=False,
+            ).exclude(user=user).count(),
             'messages_today': Message.objects.filter(
                 user=user,
                 timestamp__date=timezone.now().date()
@@ -1131,8 +1132,9 @@ class MessageSearchAPI(APIView):
         
         # Base queryset - user's accessible messages
         messages = Message.objects.filter(
-            room__roommembership__user=request.user,
-            room__roommembership__is_banned=False,
+            room_id__in=RoomMembership.objects.filter(
+                user=request.user, is_banned=False
+            ).values('room_id'),
             is_deleted=False
         )
         
@@ -1155,37 +1157,126 @@ class MessageSearchAPI(APIView):
         if not include_files:
             messages = messages.exclude(message_type='file')
         
-        # Search in content and file names
-        messages = messages.filter(
-            Q(content__icontains=query) |
-            Q(file_name__icontains=query)
-        )
+        # Full-text search over content and file names, best match first
+        messages = messages.search(query).for_serializer(request.user)
         
-        # Optimize queryset
-        messages = messages.select_related(
-            'user', 'room', 'reply_to'
-        ).only(
-            'id', 'content', 'message_type', 'file_name', 'timestamp',
-            'user__first_name', 'user__last_name', 'room__name', 'room__title'
-        ).order_by('-timestamp')[:100]
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 50)), 100))
+        except ValueError:
+            limit = 50
+        
+        # sort=recent skips ranking, which is much cheaper for very common terms
+        try:
+            if request.GET.get('sort') == 'recent':
+                page, next_cursor, _ = keyset_page(messages, cursor=request.GET.get('cursor'), limit=limit)
+            else:
+                page, next_cursor = search_page(messages, cursor=request.GET.get('cursor'), limit=limit)
+        except InvalidCursor:
+            return Response(
+                {'error': 'Invalid cursor'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        serializer = MessageSerializer(messages, many=True, context={'request': request})
+        serializer = MessageSerializer(page, many=True, context={'request': request})
         
         return Response({
             'query': query,
-            'results_count': len(messages),
+            'results_count': len(page),
+            'next_cursor': next_cursor,
             'results': serializer.data
         })
 
+def _share_file(request, room, blob, name, content_type, description):
+    """
+    Take a reference on a stored blob and, when a room was given, create
+    the file message for it. Only this step runs in a transaction; the bytes
+    are already in storage. Returns (message or None, response payload).
+    """
+    file_info = {
+        'url': blob.url,
+        'name': name,
+        'size': blob.size,
+        'type': content_type,
+        'sha256': blob.sha256,
+    }
+    # Images get WebP previews in the background (chat.thumbnails)
+    thumbnails.schedule(blob)
+
+    if room is None:
+        # Just upload file without sharing to room. Nothing tracks where
+        # the URL ends up, so this reference is never released.
+        blob.add_reference()
+        return None, {
+            'detail': 'File uploaded successfully',
+            'file_info': file_info,
+        }
+
+    with transaction.atomic():
+        blob.add_reference()
+        message = Message.objects.create(
+            room=room,
+            user=request.user,
+            content=description or f"Shared file: {name}",
+            message_type='image' if content_type in thumbnails.THUMBNAIL_CONTENT_TYPES else 'file',
+            file_url=file_info['url'],
+            file_name=name,
+            file_size=blob.size,
+            file_type=content_type,
+            file_blob=blob,
+            # Known already if this content was thumbnailed before
+            image_width=blob.width,
+            image_height=blob.height,
+        )
+
+    serializer = MessageSerializer(message, context={'request': request})
+    return message, {
+        'detail': 'File uploaded and shared successfully',
+        'message': serializer.data,
+        'file_info': file_info,
+    }
+
+
+def _upload_room(request, room_id):
+    """Resolve the target room for an upload; raises NotFound/PermissionDenied"""
+    if not room_id:
+        return None
+    try:
+        room = ChatRoom.objects.get(id=room_id)
+    except (ChatRoom.DoesNotExist, ValueError):
+        raise NotFound('Room not found')
+    if not RoomMembership.objects.filter(room=room, user=request.user, is_banned=False).exists():
+        raise PermissionDenied('Access denied to this room')
+    return room
+
+
 class FileUploadAPI(APIView):
     """
     File Upload API for Chat
+
+    Single-request multipart upload. Larger files, or clients on unreliable
+    connections, should use the resumable ChunkedUploadAPI instead.
     """
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     throttle_classes = [UserRateThrottle]
     
+    def initialize_request(self, request, *args, **kwargs):
+        # Hash the file while the body is parsed. This has to happen before
+        # authentication: SessionAuthentication's CSRF check reads
+        # request.POST, which parses the multipart body.
+        self.hasher = uploads.HashingUploadHandler(request)
+        request.upload_handlers.insert(0, self.hasher)
+        return super().initialize_request(request, *args, **kwargs)
+
     def post(self, request):
+        # Refuse oversized bodies before reading them
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if content_length > uploads.max_file_size() + uploads.BLOCK_SIZE:
+            return Response(
+                {'error': f'File size exceeds {uploads.max_file_size() // (1024 * 1024)}MB limit'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         if 'file' not in request.FILES:
             return Response(
                 {'error': 'No file provided'}, 
@@ -1196,99 +1287,248 @@ class FileUploadAPI(APIView):
         room_id = request.data.get('room_id')
         description = request.data.get('description', '')
         
-        # Validate file size (10MB limit)
-        if uploaded_file.size > 10 * 1024 * 1024:
+        error = uploads.validate_file(uploaded_file.name, uploaded_file.size, uploaded_file.content_type)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            # Check if room exists and user has access
+            room = _upload_room(request, room_id)
+            
+            # The body may have been parsed by a handler chain we didn't
+            # get into; hash the stored file then
+            sha256 = self.hasher.digests.get('file') or uploads.uploaded_file_sha256(uploaded_file)
+            # Streams from Django's temp file (or writes nothing if the content
+            # is already stored); no transaction or row locks held
+            blob = uploads.store_blob(
+                uploaded_file, sha256, uploaded_file.size,
+                uploaded_file.content_type, uploaded_file.name
+            )
+            
+            message, payload = _share_file(
+                request, room, blob, uploaded_file.name, uploaded_file.content_type, description
+            )
+            # Recorded like a resumable upload, so a message sent over the
+            # WebSocket can attach it (see uploads.blob_for_upload)
+            FileUpload.objects.create(
+                user=request.user,
+                room=room,
+                file_name=os.path.basename(uploaded_file.name)[:255],
+                file_size=uploaded_file.size,
+                file_type=uploaded_file.content_type,
+                description=description,
+                offset=uploaded_file.size,
+                sha256=sha256,
+                status='complete',
+                file_url=blob.url,
+                message=message,
+            )
+            return Response(payload, status=status.HTTP_201_CREATED)
+                    
+        except APIException:
+            raise
+        except Exception as e:
+            logger.error(f"File upload failed: {e}")
             return Response(
-                {'error': 'File size exceeds 10MB limit'}, 
-                status=status.HTTP_400_BAD_REQUEST
+                {'error': f'File upload failed: {str(e)}'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        
-        # Validate file types
-        allowed_types = [
-            'image/jpeg', 'image/png', 'image/gif', 'image/webp',
-            'application/pdf', 
-            'text/plain', 'text/csv',
-            'application/msword', 
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            'application/vnd.ms-excel',
-            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            'application/zip', 'application/x-zip-compressed'
-        ]
-        
-        if uploaded_file.content_type not in allowed_types:
+
+
+class ChunkedUploadAPI(APIView):
+    """
+    Start a resumable upload.
+
+    POST {file_name, file_size, file_type, room_id?, description?, sha256?}
+    returns an upload_id and the chunk size to use. The client then PUTs raw
+    chunks to uploads/<upload_id>/ with an Upload-Offset header, and finishes
+    with POST uploads/<upload_id>/complete/. After a dropped connection, GET
+    uploads/<upload_id>/ returns the offset to resume from.
+
+    If sha256 names content that is already stored and visible to the user,
+    the upload completes immediately (`deduplicated: true`) and no chunks
+    need to be sent.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [UserRateThrottle]
+
+    def post(self, request):
+        file_name = request.data.get('file_name', '')
+        file_type = request.data.get('file_type', '')
+        try:
+            file_size = int(request.data.get('file_size'))
+        except (TypeError, ValueError):
+            return Response({'error': 'file_size is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        error = uploads.validate_file(file_name, file_size, file_type)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+
+        room = _upload_room(request, request.data.get('room_id'))
+        upload = FileUpload(
+            user=request.user,
+            room=room,
+            file_name=os.path.basename(file_name)[:255],
+            file_size=file_size,
+            file_type=file_type,
+            description=request.data.get('description', ''),
+            sha256=(request.data.get('sha256') or '').lower()[:64],
+        )
+
+        # Known content the user can already see: share the stored blob
+        # without transferring the body. Requiring visibility keeps a bare
+        # hash from working as a key to someone else's file.
+        blob = None
+        if upload.sha256:
+            blob = FileBlob.objects.filter(sha256=upload.sha256, size=file_size).first()
+        if blob is not None and blob.is_visible_to(request.user):
+            message, payload = _share_file(request, room, blob, upload.file_name, file_type, upload.description)
+            upload.status = 'complete'
+            upload.offset = file_size
+            upload.file_url = blob.url
+            upload.message = message
+            upload.save()
+            return Response(
+                {**self.upload_status(upload), **payload, 'deduplicated': True},
+                status=status.HTTP_201_CREATED
+            )
+
+        upload.save()
+        return Response(self.upload_status(upload), status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def upload_status(upload):
+        return {
+            'upload_id': str(upload.upload_id),
+            'file_name': upload.file_name,
+            'file_size': upload.file_size,
+            'offset': upload.offset,
+            'chunk_size': uploads.chunk_size(),
+            'status': upload.status,
+        }
+
+
+class ChunkedUploadDetailAPI(APIView):
+    """Resume status (GET), chunk upload (PUT) and abort (DELETE) for one upload"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_upload(self, request, upload_id):
+        try:
+            return FileUpload.objects.get(upload_id=upload_id, user=request.user)
+        except FileUpload.DoesNotExist:
+            raise NotFound('Upload not found')
+
+    def get(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        return Response(ChunkedUploadAPI.upload_status(upload))
+
+    def put(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload.status != 'pending':
+            return Response({'error': f'Upload is {upload.status}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': 'Upload-Offset header is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Chunks must arrive in order; a client that is out of step
+        # (e.g. retrying a chunk that did land) resumes from our offset
+        if offset != upload.offset:
+            return Response(
+                {'error': 'Offset mismatch', 'offset': upload.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        if length <= 0 or offset + length > upload.file_size:
             return Response(
-                {'error': f'File type {uploaded_file.content_type} not allowed'}, 
+                {'error': 'Chunk exceeds the declared file size', 'offset': upload.offset},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
+
+        # The body is read straight from the request stream into the
+        # staging file, never through request.data
+        written = uploads.write_chunk(upload, offset, request.stream, length)
+
+        # Conditional on the offset we started from, so of two racing
+        # requests for the same chunk only one advances the upload
+        advanced = FileUpload.objects.filter(pk=upload.pk, offset=offset, status='pending').update(
+            offset=offset + written, updated_at=timezone.now()
+        )
+        if not advanced:
+            upload.refresh_from_db(fields=['offset'])
+            return Response(
+                {'error': 'Offset mismatch', 'offset': upload.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        upload.offset = offset + written
+        return Response(ChunkedUploadAPI.upload_status(upload))
+
+    def delete(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload.status == 'pending':
+            upload.status = 'aborted'
+            upload.save(update_fields=['status', 'updated_at'])
+            uploads.discard_staging(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadCompleteAPI(APIView):
+    """Verify a fully received upload, move it to storage and share it"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, upload_id):
         try:
-            with transaction.atomic():
-                # Check if room exists and user has access
-                if room_id:
-                    room = ChatRoom.objects.get(id=room_id)
-                    if not RoomMembership.objects.filter(room=room, user=request.user, is_banned=False).exists():
-                        return Response(
-                            {'error': 'Access denied to this room'}, 
-                            status=status.HTTP_403_FORBIDDEN
-                        )
-                
-                # Generate unique filename
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"chat_files/{timestamp}_{request.user.id}_{uploaded_file.name}"
-                
-                # Save file to storage (in production, use AWS S3 or similar)
-                saved_path = default_storage.save(filename, ContentFile(uploaded_file.read()))
-                file_url = default_storage.url(saved_path)
-                
-                # If room_id provided, create a message with file attachment
-                if room_id:
-                    message = Message.objects.create(
-                        room=room,
-                        user=request.user,
-                        content=description or f"Shared file: {uploaded_file.name}",
-                        message_type='file',
-                        file_url=file_url,
-                        file_name=uploaded_file.name,
-                        file_size=uploaded_file.size,
-                        file_type=uploaded_file.content_type
-                    )
-                    
-                    serializer = MessageSerializer(message, context={'request': request})
-                    
-                    return Response({
-                        'detail': 'File uploaded and shared successfully',
-                        'message': serializer.data,
-                        'file_info': {
-                            'url': file_url,
-                            'name': uploaded_file.name,
-                            'size': uploaded_file.size,
-                            'type': uploaded_file.content_type
-                        }
-                    }, status=status.HTTP_201_CREATED)
-                else:
-                    # Just upload file without sharing to room
-                    return Response({
-                        'detail': 'File uploaded successfully',
-                        'file_info': {
-                            'url': file_url,
-                            'name': uploaded_file.name,
-                            'size': uploaded_file.size,
-                            'type': uploaded_file.content_type
-                        }
-                    }, status=status.HTTP_201_CREATED)
-                    
-        except ChatRoom.DoesNotExist:
+            upload = FileUpload.objects.select_related('room').get(upload_id=upload_id, user=request.user)
+        except FileUpload.DoesNotExist:
+            raise NotFound('Upload not found')
+
+        if upload.status != 'pending':
+            return Response({'error': f'Upload is {upload.status}'}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.offset != upload.file_size:
             return Response(
-                {'error': 'Room not found'}, 
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Upload is incomplete', 'offset': upload.offset},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Claim the upload so a retried completion doesn't store it twice
+        claimed = FileUpload.objects.filter(pk=upload.pk, status='pending').update(
+            status='complete', updated_at=timezone.now()
+        )
+        if not claimed:
+            return Response({'error': 'Upload already completed'}, status=status.HTTP_400_BAD_REQUEST)
+
+        path = uploads.staging_path(upload)
+        try:
+            sha256 = uploads.file_sha256(path)
+            if upload.sha256 and upload.sha256 != sha256:
+                FileUpload.objects.filter(pk=upload.pk).update(status='aborted')
+                uploads.discard_staging(upload)
+                return Response(
+                    {'error': 'Checksum mismatch', 'sha256': sha256},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            with open(path, 'rb') as staged:
+                blob = uploads.store_blob(staged, sha256, upload.file_size, upload.file_type, upload.file_name)
+
+            message, payload = _share_file(
+                request, upload.room, blob, upload.file_name, upload.file_type, upload.description
             )
         except Exception as e:
-            logger.error(f"File upload failed: {e}")
+            # Leave the staged data so the client can retry completion
+            FileUpload.objects.filter(pk=upload.pk).update(status='pending')
+            logger.error(f"Completing upload {upload.upload_id} failed: {e}")
             return Response(
-                {'error': f'File upload failed: {str(e)}'}, 
+                {'error': f'File upload failed: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        FileUpload.objects.filter(pk=upload.pk).update(sha256=sha256, file_url=blob.url, message=message)
+        uploads.discard_staging(upload)
+        return Response(payload, status=status.HTTP_201_CREATED)
+
 class UserPresenceAPI(APIView):
     """
     User Presence Management API
@@ -1391,9 +1631,9 @@ def room_suggestions(request):
         Q(title__icontains=query) |
         Q(name__icontains=query) |
         Q(description__icontains=query)
-    ).distinct().annotate(
-        member_count=Count('roommembership', filter=Q(roommembership__is_banned=False))
-    )[:10]
+    ).distinct().with_member_info(request.user).with_unread_count(
+        request.user
+    ).select_related('created_by', 'created_by__chat_profile')[:10]
     
     serializer = ChatRoomSerializer(rooms, many=True, context={'request': request})
     return Response(serializer.data)
@@ -1405,6 +1645,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     throttle_classes = [MessageRateThrottle]
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_class = MessageFilter
+    pagination_class = MessageCursorPagination
     ordering_fields = ['timestamp', 'id']
     ordering = ['-timestamp']
     
@@ -1421,15 +1662,8 @@ class MessageViewSet(viewsets.ModelViewSet):
             room__roommembership__user=self.request.user,
             room__roommembership__is_banned=False,
             is_deleted=False
-        ).select_related(
-            'user', 'user__chat_profile', 'reply_to', 'reply_to__user', 'room'
-        ).prefetch_related(
-            'read_receipts', 'reactions', 'edit_history'
-        ).only(
-            'id', 'room_id', 'user_id', 'content', 'message_type',
-            'file_url', 'file_name', 'file_size', 'file_type',
-            'reply_to_id', 'is_edited', 'edited_at', 'is_deleted',
-            'timestamp', 'user__username', 'user__email', 'user__first_name', 'user__last_name'
+        ).for_serializer(self.request.user).prefetch_related(
+            'edit_history'
         )
 
     def create(self, request, *args, **kwargs):
@@ -1459,6 +1693,9 @@ class MessageViewSet(viewsets.ModelViewSet):
             headers = self.get_success_headers(serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
             
+        except APIException:
+            # Validation errors and throttling (slow mode) keep their status
+            raise
         except Exception as e:
             logger.error(f"Error in message creation: {str(e)}")
             return Response(
@@ -1563,7 +1800,9 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        if 'content' in serializer.validated_data:
+            # Records the edit and drops the cached room snapshot
+            instance.edit_message(serializer.validated_data['content'])
         
         return Response(serializer.data)
     
@@ -1664,18 +1903,13 @@ class MessageViewSet(viewsets.ModelViewSet):
         """Mark message as read"""
         message = self.get_object()
         
-        receipt, created = MessageReadReceipt.objects.get_or_create(
-            message=message,
-            user=request.user
-        )
-        
-        # Clear unread count cache
-        cache_key = f"unread_{message.room_id}_{request.user.id}"
-        cache.delete(cache_key)
+        # Buffered; the write buffer bulk-inserts receipts, advances the
+        # member's read cursor and clears the unread cache on flush
+        get_write_buffer().mark_read(message.room_id, request.user.id, message.id)
         
         return Response({
             'status': 'message marked as read',
-            'read_at': receipt.read_at
+            'read_at': timezone.now()
         })
     
     @action(detail=True, methods=['post'])
@@ -1697,19 +1931,8 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            # Remove existing reaction if exists
-            Reaction.objects.filter(
-                message=message,
-                user=request.user
-            ).delete()
-            
-            # Add new reaction
-            reaction = Reaction.objects.create(
-                message=message,
-                user=request.user,
-                reaction_type=reaction_type
-            )
+        # Buffered upsert (one reaction per user per message)
+        get_write_buffer().set_reaction(message.room_id, message.id, request.user.id, reaction_type)
         
         return Response({
             'status': 'reaction added',
@@ -1729,13 +1952,14 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        discarded = get_write_buffer().discard_reaction(message.id, request.user.id, reaction_type)
         deleted_count, _ = Reaction.objects.filter(
             message=message,
             user=request.user,
             reaction_type=reaction_type
         ).delete()
         
-        if deleted_count > 0:
+        if deleted_count > 0 or discarded:
             return Response({'status': 'reaction removed'})
         else:
             return Response(
@@ -1747,9 +1971,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     def readers(self, request, pk=None):
         """Get users who have read this message"""
         message = self.get_object()
-        readers = message.read_receipts.select_related('user').order_by('-read_at')
-        
-        serializer = MessageReadReceiptSerializer(readers, many=True)
+        serializer = MessageReaderSerializer(message.readers(), many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
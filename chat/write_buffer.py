@@ -0,0 +1,244 @@
+# chat/write_buffer.py
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWriteBuffer:
+    """
+    Write-behind buffer for read receipts, reactions and presence.
+
+    Clients report "read up to message X" and reactions far more often than
+    anyone needs them persisted individually. Reports are coalesced in
+    memory per process and flushed on an interval (or when the buffer grows
+    past max_pending) as one bulk upsert for reactions and, per room/user,
+    one guarded UPDATE of the read cursor plus one receipt for the newest
+    message read. Reading is a high-water mark, so the messages before it
+    get no receipt rows of their own; RoomMembership.last_read_message_id
+    is what says whether a message has been read.
+
+    A reaction removed while a flush is writing it is remembered and deleted
+    again once that flush commits, so the upsert cannot bring it back.
+
+    Presence changes and heartbeats become at most two UPDATEs of
+    UserProfile.online/last_seen per flush, and profiles whose last_seen is
+    older than CHAT_PRESENCE_TTL are swept offline so a crashed worker can't
+    leave users marked online.
+
+    Anything still buffered when a worker dies is lost, which is acceptable
+    for this data; an orderly shutdown flushes via atexit.
+    """
+
+    def __init__(self, interval=2.0, max_pending=5000):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._receipts = {}   # (room_id, user_id) -> newest message_id read
+        self._reactions = {}  # (message_id, user_id) -> (room_id, reaction_type)
+        self._presence = {}   # user_id -> online
+        # Reactions taken by the flush in progress, and those of them
+        # removed before it committed: (message_id, user_id) -> reaction_type
+        self._flushing_reactions = {}
+        self._removed_while_flushing = {}
+
+    def mark_read(self, room_id, user_id, message_id):
+        """Record that user_id has read message_id (and everything before it) in room_id"""
+        key, message_id = (room_id, user_id), int(message_id)
+        with self._lock:
+            self._receipts[key] = max(self._receipts.get(key, 0), message_id)
+            pending = len(self._receipts) + len(self._reactions) + len(self._presence)
+        self._schedule(pending)
+
+    def set_reaction(self, room_id, message_id, user_id, reaction_type):
+        """Record the user's current reaction to a message (last write wins)"""
+        with self._lock:
+            self._reactions[(int(message_id), user_id)] = (room_id, reaction_type)
+            pending = len(self._receipts) + len(self._reactions) + len(self._presence)
+        self._schedule(pending)
+
+    def discard_reaction(self, message_id, user_id, reaction_type=None):
+        """Drop a buffered reaction that was removed before being flushed"""
+        key = (int(message_id), user_id)
+        with self._lock:
+            pending = self._reactions.get(key)
+            if pending is not None:
+                if reaction_type and pending[1] != reaction_type:
+                    return False
+                del self._reactions[key]
+                return True
+
+            flushing = self._flushing_reactions.get(key)
+            if flushing is None or (reaction_type and flushing[1] != reaction_type):
+                return False
+            # Being written right now; delete it again after the flush commits
+            self._removed_while_flushing[key] = flushing[1]
+            return True
+
+    def touch_presence(self, user_id, online=True):
+        """Record that user_id is (still) online or has gone offline everywhere"""
+        with self._lock:
+            self._presence[user_id] = online
+            pending = len(self._receipts) + len(self._reactions) + len(self._presence)
+        self._schedule(pending)
+
+    def _schedule(self, pending):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name='chat-write-buffer', daemon=True
+                    )
+                    self._thread.start()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        """Persist everything buffered so far"""
+        from .models import Message, MessageReadReceipt, Reaction, RoomMembership
+
+        with self._lock:
+            receipts, self._receipts = self._receipts, {}
+            reactions, self._reactions = self._reactions, {}
+            presence, self._presence = self._presence, {}
+            self._flushing_reactions = reactions
+
+        if presence:
+            self.flush_presence(presence)
+
+        if not receipts and not reactions:
+            return
+
+        try:
+            message_ids = set(receipts.values()) | {m for m, _ in reactions}
+            # Only keep reports for live messages in the room they were reported from
+            message_rooms = dict(
+                Message.objects.filter(id__in=message_ids, is_deleted=False).values_list('id', 'room_id')
+            )
+
+            cursors = {
+                (room_id, user_id): message_id
+                for (room_id, user_id), message_id in receipts.items()
+                if message_rooms.get(message_id) == room_id
+            }
+            receipt_rows = [
+                MessageReadReceipt(message_id=message_id, user_id=user_id)
+                for (room_id, user_id), message_id in cursors.items()
+            ]
+
+            reaction_rows = [
+                Reaction(message_id=message_id, user_id=user_id, reaction_type=reaction_type)
+                for (message_id, user_id), (room_id, reaction_type) in reactions.items()
+                if message_rooms.get(message_id) == room_id
+            ]
+
+            with transaction.atomic():
+                if receipt_rows:
+                    MessageReadReceipt.objects.bulk_create(
+                        receipt_rows, ignore_conflicts=True, batch_size=1000
+                    )
+
+                # High-water mark: cursors only ever move forward
+                for (room_id, user_id), message_id in cursors.items():
+                    RoomMembership.objects.filter(room_id=room_id, user_id=user_id).filter(
+                        Q(last_read_message_id__isnull=True) | Q(last_read_message_id__lt=message_id)
+                    ).update(last_read_message_id=message_id)
+
+                if reaction_rows:
+                    Reaction.objects.bulk_create(
+                        reaction_rows,
+                        update_conflicts=True,
+                        unique_fields=['message', 'user'],
+                        update_fields=['reaction_type', 'updated_at'],
+                        batch_size=1000,
+                    )
+
+        except Exception as e:
+            logger.error(
+                f"Failed to flush {len(receipts)} read cursors and {len(reactions)} reactions: {e}"
+            )
+
+        finally:
+            with self._lock:
+                removed, self._removed_while_flushing = self._removed_while_flushing, {}
+                self._flushing_reactions = {}
+            if removed:
+                self.delete_reactions(removed)
+
+    def delete_reactions(self, removed):
+        """Delete reactions removed while a flush was writing them"""
+        from .models import Reaction
+
+        match = Q(pk__in=[])
+        for (message_id, user_id), reaction_type in removed.items():
+            match |= Q(message_id=message_id, user_id=user_id, reaction_type=reaction_type)
+        try:
+            Reaction.objects.filter(match).delete()
+        except Exception as e:
+            logger.error(f"Failed to delete {len(removed)} reactions removed during a flush: {e}")
+
+    def flush_presence(self, presence):
+        from .models import UserProfile
+
+        now = timezone.now()
+        try:
+            existing = set(
+                UserProfile.objects.filter(user_id__in=presence).values_list('user_id', flat=True)
+            )
+            with transaction.atomic():
+                UserProfile.objects.bulk_create(
+                    [
+                        UserProfile(user_id=user_id, online=online, last_seen=now)
+                        for user_id, online in presence.items()
+                        if user_id not in existing
+                    ],
+                    ignore_conflicts=True,
+                )
+                for online in (True, False):
+                    user_ids = [u for u, state in presence.items() if state is online and u in existing]
+                    if user_ids:
+                        UserProfile.objects.filter(user_id__in=user_ids).update(online=online, last_seen=now)
+
+                # Heartbeats keep live users' last_seen fresh; anyone else
+                # still flagged online belonged to a socket that died
+                UserProfile.objects.filter(
+                    online=True,
+                    last_seen__lt=now - timedelta(seconds=getattr(settings, 'CHAT_PRESENCE_TTL', 60)),
+                ).update(online=False)
+
+        except Exception as e:
+            logger.error(f"Failed to flush presence for {len(presence)} users: {e}")
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_buffer():
+    """Process-wide ChatWriteBuffer configured from settings"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ChatWriteBuffer(
+                    interval=getattr(settings, 'CHAT_WRITE_BUFFER_INTERVAL', 2.0),
+                    max_pending=getattr(settings, 'CHAT_WRITE_BUFFER_MAX_PENDING', 5000),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.utils import timezone
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Count, Sum
 from django.urls import reverse
 from django.utils.safestring import mark_safe
@@ -10,6 +11,7 @@ from .models import (
     DocumentCollaborator, DocumentVersion, AuditLog, DocumentAccessLog,
     DocumentComment, DocumentStatus, DocumentType, PermissionLevel, ChangeType
 )
+from .versioning import rebase_dependents
 
 # Inline Admin Classes
 class OrganizationMembershipInline(admin.TabularInline):
@@ -249,7 +251,7 @@ class DocumentVersionAdmin(admin.ModelAdmin):
     list_display = ('document', 'version_number', 'created_by', 'created_at', 'data_size', 'change_description_preview')
     list_filter = ('created_at',)
     search_fields = ('document__title', 'created_by__email', 'change_description')
-    readonly_fields = ('version_number', 'created_at', 'data_size', 'checksum')
+    readonly_fields = ('version_number', 'created_at', 'data_size', 'checksum', 'storage', 'base', 'depth')
     list_per_page = 25
     
     def change_description_preview(self, obj):
@@ -257,6 +259,17 @@ class DocumentVersionAdmin(admin.ModelAdmin):
             return obj.change_description[:50] + '...' if len(obj.change_description) > 50 else obj.change_description
         return '-'
     change_description_preview.short_description = 'Change Description'
+    
+    def get_deleted_objects(self, objs, request):
+        # Only deltas based on a version can protect it, and those are
+        # rebased before the delete (delete_queryset, DocumentVersion.delete)
+        deleted_objects, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        return deleted_objects, model_count, perms_needed, []
+    
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            rebase_dependents(queryset)
+            super().delete_queryset(request, queryset)
 
 # Audit Log Admin
 @admin.register(AuditLog)
@@ -0,0 +1,290 @@
+# editor/diff.py
+import copy
+from typing import Any, Dict, List
+
+# Structural diff between two versions of SpreadsheetDocument.editor_data.
+# Sheets are matched by name and compared cell by cell, formula by formula
+# and style by style, so the cost is one dict comparison per entry and
+# nothing is encoded to JSON. A sheet name that disappears from a position
+# where a new name appears is treated as a rename.
+#
+# The delta is a list of operations; apply_delta(old, delta) gives `new`
+# exactly. Cell edits use the editor.patches vocabulary where that is
+# lossless, so a client that applies PATCH operations can follow along:
+#
+#   {"op": "set_value",    "sheet": "Sheet1", "cell": "B2", "value": 42}
+#   {"op": "set_style",    "sheet": "Sheet1", "cell": "B2", "style": "bold"}
+#   {"op": "set_formula",  "sheet": "Sheet1", "cell": "B3", "formula": "=B2*2"}
+#   {"op": "rename_sheet", "sheet": "Sheet1", "name": "Budget"}
+#
+# (rename_sheet only renames here; the formula references PATCH would
+# rewrite arrive as set_formula operations of their own.) Everything else
+# uses operations PATCH does not accept:
+#
+#   {"op": "set_entry",    "sheet": "Sheet1", "field": "cells", "key": "B2", "value": {...}}
+#   {"op": "remove_entry", "sheet": "Sheet1", "field": "styles", "key": "bold"}
+#   {"op": "set_sheet_field",    "sheet": "Sheet1", "field": "config", "value": {...}}
+#   {"op": "remove_sheet_field", "sheet": "Sheet1", "field": "config"}
+#   {"op": "add_sheet",    "data": {...}}
+#   {"op": "remove_sheet", "sheet": "Sheet3"}
+#   {"op": "order_sheets", "names": ["Budget", "Sheet2"]}
+#   {"op": "set_field",    "field": "metadata", "value": {...}}
+#   {"op": "remove_field", "field": "metadata"}
+#
+# Unlike PATCH, applying a delta neither validates nor sanitizes: deltas
+# are computed from data that already went through both.
+
+# A save is significant (and gets a version) once this many cells, formulas
+# and styles changed, or a tenth of the workbook's cells if that is fewer
+SIGNIFICANT_CHANGES = 500
+SIGNIFICANT_FRACTION = 0.1
+
+# Per-sheet dicts diffed entry by entry
+ENTRY_FIELDS = ('cells', 'formulas', 'styles')
+
+STRUCTURAL_OPERATIONS = {
+    'rename_sheet', 'add_sheet', 'remove_sheet', 'order_sheets',
+    'set_sheet_field', 'remove_sheet_field', 'set_field', 'remove_field',
+}
+
+_MISSING = object()
+
+
+def diff_spreadsheets(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compare two versions of spreadsheet data. Returns change counts
+    (cells_changed, formulas_changed, styles_changed), the names of sheets
+    added, removed, renamed and modified, `cell_count` for the new data,
+    and `operations`, the delta from `old` to `new`.
+    """
+    old, new = old or {}, new or {}
+    result = {
+        'cells_changed': 0,
+        'formulas_changed': 0,
+        'styles_changed': 0,
+        'sheets_added': [],
+        'sheets_removed': [],
+        'sheets_renamed': [],
+        'sheets_modified': [],
+        'cell_count': _count_cells(new),
+        'operations': [],
+    }
+    operations = result['operations']
+
+    _diff_fields(old, new, {'sheets'}, operations, 'set_field', 'remove_field', {})
+
+    old_sheets, new_sheets = _sheets_by_name(old), _sheets_by_name(new)
+    if old_sheets is None or new_sheets is None:
+        # Missing, unnamed or duplicate sheets cannot be matched up; replace them all
+        if old.get('sheets', _MISSING) != new.get('sheets', _MISSING):
+            _diff_fields(old, new, (set(old) | set(new)) - {'sheets'}, operations, 'set_field', 'remove_field', {})
+            result['cells_changed'] = _count_cells(old) + result['cell_count']
+        return result
+
+    old_names, new_names = list(old_sheets), list(new_sheets)
+    renamed_from = {}
+    for index, name in enumerate(old_names[:len(new_names)]):
+        if name not in new_sheets and new_names[index] not in old_sheets:
+            renamed_from[new_names[index]] = name
+            operations.append({'op': 'rename_sheet', 'sheet': name, 'name': new_names[index]})
+            result['sheets_renamed'].append({'from': name, 'to': new_names[index]})
+    renamed_to = {name: new_name for new_name, name in renamed_from.items()}
+
+    for name in old_names:
+        if name not in new_sheets and name not in renamed_to:
+            operations.append({'op': 'remove_sheet', 'sheet': name})
+            result['sheets_removed'].append(name)
+            result['cells_changed'] += len(_entries(old_sheets[name], 'cells'))
+
+    for name, sheet in new_sheets.items():
+        previous = old_sheets.get(renamed_from.get(name, name))
+        if previous is None:
+            operations.append({'op': 'add_sheet', 'data': copy.deepcopy(sheet)})
+            result['sheets_added'].append(name)
+            result['cells_changed'] += len(_entries(sheet, 'cells'))
+        elif _diff_sheet(name, previous, sheet, operations, result):
+            result['sheets_modified'].append(name)
+
+    # Surviving sheets keep their old order and added ones go at the end
+    order = [renamed_to.get(name, name) for name in old_names if name in new_sheets or name in renamed_to]
+    if order + result['sheets_added'] != new_names:
+        operations.append({'op': 'order_sheets', 'names': new_names})
+
+    return result
+
+
+def is_significant_change(diff: Dict[str, Any]) -> bool:
+    """Whether the changes in a diff_spreadsheets result deserve their own version"""
+    if any(operation['op'] in STRUCTURAL_OPERATIONS for operation in diff['operations']):
+        return True
+    changed = diff['cells_changed'] + diff['formulas_changed'] + diff['styles_changed']
+    threshold = min(SIGNIFICANT_CHANGES, max(1, int(diff['cell_count'] * SIGNIFICANT_FRACTION)))
+    return changed >= threshold
+
+
+def change_summary(diff: Dict[str, Any]) -> Dict[str, Any]:
+    """A diff_spreadsheets result without the delta, for audit logs and responses"""
+    return {key: value for key, value in diff.items() if key not in ('operations', 'cell_count')}
+
+
+def apply_delta(data: Dict[str, Any], operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply a delta from diff_spreadsheets to `data` in place and return it"""
+    for operation in operations:
+        DELTA_OPERATIONS[operation['op']](data, operation)
+    return data
+
+
+def _sheets_by_name(data):
+    sheets = data.get('sheets')
+    if not isinstance(sheets, list):
+        return None
+    by_name = {}
+    for sheet in sheets:
+        name = sheet.get('name') if isinstance(sheet, dict) else None
+        if not isinstance(name, str) or name in by_name:
+            return None
+        by_name[name] = sheet
+    return by_name
+
+
+def _entries(sheet, field):
+    entries = sheet.get(field)
+    return entries if isinstance(entries, dict) else {}
+
+
+def _count_cells(data):
+    sheets = data.get('sheets')
+    if not isinstance(sheets, list):
+        return 0
+    return sum(len(_entries(sheet, 'cells')) for sheet in sheets if isinstance(sheet, dict))
+
+
+def _diff_fields(old, new, skip, operations, set_op, remove_op, target) -> bool:
+    """Whole-value operations for every key of `old`/`new` outside `skip` that differs"""
+    changed = False
+    for field in list(new) + [field for field in old if field not in new]:
+        if field in skip or old.get(field, _MISSING) == new.get(field, _MISSING):
+            continue
+        if field in new:
+            operations.append({'op': set_op, **target, 'field': field, 'value': copy.deepcopy(new[field])})
+        else:
+            operations.append({'op': remove_op, **target, 'field': field})
+        changed = True
+    return changed
+
+
+def _diff_entries(old, new):
+    """(key, old entry, new entry) for every key whose entry differs; absent entries are _MISSING"""
+    if old == new:
+        return []
+    changed = [(key, old.get(key, _MISSING), entry) for key, entry in new.items() if old.get(key, _MISSING) != entry]
+    changed += [(key, old[key], _MISSING) for key in old.keys() - new.keys()]
+    return changed
+
+
+def _diff_sheet(name, old, new, operations, result) -> bool:
+    """Append the operations turning sheet `old` into `new`; True if there were any"""
+    fields = [field for field in ENTRY_FIELDS if isinstance(old.get(field), dict) and isinstance(new.get(field), dict)]
+    changed = _diff_fields(
+        old, new, {'name', *fields}, operations, 'set_sheet_field', 'remove_sheet_field', {'sheet': name}
+    )
+
+    for field in fields:
+        for key, before, after in _diff_entries(old[field], new[field]):
+            operations.extend(_entry_operations(name, field, key, before, after))
+            result[f'{field}_changed'] += 1
+            changed = True
+
+    return changed
+
+
+def _entry_operations(sheet, field, key, before, after):
+    """The patches-style operation(s) reproducing `after` where one fits, otherwise set_entry/remove_entry"""
+    if field == 'formulas' and (after is _MISSING or (isinstance(after, str) and after)):
+        return [{'op': 'set_formula', 'sheet': sheet, 'cell': key, 'formula': None if after is _MISSING else after}]
+
+    if field == 'cells' and _cell_fields_only(before, after):
+        before = {} if before is _MISSING else before
+        return [
+            {'op': f'set_{cell_field}', 'sheet': sheet, 'cell': key, cell_field: after.get(cell_field)}
+            for cell_field in ('value', 'style')
+            if before.get(cell_field, _MISSING) != after.get(cell_field, _MISSING)
+        ]
+
+    if after is _MISSING:
+        return [{'op': 'remove_entry', 'sheet': sheet, 'field': field, 'key': key}]
+    return [{'op': 'set_entry', 'sheet': sheet, 'field': field, 'key': key, 'value': copy.deepcopy(after)}]
+
+
+def _cell_fields_only(before, after) -> bool:
+    """Whether set_value/set_style turn cell `before` into `after` exactly"""
+    cell_fields = {'value', 'style'}
+    if before is not _MISSING and (not isinstance(before, dict) or before.keys() - cell_fields):
+        return False
+    # Setting a field to null removes it, and a cell left empty is dropped
+    return (
+        isinstance(after, dict) and bool(after) and not after.keys() - cell_fields
+        and all(value is not None for value in after.values())
+    )
+
+
+def _sheet(data, name):
+    for sheet in data['sheets']:
+        if sheet['name'] == name:
+            return sheet
+    raise KeyError(name)
+
+
+def _set_cell_field(data, operation, field):
+    cells = _sheet(data, operation['sheet']).setdefault('cells', {})
+    value = operation[field]
+    if value is None:
+        cell = cells.get(operation['cell'])
+        if cell:
+            cell.pop(field, None)
+            if not cell:
+                del cells[operation['cell']]
+    else:
+        cells.setdefault(operation['cell'], {})[field] = value
+
+
+def _set_formula(data, operation):
+    formulas = _sheet(data, operation['sheet']).setdefault('formulas', {})
+    if operation['formula']:
+        formulas[operation['cell']] = operation['formula']
+    else:
+        formulas.pop(operation['cell'], None)
+
+
+def _set_entry(data, operation):
+    _sheet(data, operation['sheet']).setdefault(operation['field'], {})[operation['key']] = copy.deepcopy(operation['value'])
+
+
+def _remove_entry(data, operation):
+    _sheet(data, operation['sheet']).get(operation['field'], {}).pop(operation['key'], None)
+
+
+def _order_sheets(data, operation):
+    by_name = {sheet['name']: sheet for sheet in data['sheets']}
+    data['sheets'] = [by_name[name] for name in operation['names']]
+
+
+def _set_field(target, operation):
+    target[operation['field']] = copy.deepcopy(operation['value'])
+
+
+DELTA_OPERATIONS = {
+    'set_value': lambda data, op: _set_cell_field(data, op, 'value'),
+    'set_style': lambda data, op: _set_cell_field(data, op, 'style'),
+    'set_formula': _set_formula,
+    'set_entry': _set_entry,
+    'remove_entry': _remove_entry,
+    'rename_sheet': lambda data, op: _sheet(data, op['sheet']).__setitem__('name', op['name']),
+    'add_sheet': lambda data, op: data.setdefault('sheets', []).append(copy.deepcopy(op['data'])),
+    'remove_sheet': lambda data, op: data['sheets'].remove(_sheet(data, op['sheet'])),
+    'order_sheets': _order_sheets,
+    'set_sheet_field': lambda data, op: _set_field(_sheet(data, op['sheet']), op),
+    'remove_sheet_field': lambda data, op: _sheet(data, op['sheet']).pop(op['field'], None),
+    'set_field': _set_field,
+    'remove_field': lambda data, op: data.pop(op['field'], None),
+}
@@ -0,0 +1,36 @@
+# editor/management/commands/compact_document_versions.py
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite spreadsheet versions stored as full copies as compressed keyframes "
+        "and deltas, one document per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--document', type=int, action='append', dest='documents',
+            help='Only compact this document (repeatable)',
+        )
+
+    def handle(self, *args, **options):
+        from editor.models import DocumentVersion, VersionStorage
+        from editor.versioning import compact_history
+
+        document_ids = options['documents'] or list(
+            DocumentVersion.objects.filter(storage=VersionStorage.FULL)
+            .values_list('document_id', flat=True).distinct().order_by('document_id')
+        )
+
+        rewritten = before = after = 0
+        for document_id in document_ids:
+            versions, old_bytes, new_bytes = compact_history(document_id)
+            rewritten += versions
+            before += old_bytes
+            after += new_bytes
+
+        self.stdout.write(
+            f"Rewrote {rewritten} version(s) of {len(document_ids)} document(s): "
+            f"{before / (1024 * 1024):.1f} MB of full copies now take {after / (1024 * 1024):.1f} MB"
+        )
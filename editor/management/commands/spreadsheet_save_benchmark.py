@@ -0,0 +1,102 @@
+# editor/management/commands/spreadsheet_save_benchmark.py
+import hashlib
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+WORDS = ['revenue', 'cost', 'total', 'north', 'south', 'q1', 'q2', 'forecast', 'actual', 'budget']
+
+
+def make_workbook(cells, sheets=4, seed=0):
+    """A workbook of `cells` cells: numbers, short labels, a formula every tenth row, a few styles"""
+    rng = random.Random(seed)
+    per_sheet = max(1, cells // sheets)
+    workbook = {'app_version': '1.0.0', 'file_name': 'benchmark.xlsx', 'metadata': {}, 'sheets': []}
+    for s in range(sheets):
+        sheet_cells, formulas = {}, {}
+        for i in range(per_sheet):
+            column, row = 'ABCDEFGHIJ'[i % 10], i // 10 + 1
+            ref = f"{column}{row}"
+            if i % 10 == 0:
+                sheet_cells[ref] = {'value': f"{rng.choice(WORDS)} {rng.choice(WORDS)}", 'style': 'header'}
+            else:
+                sheet_cells[ref] = {'value': round(rng.uniform(-1e6, 1e6), 2)}
+            if row % 10 == 0 and column == 'J':
+                formulas[ref] = f"=SUM(B{row - 9}:I{row})"
+        workbook['sheets'].append({
+            'name': f"Sheet{s + 1}",
+            'cells': sheet_cells,
+            'formulas': formulas,
+            'styles': {'header': {'bold': True}},
+        })
+    return workbook
+
+
+def legacy_save(old_data, new_data):
+    """The encoding work one PUT used to do, in order; returns the checksum"""
+    from .spreadsheet_sanitize_benchmark import legacy_sanitize_sheet_data
+
+    len(json.dumps(new_data))                                  # SpreadsheetDataSerializer.validate
+    sanitized = legacy_sanitize_sheet_data(new_data)           # sanitize_sheet_data round trip
+    len(json.dumps(sanitized))                                 # document.size in the view
+    len(json.dumps(sanitized))                                 # SpreadsheetDocument.save() size
+    json.dumps(sanitized)                                      # JSONField validation in full_clean()
+    json.dumps(sanitized)                                      # adapting the column for the UPDATE
+    json.dumps(old_data, sort_keys=True)                       # _is_significant_change
+    json.dumps(sanitized, sort_keys=True)
+    len(json.dumps(sanitized))                                 # calculate_spreadsheet_stats
+    len(json.dumps(sanitized)) - len(json.dumps(old_data))     # audit log size_change
+    return hashlib.md5(json.dumps(sanitized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def current_save(old_data, old_size, new_data):
+    """The same steps through the single-encoding pipeline"""
+    from editor.diff import diff_spreadsheets, is_significant_change
+    from editor.utils import calculate_spreadsheet_stats, checksum_encoded_data, sanitize_sheet_data
+
+    sanitized = sanitize_sheet_data(new_data)
+    is_significant_change(diff_spreadsheets(old_data, sanitized))
+    encoded = json.dumps(sanitized, sort_keys=True)            # set_editor_data
+    json.dumps(sanitized)                                      # adapting the column for the UPDATE
+    calculate_spreadsheet_stats(sanitized, data_size=len(encoded))
+    len(encoded) - old_size
+    return checksum_encoded_data(encoded)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the CPU side of a full spreadsheet save (validation sizing, sanitizing, "
+        "encoding, change detection, stats, checksum) against workbook size, for the "
+        "old repeated-encoding sequence and the current pipeline. No database access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cells', default='1000,10000,100000,500000', help='Comma-separated workbook sizes')
+        parser.add_argument('--iterations', type=int, default=5, help='Timed runs per size (median reported)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'cells':>8} {'size MB':>8} {'legacy ms':>10} {'current ms':>11} {'speedup':>8}")
+        for cells in [int(n) for n in options['cells'].split(',')]:
+            old_data = make_workbook(cells, seed=1)
+            new_data = make_workbook(cells, seed=2)
+            encoded_size = len(json.dumps(new_data))
+
+            legacy = self.time(lambda: legacy_save(old_data, new_data), options['iterations'])
+            current = self.time(
+                lambda: current_save(old_data, len(json.dumps(old_data)), new_data), options['iterations']
+            )
+            self.stdout.write(
+                f"{cells:>8} {encoded_size / (1024 * 1024):>8.2f} {legacy * 1000:>10.1f} "
+                f"{current * 1000:>11.1f} {legacy / current:>7.1f}x"
+            )
+
+    def time(self, run, iterations):
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            run()
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples)
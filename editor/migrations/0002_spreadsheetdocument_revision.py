@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('editor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spreadsheetdocument',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, verbose_name='data revision'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('editor', '0002_spreadsheetdocument_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='editor.documentversion'),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='depth'),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='payload',
+            field=models.BinaryField(blank=True, editable=False, null=True, verbose_name='payload'),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='storage',
+            field=models.CharField(choices=[('full', 'Full copy'), ('keyframe', 'Keyframe'), ('delta', 'Delta')], default='full', max_length=10, verbose_name='storage'),
+        ),
+        migrations.AlterField(
+            model_name='documentversion',
+            name='version_data',
+            field=models.JSONField(blank=True, null=True, verbose_name='version data'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 # editor/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -52,6 +52,11 @@ class ChangeType(models.TextChoices):
     RESTORED = 'restored', _('Restored')
     EXPORTED = 'exported', _('Exported')
 
+class VersionStorage(models.TextChoices):
+    FULL = 'full', _('Full copy')
+    KEYFRAME = 'keyframe', _('Keyframe')
+    DELTA = 'delta', _('Delta')
+
 class Organization(models.Model):
     """
     Organization model for multi-tenant support
@@ -275,6 +280,13 @@ class SpreadsheetDocument(models.Model):
         default=True
     )
     
+    # Bumped on every data save; patch clients send the revision they
+    # edited against and get a conflict if someone saved since
+    revision = models.PositiveIntegerField(
+        _('data revision'),
+        default=0
+    )
+    
     # Performance & Analytics
     size = models.IntegerField(
         _('data size'),
@@ -335,9 +347,18 @@ class SpreadsheetDocument(models.Model):
 
     def save(self, *args, **kwargs) -> None:
         """Enhanced save with automatic field updates"""
-        # Update size field
-        if self.editor_data:
-            self.size = len(json.dumps(self.editor_data))
+        update_fields = kwargs.get('update_fields')
+        data_changed = update_fields is None or 'editor_data' in update_fields
+        # Set by set_editor_data: size is current and the data is known to encode
+        pre_encoded = self.__dict__.pop('_encoded_data', None) is not None
+        
+        if data_changed:
+            # Update size field
+            if self.editor_data and not pre_encoded:
+                self.size = len(json.dumps(self.editor_data))
+            
+            # Calculate complexity score
+            self.complexity_score = self.calculate_complexity()
         
         # Update timestamps
         if not self.id:
@@ -345,17 +366,28 @@ class SpreadsheetDocument(models.Model):
         
         self.updated_at = timezone.now()
         
-        # Calculate complexity score
-        self.complexity_score = self.calculate_complexity()
-        
-        # Validate data before saving
-        self.full_clean()
+        # Validate data before saving; JSONField validation re-encodes the
+        # whole document, so skip it when the data is unchanged or was just encoded
+        self.full_clean(exclude=['editor_data'] if pre_encoded or not data_changed else None)
         
         super().save(*args, **kwargs)
         
         # Update search vector asynchronously (could be done with Celery)
         self.update_search_vector()
 
+    def set_editor_data(self, data: Dict[str, Any]) -> str:
+        """
+        Replace editor_data and set size from a single canonical (sorted-key)
+        JSON encoding of it. The encoding is returned so callers can reuse it
+        (checksum, version sizes) and the next save() doesn't encode again,
+        so the data must not be mutated in between.
+        """
+        encoded = json.dumps(data, sort_keys=True) if data else ''
+        self.editor_data = data
+        self.size = len(encoded)
+        self._encoded_data = encoded
+        return encoded
+
     def calculate_complexity(self) -> float:
         """Calculate spreadsheet complexity score"""
         if not self.editor_data:
@@ -454,16 +486,14 @@ class SpreadsheetDocument(models.Model):
         """Check if user can delete this document"""
         return user == self.owner
 
-    def create_version(self, user: 'UserType', description: str = "") -> 'DocumentVersion':
-        """Create a version snapshot of the document"""
-        return DocumentVersion.objects.create(
-            document=self,
-            version_data=self.editor_data.copy() if self.editor_data else {},
-            created_by=user,
-            version_number=self.versions.count() + 1,
-            change_description=description,
-            checksum=self.calculate_checksum()
-        )
+    def create_version(self, user: 'UserType', description: str = "", encoded: Optional[str] = None) -> 'DocumentVersion':
+        """
+        Create a version snapshot of the document, stored as a delta from
+        the previous version where that pays off (see editor.versioning).
+        Pass `encoded` from set_editor_data to reuse it.
+        """
+        from .versioning import create_version
+        return create_version(self, user, description=description, encoded=encoded)
 
     def calculate_checksum(self) -> str:
         """Calculate checksum for data integrity verification"""
@@ -605,11 +635,34 @@ class DocumentVersion(models.Model):
         related_name='versions'
     )
     version_number = models.IntegerField(_('version number'))
-    version_data = models.JSONField(_('version data'))
+    # Only set for versions stored as full copies; see editor.versioning
+    version_data = models.JSONField(_('version data'), null=True, blank=True)
+    storage = models.CharField(
+        _('storage'),
+        max_length=10,
+        choices=VersionStorage.choices,
+        default=VersionStorage.FULL
+    )
+    # Compressed keyframe data, or the delta from `base`
+    payload = models.BinaryField(_('payload'), null=True, blank=True, editable=False)
+    # RESTRICT rather than PROTECT so deleting the document can cascade
+    # through a chain; delete() rebases dependents of a single version
+    base = models.ForeignKey(
+        'self',
+        on_delete=models.RESTRICT,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    # Deltas between this version and its keyframe
+    depth = models.PositiveSmallIntegerField(_('depth'), default=0)
     created_at = models.DateTimeField(_('created at'), default=timezone.now)
+    # Not CASCADE: deleting a user must not delete versions that other
+    # users' deltas are based on
     created_by = models.ForeignKey(
         UserType,
-        on_delete=models.CASCADE,
+        on_delete=models.SET_NULL,
+        null=True,
         related_name='created_versions'
     )
     change_description = models.TextField(
@@ -631,14 +684,27 @@ class DocumentVersion(models.Model):
         return f"v{self.version_number} - {self.document.title}"
 
     def save(self, *args, **kwargs) -> None:
-        """Calculate data size before saving"""
-        if self.version_data:
+        """Calculate data size before saving, unless the creator already knows it"""
+        if self.version_data and not self.data_size:
             self.data_size = len(json.dumps(self.version_data))
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        """Delete this version, first rewriting any delta based on it as a keyframe"""
+        from .versioning import rebase_dependents
+        with transaction.atomic():
+            rebase_dependents([self])
+            return super().delete(*args, **kwargs)
+
+    def get_data(self, cache: Optional[Dict[int, Any]] = None) -> Dict[str, Any]:
+        """The document data recorded by this version"""
+        from .versioning import load_version_data
+        return load_version_data(self, cache)
+
     def restore(self, user: 'UserType') -> SpreadsheetDocument:
         """Restore this version as the current document"""
-        self.document.editor_data = self.version_data
+        self.document.set_editor_data(self.get_data())
+        self.document.revision += 1
         self.document.last_modified_by = user
         self.document.save()
         return self.document
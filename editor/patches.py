@@ -0,0 +1,264 @@
+# editor/patches.py
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from django.core.exceptions import ValidationError
+
+from .utils import _is_valid_cell_reference, _is_valid_cell_value, sanitize_value, validate_sheet_names
+from .validators import validate_formula_syntax
+
+# Cell-level edits for SpreadsheetDocument.editor_data, so a client changing
+# one cell sends that cell instead of the whole workbook. A patch is a list
+# of operations applied in order to the stored document:
+#
+#   {"op": "set_value",   "sheet": "Sheet1", "cell": "B2", "value": 42}
+#   {"op": "set_formula", "sheet": "Sheet1", "cell": "B3", "formula": "=B2*2"}
+#   {"op": "set_style",   "sheet": "Sheet1", "cell": "B2", "style": "bold"}
+#   {"op": "clear_cell",  "sheet": "Sheet1", "cell": "B2"}
+#   {"op": "insert_rows", "sheet": "Sheet1", "row": 5, "count": 2}
+#   {"op": "delete_rows", "sheet": "Sheet1", "row": 5, "count": 2}
+#   {"op": "rename_sheet", "sheet": "Sheet1", "name": "Budget"}
+#
+# A null value, formula or style removes it. Inserting or deleting rows
+# moves the cells below and rewrites formula references to them in every
+# sheet; ranges shrink to the rows left, and references whose rows were all
+# deleted become #REF!.
+
+MAX_ROWS_PER_OPERATION = 10000
+
+# Operations that reshape a sheet rather than edit cells
+STRUCTURAL_OPERATIONS = {'insert_rows', 'delete_rows', 'rename_sheet'}
+
+CELL_KEY_RE = re.compile(r'^([A-Za-z]{1,3})([1-9]\d*)$')
+
+# A cell reference or range inside a formula, optionally qualified with a
+# sheet name (Sheet2!A1, 'My Sheet'!A1:B5), and not part of a longer name
+# like LOG10(. String literals match as a whole so references are never
+# rewritten inside them.
+FORMULA_REF_RE = re.compile(
+    r'(?P<string>"(?:[^"]|"")*")|'
+    r"(?<![A-Za-z0-9_.$'!])"
+    r"(?:(?P<sheet>'(?:[^']|'')+'|[A-Za-z_][A-Za-z0-9_.]*)!)?"
+    r"(?P<col>\$?[A-Za-z]{1,3})(?P<row_abs>\$?)(?P<row>\d+)"
+    r"(?::(?P<end_col>\$?[A-Za-z]{1,3})(?P<end_row_abs>\$?)(?P<end_row>\d+))?"
+    r"(?![A-Za-z0-9_(!])"
+)
+
+UNQUOTED_SHEET_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+
+
+class PatchError(ValueError):
+    """An operation that cannot be applied to the document"""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(f"Operation {index}: {message}")
+        self.index = index
+        self.message = message
+
+
+def apply_operations(data: Dict[str, Any], operations: List[Dict[str, Any]]) -> None:
+    """
+    Apply `operations` to spreadsheet `data` in place. Values are sanitized
+    as they are written. Raises PatchError for the first operation that is
+    invalid; earlier operations have been applied by then, so callers apply
+    to a document they can discard.
+    """
+    sheets = data.get('sheets')
+    if not isinstance(sheets, list):
+        raise PatchError(0, "document has no sheets")
+
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise PatchError(index, "must be an object")
+        handler = OPERATIONS.get(operation.get('op'))
+        if handler is None:
+            raise PatchError(index, f"unknown op {operation.get('op')!r}")
+        try:
+            handler(sheets, _find_sheet(sheets, operation.get('sheet')), operation)
+        except KeyError as e:
+            raise PatchError(index, f"missing field {e}")
+        except (TypeError, ValueError) as e:
+            raise PatchError(index, str(e))
+
+
+def _find_sheet(sheets: List[Dict[str, Any]], name: Any) -> Dict[str, Any]:
+    for i, sheet in enumerate(sheets):
+        if isinstance(sheet, dict) and sheet.get('name', f'Sheet{i+1}') == name:
+            return sheet
+    raise ValueError(f"no sheet named {name!r}")
+
+
+def _cell_ref(operation: Dict[str, Any]) -> str:
+    cell = operation['cell']
+    if not isinstance(cell, str) or not _is_valid_cell_reference(cell):
+        raise ValueError(f"invalid cell reference {cell!r}")
+    return cell.upper()
+
+
+def _row_range(operation: Dict[str, Any]) -> tuple:
+    row, count = operation['row'], operation.get('count', 1)
+    # bool is an int subclass; "row": true must not mean row 1
+    if type(row) is not int or type(count) is not int or row < 1 or not 1 <= count <= MAX_ROWS_PER_OPERATION:
+        raise ValueError("row must be >= 1 and count between 1 and %d" % MAX_ROWS_PER_OPERATION)
+    return row, count
+
+
+def _set_cell_field(sheet: Dict[str, Any], cell: str, field: str, value: Any) -> None:
+    cells = sheet.setdefault('cells', {})
+    if value is None:
+        cell_data = cells.get(cell)
+        if cell_data:
+            cell_data.pop(field, None)
+            if not cell_data:
+                del cells[cell]
+    else:
+        cells.setdefault(cell, {})[field] = value
+
+
+def set_value(sheets, sheet, operation):
+    value = operation['value']
+    if not _is_valid_cell_value(value):
+        raise ValueError("value must be a string, number, boolean or null")
+    _set_cell_field(sheet, _cell_ref(operation), 'value', sanitize_value(value))
+
+
+def set_style(sheets, sheet, operation):
+    style = operation['style']
+    if style is not None and not isinstance(style, str):
+        raise ValueError("style must be a style reference or null")
+    _set_cell_field(sheet, _cell_ref(operation), 'style', sanitize_value(style))
+
+
+def set_formula(sheets, sheet, operation):
+    cell, formula = _cell_ref(operation), operation['formula']
+    formulas = sheet.setdefault('formulas', {})
+    if formula is None or formula == '':
+        formulas.pop(cell, None)
+        return
+    if not isinstance(formula, str):
+        raise ValueError("formula must be a string or null")
+    try:
+        validate_formula_syntax(formula)
+    except ValidationError:
+        raise ValueError("formula contains a disallowed function")
+    formulas[cell] = sanitize_value(formula)
+
+
+def clear_cell(sheets, sheet, operation):
+    cell = _cell_ref(operation)
+    sheet.get('cells', {}).pop(cell, None)
+    sheet.get('formulas', {}).pop(cell, None)
+
+
+def insert_rows(sheets, sheet, operation):
+    row, count = _row_range(operation)
+    _move_rows(sheets, sheet, lambda r: r + count if r >= row else r)
+
+
+def delete_rows(sheets, sheet, operation):
+    row, count = _row_range(operation)
+    end = row + count
+    _move_rows(sheets, sheet, lambda r: r if r < row else (None if r < end else r - count))
+
+
+def rename_sheet(sheets, sheet, operation):
+    old_name, new_name = operation['sheet'], operation['name']
+    names = [s.get('name', f'Sheet{i+1}') for i, s in enumerate(sheets) if s is not sheet]
+    if not isinstance(new_name, str) or not validate_sheet_names(names + [new_name]):
+        raise ValueError(f"invalid or duplicate sheet name {new_name!r}")
+    sheet['name'] = new_name
+
+    def rename(match):
+        if match.group('sheet') is None or _unquote(match.group('sheet')) != old_name:
+            return match.group(0)
+        return _format_ref(match, _quote(new_name), int(match.group('row')), _end_row(match))
+
+    _rewrite_formulas(sheets, rename)
+
+
+def _move_rows(sheets, sheet, new_row: Callable[[int], Optional[int]]) -> None:
+    """Re-key `sheet`'s cells and formulas by `new_row` (None drops them) and fix references to them"""
+    for field in ('cells', 'formulas'):
+        entries = sheet.get(field)
+        if not entries:
+            continue
+        moved = {}
+        for key, value in entries.items():
+            match = CELL_KEY_RE.match(key)
+            if not match:
+                moved[key] = value
+                continue
+            row = new_row(int(match.group(2)))
+            if row is not None:
+                moved[f"{match.group(1)}{row}"] = value
+        sheet[field] = moved
+
+    name = sheet.get('name')
+
+    def shift(match, formula_sheet):
+        if match.group('string') is not None:
+            return match.group(0)
+        target = _unquote(match.group('sheet')) if match.group('sheet') else formula_sheet.get('name')
+        if target != name:
+            return match.group(0)
+        start, end = int(match.group('row')), _end_row(match)
+        if end is None:
+            row = new_row(start)
+            return '#REF!' if row is None else _format_ref(match, match.group('sheet'), row)
+        # A range shrinks to the rows that survive and is only lost when
+        # all of them are deleted
+        step = 1 if start <= end else -1
+        first = next((r for r in range(start, end + step, step) if new_row(r) is not None), None)
+        if first is None:
+            return '#REF!'
+        last = next(r for r in range(end, start - step, -step) if new_row(r) is not None)
+        return _format_ref(match, match.group('sheet'), new_row(first), new_row(last))
+
+    _rewrite_formulas(sheets, shift, with_sheet=True)
+
+
+def _rewrite_formulas(sheets, replace, with_sheet=False) -> None:
+    for sheet in sheets:
+        formulas = sheet.get('formulas') if isinstance(sheet, dict) else None
+        if not formulas:
+            continue
+        repl = (lambda m, s=sheet: replace(m, s)) if with_sheet else replace
+        for cell, formula in formulas.items():
+            if isinstance(formula, str):
+                formulas[cell] = FORMULA_REF_RE.sub(repl, formula)
+
+
+def _end_row(match) -> Optional[int]:
+    return int(match.group('end_row')) if match.group('end_row') else None
+
+
+def _format_ref(match, sheet: Optional[str], row: int, end_row: Optional[int] = None) -> str:
+    """`match`'s reference with `sheet` as its qualifier and its rows replaced"""
+    ref = f"{sheet}!" if sheet else ''
+    ref += f"{match.group('col')}{match.group('row_abs')}{row}"
+    if end_row is not None:
+        ref += f":{match.group('end_col')}{match.group('end_row_abs')}{end_row}"
+    return ref
+
+
+def _unquote(sheet_ref: str) -> str:
+    if sheet_ref.startswith("'"):
+        return sheet_ref[1:-1].replace("''", "'")
+    return sheet_ref
+
+
+def _quote(name: str) -> str:
+    if UNQUOTED_SHEET_NAME_RE.match(name):
+        return name
+    return "'" + name.replace("'", "''") + "'"
+
+
+OPERATIONS = {
+    'set_value': set_value,
+    'set_formula': set_formula,
+    'set_style': set_style,
+    'clear_cell': clear_cell,
+    'insert_rows': insert_rows,
+    'delete_rows': delete_rows,
+    'rename_sheet': rename_sheet,
+}
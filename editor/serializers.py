@@ -5,6 +5,9 @@ from django.utils import timezone
 import json
 from django.contrib.auth import get_user_model
 User = get_user_model()
+
+# Largest editor_data accepted by a full save or left by a PATCH
+MAX_SPREADSHEET_DATA_SIZE = 15 * 1024 * 1024  # 15MB total
 import re
 import hashlib
 from typing import Dict, Any, List
@@ -143,10 +146,10 @@ class SpreadsheetDocumentSerializer(DynamicFieldsModelSerializer):
             'permissions',
             
             # Data field (carefully managed)
-            'editor_data'
+            'editor_data', 'revision'
         ]
         read_only_fields = [
-            'id', 'owner', 'owner_info', 'owner_username', 'organization_info',
+            'id', 'revision', 'owner', 'owner_info', 'owner_username', 'organization_info',
             'created_at', 'updated_at', 'last_accessed_at', 'document_size',
             'sheet_count', 'is_editable', 'collaborator_count', 'version_count',
             'last_version_date', 'status_display', 'permissions', 'last_modified_by_username'
@@ -265,7 +268,9 @@ class SpreadsheetDocumentSerializer(DynamicFieldsModelSerializer):
             })
         
         # Sanitize data to prevent XSS and other attacks
-        sanitized_data = sanitize_sheet_data(value)
+        sanitized_data = sanitize_sheet_data(
+            value, previous=self.instance.editor_data if self.instance else None
+        )
         
         return sanitized_data
 
@@ -576,13 +581,13 @@ class SpreadsheetDataSerializer(serializers.Serializer):
 
     def validate(self, attrs: Dict[str, Any]) -> Dict[str, Any]:
         """Global validation for the entire spreadsheet data structure"""
-        # Calculate and validate total data size
-        total_size = len(json.dumps(attrs))
-        max_total_size = 15 * 1024 * 1024  # 15MB total
+        # Calculate and validate total data size; views pass the request's
+        # Content-Length so a large document isn't re-encoded just to measure it
+        total_size = self.context.get('content_length') or len(json.dumps(attrs))
         
-        if total_size > max_total_size:
+        if total_size > MAX_SPREADSHEET_DATA_SIZE:
             raise serializers.ValidationError(
-                f"Total document size ({total_size} bytes) exceeds maximum allowed ({max_total_size} bytes)"
+                f"Total document size ({total_size} bytes) exceeds maximum allowed ({MAX_SPREADSHEET_DATA_SIZE} bytes)"
             )
         
         # Validate cross-sheet references
@@ -605,9 +610,24 @@ class SpreadsheetDataSerializer(serializers.Serializer):
         # Ensure consistent data types
         pass
 
+class SpreadsheetPatchSerializer(serializers.Serializer):
+    """Cell-level operations against a known revision (see editor.patches)"""
+    base_revision = serializers.IntegerField(
+        min_value=0,
+        help_text="Document revision the operations were made against."
+    )
+    operations = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=1000,
+        help_text="Operations applied in order: set_value, set_formula, set_style, clear_cell, "
+                  "insert_rows, delete_rows, rename_sheet."
+    )
+
 class DocumentVersionSerializer(serializers.ModelSerializer):
     """Serializer for document versions"""
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
+    version_data = serializers.SerializerMethodField()
     data_size = serializers.SerializerMethodField()
     
     class Meta:
@@ -623,11 +643,14 @@ class DocumentVersionSerializer(serializers.ModelSerializer):
         ]
         ref_name = "EditorDocumentVersion"  # ADDED
 
+    def get_version_data(self, obj) -> Dict[str, Any]:
+        """Version data, rebuilt from its keyframe and deltas if need be"""
+        # Shared across a page: a delta whose base is already loaded replays from it
+        return obj.get_data(cache=self.context.setdefault('version_data_cache', {}))
+
     def get_data_size(self, obj) -> int:
-        """Calculate version data size"""
-        if obj.version_data:
-            return len(json.dumps(obj.version_data))
-        return 0
+        """Encoded size of the version data, recorded when it was saved"""
+        return obj.data_size
 
 class BulkOperationSerializer(serializers.Serializer):
     """Serializer for bulk operations"""
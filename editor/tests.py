@@ -1,3 +1,461 @@
-from django.test import TestCase
+import copy
+import random
+import re
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .admin import DocumentVersionAdmin
+from .diff import apply_delta, diff_spreadsheets, is_significant_change
+from .models import DocumentVersion, SpreadsheetDocument, VersionStorage
+from .utils import sanitize_sheet_data, sanitize_string
+from .versioning import compact_history
+
+User = get_user_model()
+
+
+def workbook(first_value, cells=200):
+    """A one-sheet workbook where only A1 differs between calls"""
+    sheet_cells = {f"A{row}": {'value': row * 10} for row in range(2, cells + 1)}
+    sheet_cells['A1'] = {'value': first_value}
+    return {
+        'app_version': '1.0.0',
+        'file_name': 'versions.xlsx',
+        'sheets': [{'name': 'Sheet1', 'cells': sheet_cells, 'formulas': {}, 'styles': {}}],
+    }
+
+
+class VersioningTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='editor@example.com', password='password', first_name='Test', last_name='Editor'
+        )
+        self.document = SpreadsheetDocument.objects.create(title='Versions', owner=self.user)
+
+    def save_versions(self, count):
+        """Save `count` edits of the document, each with a version; returns (versions, data)"""
+        versions, data = [], []
+        for i in range(count):
+            data.append(workbook(f"edit {i}"))
+            self.document.set_editor_data(copy.deepcopy(data[-1]))
+            self.document.save()
+            versions.append(self.document.create_version(self.user))
+        return versions, data
+
+    def reload(self, versions):
+        return [DocumentVersion.objects.get(pk=version.pk) for version in versions]
+
+    @override_settings(SPREADSHEET_VERSION_KEYFRAME_INTERVAL=3)
+    def test_versions_alternate_keyframes_and_deltas(self):
+        versions, data = self.save_versions(7)
+
+        versions = self.reload(versions)
+        K, D = VersionStorage.KEYFRAME, VersionStorage.DELTA
+        self.assertEqual([v.storage for v in versions], [K, D, D, K, D, D, K])
+        self.assertEqual([v.depth for v in versions], [0, 1, 2, 0, 1, 2, 0])
+        for previous, version in zip(versions, versions[1:]):
+            self.assertEqual(version.base_id, previous.pk if version.storage == D else None)
+            self.assertIsNone(version.version_data)
+
+    @override_settings(SPREADSHEET_VERSION_KEYFRAME_INTERVAL=3)
+    def test_every_version_replays_to_its_data(self):
+        versions, data = self.save_versions(7)
+
+        for version, expected in zip(self.reload(versions), data):
+            self.assertEqual(version.get_data(), expected)
+
+        # A shared cache replays each delta onto the version before it
+        cache = {}
+        for version, expected in zip(self.reload(versions), data):
+            self.assertEqual(version.get_data(cache), expected)
+
+    def test_deltas_are_smaller_than_the_data(self):
+        versions, data = self.save_versions(2)
+
+        keyframe, delta = self.reload(versions)
+        self.assertEqual(delta.storage, VersionStorage.DELTA)
+        self.assertLess(len(delta.payload), len(keyframe.payload))
+        self.assertEqual(delta.data_size, keyframe.data_size)
+
+    def test_compact_history_rewrites_full_copies(self):
+        data = [workbook(f"legacy {i}") for i in range(5)]
+        for number, version_data in enumerate(data, 1):
+            DocumentVersion.objects.create(
+                document=self.document, version_number=number, version_data=copy.deepcopy(version_data),
+                created_by=self.user, checksum='',
+            )
+
+        rewritten, before, after = compact_history(self.document.pk)
+
+        self.assertEqual(rewritten, 5)
+        self.assertLess(after, before)
+        versions = list(self.document.versions.order_by('version_number'))
+        self.assertEqual(
+            [v.storage for v in versions],
+            [VersionStorage.KEYFRAME] + [VersionStorage.DELTA] * 4,
+        )
+        for version, expected in zip(versions, data):
+            self.assertIsNone(version.version_data)
+            self.assertEqual(version.get_data(), expected)
+
+        # Already compact
+        self.assertEqual(compact_history(self.document.pk), (0, 0, 0))
+
+    def test_deleting_a_base_version_rebases_its_dependents(self):
+        versions, data = self.save_versions(4)
+
+        versions[1].delete()
+
+        first, third, fourth = self.reload([versions[0], versions[2], versions[3]])
+        self.assertEqual((third.storage, third.base_id, third.depth), (VersionStorage.KEYFRAME, None, 0))
+        self.assertEqual((fourth.storage, fourth.base_id, fourth.depth), (VersionStorage.DELTA, third.pk, 1))
+        for version, expected in zip([first, third, fourth], [data[0], data[2], data[3]]):
+            self.assertEqual(version.get_data(), expected)
+
+    def test_versions_after_a_deletion_are_numbered_past_the_latest(self):
+        versions, data = self.save_versions(4)
+        versions[1].delete()
+
+        later, later_data = self.save_versions(2)
+
+        self.assertEqual([v.version_number for v in self.reload(later)], [5, 6])
+        cache = {}
+        for version, expected in zip(self.reload(versions[:1] + versions[2:] + later), data[:1] + data[2:] + later_data):
+            self.assertEqual(version.get_data(), expected)
+            self.assertEqual(version.get_data(cache), expected)
+
+    def test_deleting_a_user_keeps_versions_others_build_on(self):
+        other = User.objects.create_user(
+            email='collaborator@example.com', password='password', first_name='Test', last_name='Collaborator'
+        )
+        self.document.set_editor_data(workbook('by collaborator'))
+        self.document.save()
+        base = self.document.create_version(other)
+        versions, data = self.save_versions(1)
+
+        other.delete()
+
+        base, delta = self.reload([base, versions[0]])
+        self.assertIsNone(base.created_by)
+        self.assertEqual(delta.base_id, base.pk)
+        self.assertEqual(delta.get_data(), data[0])
+
+    def test_admin_delete_rebases_surviving_dependents(self):
+        versions, data = self.save_versions(4)
+        model_admin = DocumentVersionAdmin(DocumentVersion, admin.site)
+
+        model_admin.delete_queryset(None, DocumentVersion.objects.filter(pk__in=[versions[0].pk, versions[1].pk]))
+
+        third, fourth = self.reload(versions[2:])
+        self.assertEqual(third.storage, VersionStorage.KEYFRAME)
+        self.assertEqual(fourth.base_id, third.pk)
+        self.assertEqual(third.get_data(), data[2])
+        self.assertEqual(fourth.get_data(), data[3])
+
+
+class SpreadsheetPatchAPITests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='patcher@example.com', password='password', first_name='Test', last_name='Patcher'
+        )
+        self.document = SpreadsheetDocument.objects.create(title='Patched', owner=self.user)
+        self.document.set_editor_data(workbook('start', cells=5))
+        self.document.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def patch(self, operations, base_revision=None):
+        if base_revision is None:
+            base_revision = SpreadsheetDocument.objects.get(pk=self.document.pk).revision
+        return self.client.patch(
+            f'/api/editor/sheets/{self.document.pk}/data/',
+            {'base_revision': base_revision, 'operations': operations},
+            format='json',
+        )
+
+    def test_document_update_with_data_bumps_the_revision(self):
+        revision = self.document.revision
+
+        response = self.client.patch(
+            f'/api/editor/sheets/{self.document.pk}/',
+            {'editor_data': workbook('saved', cells=5)},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.revision, revision + 1)
+        response = self.patch(
+            [{'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'A1', 'value': 'stale'}], base_revision=revision
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['revision'], revision + 1)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.editor_data['sheets'][0]['cells']['A1'], {'value': 'saved'})
+
+    def stored_sheet(self):
+        return SpreadsheetDocument.objects.get(pk=self.document.pk).editor_data['sheets'][0]
+
+    def test_cell_operations(self):
+        revision = self.document.revision
+
+        response = self.patch([
+            {'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'b2', 'value': 42},
+            {'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'B3', 'value': '<script>alert(1)</script>hi'},
+            {'op': 'set_style', 'sheet': 'Sheet1', 'cell': 'B2', 'style': 'bold'},
+            {'op': 'set_formula', 'sheet': 'Sheet1', 'cell': 'C1', 'formula': '=B2*2'},
+            {'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'A1', 'value': None},
+            {'op': 'clear_cell', 'sheet': 'Sheet1', 'cell': 'A2'},
+        ])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['operations_applied'], 6)
+        self.assertEqual(response.data['revision'], revision + 1)
+        sheet = self.stored_sheet()
+        self.assertEqual(sheet['cells']['B2'], {'value': 42, 'style': 'bold'})
+        self.assertEqual(sheet['cells']['B3'], {'value': 'hi'})
+        self.assertEqual(sheet['formulas'], {'C1': '=B2*2'})
+        self.assertNotIn('A1', sheet['cells'])
+        self.assertNotIn('A2', sheet['cells'])
+
+    def test_insert_rows_moves_cells_and_references_but_not_strings(self):
+        self.patch([{'op': 'set_formula', 'sheet': 'Sheet1', 'cell': 'C1', 'formula': '="Row A1 total"&A1+SUM(A2:A5)'}])
+
+        response = self.patch([{'op': 'insert_rows', 'sheet': 'Sheet1', 'row': 1, 'count': 2}])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        sheet = self.stored_sheet()
+        self.assertEqual(sheet['formulas'], {'C3': '="Row A1 total"&A3+SUM(A4:A7)'})
+        self.assertEqual(sheet['cells']['A3'], {'value': 'start'})
+        self.assertNotIn('A1', sheet['cells'])
+
+    def test_delete_rows_shrinks_ranges_and_breaks_lost_references(self):
+        self.patch([
+            {'op': 'set_formula', 'sheet': 'Sheet1', 'cell': 'C1', 'formula': '=SUM(A2:A5)'},
+            {'op': 'set_formula', 'sheet': 'Sheet1', 'cell': 'D1', 'formula': '=A3+SUM(A2:A3)'},
+            {'op': 'set_formula', 'sheet': 'Sheet1', 'cell': 'E1', 'formula': '=A4'},
+        ])
+
+        response = self.patch([{'op': 'delete_rows', 'sheet': 'Sheet1', 'row': 2, 'count': 2}])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        sheet = self.stored_sheet()
+        self.assertEqual(sheet['formulas'], {'C1': '=SUM(A2:A3)', 'D1': '=#REF!+SUM(#REF!)', 'E1': '=A2'})
+        self.assertEqual(sheet['cells']['A2'], {'value': 40})
+
+    def test_rename_sheet_rewrites_qualified_references(self):
+        self.patch([{'op': 'set_formula', 'sheet': 'Sheet1', 'cell': 'C1', 'formula': '=Sheet1!A2:A3&"Sheet1!A2"'}])
+
+        response = self.patch([{'op': 'rename_sheet', 'sheet': 'Sheet1', 'name': 'My Budget'}])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        sheet = self.stored_sheet()
+        self.assertEqual(sheet['name'], 'My Budget')
+        self.assertEqual(sheet['formulas'], {'C1': '=\'My Budget\'!A2:A3&"Sheet1!A2"'})
+
+    def test_stale_base_revision_is_a_conflict(self):
+        revision = self.document.revision
+        self.patch([{'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'A1', 'value': 'first'}], base_revision=revision)
+
+        response = self.patch(
+            [{'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'A1', 'value': 'second'}], base_revision=revision
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['revision'], revision + 1)
+        self.assertEqual(self.stored_sheet()['cells']['A1'], {'value': 'first'})
+
+    def test_invalid_operation_reports_its_index_and_changes_nothing(self):
+        revision = self.document.revision
+        invalid = [
+            {'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'ZZZZ1', 'value': 1},
+            {'op': 'set_value', 'sheet': 'Missing', 'cell': 'A1', 'value': 1},
+            {'op': 'insert_rows', 'sheet': 'Sheet1', 'row': True},
+            {'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'A1'},
+            {'op': 'transpose', 'sheet': 'Sheet1'},
+        ]
+        for operation in invalid:
+            response = self.patch([{'op': 'set_value', 'sheet': 'Sheet1', 'cell': 'A1', 'value': 'x'}, operation])
+
+            self.assertEqual(response.status_code, 400, operation)
+            self.assertEqual(response.data['operation'], 1)
+            self.assertTrue(response.data['errors'][0].startswith('Operation 1: '))
+
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.revision, revision)
+        self.assertEqual(self.stored_sheet()['cells']['A1'], {'value': 'start'})
+
+
+def legacy_sanitize_string(value):
+    """sanitize_value's string handling before the single-pass rewrite"""
+    value = re.sub(r'<script\b[^<]*(?:(?!<\/script>)<[^<]*)*<\/script>', '', value, flags=re.IGNORECASE)
+    value = re.sub(r'on\w+\s*=', 'data-removed=', value, flags=re.IGNORECASE)
+    value = re.sub(r'javascript:', 'data-removed:', value, flags=re.IGNORECASE)
+    return value[:10000]
+
+
+class SanitizerTests(SimpleTestCase):
+    def test_single_pass_matches_legacy_output(self):
+        inputs = [
+            'plain text', '', '=SUM(A1:A3)', 'one < two > three',
+            '<script>alert(1)</script>', 'a<SCRIPT type="x">b</sCrIpT>c', '<script>unclosed',
+            '<script><b>x</b></script>after', 'on<script></script>click=alert(1)',
+            '<img src=x onerror=alert(1)>', '<a ONCLICK = "x">', 'onload=', 'Only one',
+            'javascript:alert(1)', 'JavaScript:void(0)', '<a href="javascript:x" onmouseover=y>',
+            'x' * 10001, '<script>x</script>' + 'y' * 10050,
+        ]
+        for value in inputs:
+            self.assertEqual(sanitize_string(value), legacy_sanitize_string(value), value[:40])
+
+    def test_sanitizes_in_place(self):
+        cells = {'A1': {'value': '<script>x</script>kept'}, 'A2': {'value': 3}}
+        sheet = {'name': 'Sheet1', 'cells': cells, 'formulas': {'B1': '=A2 onclick=x'}}
+        data = {'app_version': '1.0', 'file_name': 'a.xlsx', 'sheets': [sheet]}
+
+        self.assertIs(sanitize_sheet_data(data), data)
+
+        self.assertIs(data['sheets'][0], sheet)
+        self.assertIs(sheet['cells'], cells)
+        self.assertEqual(cells, {'A1': {'value': 'kept'}, 'A2': {'value': 3}})
+        self.assertEqual(sheet['formulas'], {'B1': '=A2 data-removed=x'})
+
+    def test_cells_unchanged_since_previous_are_not_rescanned(self):
+        # The stored copy stands in for already-sanitized data; a cell equal
+        # to it is trusted as is, anything else is sanitized
+        unsafe = {'value': '<script>x</script>'}
+        previous = {'sheets': [{'name': 'Sheet1', 'cells': {'A1': dict(unsafe)}, 'formulas': {}}]}
+        data = {'sheets': [{
+            'name': 'Sheet1',
+            'cells': {'A1': dict(unsafe), 'A2': dict(unsafe)},
+            'formulas': {'B1': '=A1 onclick=x'},
+        }]}
+
+        sanitize_sheet_data(data, previous=previous)
+
+        sheet = data['sheets'][0]
+        self.assertEqual(sheet['cells'], {'A1': unsafe, 'A2': {'value': ''}})
+        self.assertEqual(sheet['formulas'], {'B1': '=A1 data-removed=x'})
+
+
+def sheet(name, cells=None, **fields):
+    return {'name': name, 'cells': cells or {}, 'formulas': {}, 'styles': {}, **fields}
+
+
+class SpreadsheetDiffTests(SimpleTestCase):
+    def assertRoundTrip(self, old, new):
+        """diff_spreadsheets(old, new) applied to a copy of old gives new; returns the diff"""
+        before = copy.deepcopy(old)
+        diff = diff_spreadsheets(old, new)
+        self.assertEqual(old, before)
+        self.assertEqual(apply_delta(copy.deepcopy(old), diff['operations']), new)
+        return diff
+
+    def test_cell_formula_and_style_changes(self):
+        old = {'app_version': '1.0', 'sheets': [sheet('Sheet1', {'A1': {'value': 1}, 'A2': {'value': 2}})]}
+        new = copy.deepcopy(old)
+        cells, formulas = new['sheets'][0]['cells'], new['sheets'][0]['formulas']
+        cells['A1'] = {'value': 10, 'style': 'bold'}
+        del cells['A2']
+        cells['B1'] = {'value': 'x', 'note': 'kept whole'}
+        formulas['C1'] = '=A1*2'
+        new['sheets'][0]['styles']['bold'] = {'font-weight': 'bold'}
+        new['metadata'] = {'author': 'test'}
+
+        diff = self.assertRoundTrip(old, new)
+
+        self.assertEqual((diff['cells_changed'], diff['formulas_changed'], diff['styles_changed']), (3, 1, 1))
+        self.assertEqual(diff['sheets_modified'], ['Sheet1'])
+        ops = {operation['op'] for operation in diff['operations']}
+        self.assertTrue({'set_value', 'set_style', 'set_formula', 'set_entry', 'remove_entry', 'set_field'} <= ops)
+
+        # And back again, removing what was added
+        self.assertRoundTrip(new, old)
+
+    def test_identical_data_has_no_operations(self):
+        data = {'sheets': [sheet('Sheet1', {'A1': {'value': 1}})]}
+
+        diff = self.assertRoundTrip(data, copy.deepcopy(data))
+
+        self.assertEqual(diff['operations'], [])
+        self.assertFalse(is_significant_change(diff))
+
+    def test_rename_in_place(self):
+        old = {'sheets': [sheet('Sheet1', {'A1': {'value': 1}}), sheet('Sheet2')]}
+        new = {'sheets': [sheet('Budget', {'A1': {'value': 1}}), sheet('Sheet2')]}
+
+        diff = self.assertRoundTrip(old, new)
+
+        self.assertEqual(diff['operations'], [{'op': 'rename_sheet', 'sheet': 'Sheet1', 'name': 'Budget'}])
+        self.assertEqual(diff['sheets_renamed'], [{'from': 'Sheet1', 'to': 'Budget'}])
+        self.assertEqual(diff['cells_changed'], 0)
+
+    def test_reorder_add_and_remove_sheets(self):
+        a, b, c = sheet('A', {'A1': {'value': 1}}), sheet('B'), sheet('C', {'A1': {'value': 3}, 'A2': {'value': 4}})
+        old = {'sheets': [a, b, c]}
+
+        reordered = self.assertRoundTrip(old, {'sheets': [copy.deepcopy(c), copy.deepcopy(a), copy.deepcopy(b)]})
+        self.assertEqual([operation['op'] for operation in reordered['operations']], ['order_sheets'])
+
+        removed = self.assertRoundTrip(old, {'sheets': [copy.deepcopy(a), copy.deepcopy(b)]})
+        self.assertEqual(removed['sheets_removed'], ['C'])
+        self.assertEqual(removed['cells_changed'], 2)
+
+        added = self.assertRoundTrip(old, {'sheets': [copy.deepcopy(a), copy.deepcopy(b), copy.deepcopy(c), sheet('D')]})
+        self.assertEqual(added['sheets_added'], ['D'])
+
+        self.assertRoundTrip(old, {'sheets': [sheet('D'), copy.deepcopy(a)]})
+
+    def test_unmatched_sheets_are_replaced_whole(self):
+        old = {'sheets': [sheet('A', {'A1': {'value': 1}})]}
+        new = {'sheets': [sheet('A'), sheet('A', {'B1': {'value': 2}})]}
+
+        diff = self.assertRoundTrip(old, new)
+
+        self.assertEqual(diff['cells_changed'], 2)
+        self.assertRoundTrip(new, old)
+
+    def test_random_edits_round_trip(self):
+        rng = random.Random(7)
+        values = [None, 0, 1.5, True, 'text', {'nested': [1, 2]}]
+        data = {'sheets': [sheet(f'Sheet{i}') for i in range(3)]}
+        for _ in range(200):
+            new = copy.deepcopy(data)
+            for _ in range(rng.randint(1, 5)):
+                target = rng.choice(new['sheets'])
+                field = rng.choice(['cells', 'formulas', 'styles'])
+                key = f"{rng.choice('ABC')}{rng.randint(1, 5)}"
+                choice = rng.random()
+                if choice < 0.2:
+                    target[field].pop(key, None)
+                elif field == 'formulas':
+                    target[field][key] = f'=A{rng.randint(1, 9)}'
+                elif field == 'cells':
+                    target[field][key] = {name: rng.choice(values) for name in rng.sample(['value', 'style', 'note'], 2)}
+                else:
+                    target[field][key] = rng.choice(values)
+            if rng.random() < 0.1:
+                rng.shuffle(new['sheets'])
+            if rng.random() < 0.1:
+                rng.choice(new['sheets'])['name'] += 'x'
+            self.assertRoundTrip(data, new)
+            data = new
+
+    def test_significance_threshold(self):
+        def diff_with(changed, cell_count, operations=()):
+            return {
+                'cells_changed': changed, 'formulas_changed': 0, 'styles_changed': 0,
+                'cell_count': cell_count, 'operations': list(operations),
+            }
+
+        # A tenth of the workbook's cells ...
+        self.assertFalse(is_significant_change(diff_with(9, 100)))
+        self.assertTrue(is_significant_change(diff_with(10, 100)))
+        # ... capped at SIGNIFICANT_CHANGES, and at least one change
+        self.assertFalse(is_significant_change(diff_with(499, 100000)))
+        self.assertTrue(is_significant_change(diff_with(500, 100000)))
+        self.assertFalse(is_significant_change(diff_with(0, 0)))
+        self.assertTrue(is_significant_change(diff_with(1, 0)))
+        # Structural changes always are
+        self.assertTrue(is_significant_change(diff_with(0, 1000, [{'op': 'rename_sheet'}])))
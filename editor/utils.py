@@ -204,34 +204,94 @@ def _validate_formula_syntax(formula: str, cell_ref: str, sheet_index: int) -> L
     
     return errors
 
-def sanitize_sheet_data(data: Dict[str, Any]) -> Dict[str, Any]:
+# Markup defused in every string of spreadsheet data: script elements are
+# dropped, inline event handlers and javascript: URLs are renamed so they no
+# longer run. UNSAFE_MARKUP_RE finds any of them in a single pass, so clean
+# strings (nearly all of them) are scanned once.
+UNSAFE_MARKUP_RE = re.compile(r'<script\b|on\w+\s*=|javascript:', re.IGNORECASE)
+SCRIPT_ELEMENT_RE = re.compile(r'<script\b[^<]*(?:(?!</script>)<[^<]*)*</script>', re.IGNORECASE)
+INLINE_SCRIPT_RE = re.compile(r'(?P<handler>on\w+\s*=)|(?P<url>javascript:)', re.IGNORECASE)
+_INLINE_SCRIPT_REPLACEMENTS = {'handler': 'data-removed=', 'url': 'data-removed:'}
+
+MAX_CELL_TEXT_LENGTH = 10000
+
+def _defuse_inline_script(match: re.Match) -> str:
+    return _INLINE_SCRIPT_REPLACEMENTS[match.lastgroup]
+
+def sanitize_string(value: str) -> str:
+    """Defuse markup in a single string and cap its length"""
+    if UNSAFE_MARKUP_RE.search(value):
+        # Scripts go first: dropping one can join the text around it into
+        # a new handler (on<script></script>click=)
+        value = SCRIPT_ELEMENT_RE.sub('', value)
+        value = INLINE_SCRIPT_RE.sub(_defuse_inline_script, value)
+    if len(value) > MAX_CELL_TEXT_LENGTH:
+        value = value[:MAX_CELL_TEXT_LENGTH]
+    return value
+
+# Cell values that never need scanning; checked by exact type so the
+# common numeric cell costs one set lookup
+_PLAIN_SCALAR_TYPES = frozenset((int, float, bool, type(None)))
+
+def sanitize_value(value: Any) -> Any:
+    """
+    Sanitize a cell value or any nested part of spreadsheet data. Dicts and
+    lists are sanitized in place and returned; numbers, booleans and None
+    pass through untouched.
     """
-    Sanitize spreadsheet data to prevent XSS and other attacks.
-    Returns a sanitized copy of the data.
+    if isinstance(value, str):
+        return sanitize_string(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if type(item) not in _PLAIN_SCALAR_TYPES:
+                value[key] = sanitize_value(item)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            if type(item) not in _PLAIN_SCALAR_TYPES:
+                value[index] = sanitize_value(item)
+    return value
+
+def sanitize_sheet_data(data: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Sanitize spreadsheet data in place to prevent XSS and other attacks,
+    and return it.
+    
+    `previous` is the document's stored (already sanitized) data: cells and
+    formulas equal to their stored counterpart in the same-named sheet are
+    not scanned again.
     """
     if not data:
         return {}
     
-    # Create a deep copy to avoid modifying original
-    sanitized = json.loads(json.dumps(data))
-    
-    def _sanitize_value(value: Any) -> Any:
-        """Recursively sanitize values"""
-        if isinstance(value, str):
-            # Basic XSS prevention - remove script tags and dangerous attributes
-            value = re.sub(r'<script\b[^<]*(?:(?!<\/script>)<[^<]*)*<\/script>', '', value, flags=re.IGNORECASE)
-            value = re.sub(r'on\w+\s*=', 'data-removed=', value, flags=re.IGNORECASE)
-            value = re.sub(r'javascript:', 'data-removed:', value, flags=re.IGNORECASE)
-            # Limit string length for cell values
-            if len(value) > 10000:
-                value = value[:10000]
-        elif isinstance(value, dict):
-            return {k: _sanitize_value(v) for k, v in value.items()}
-        elif isinstance(value, list):
-            return [_sanitize_value(item) for item in value]
-        return value
+    sheets = data.get('sheets')
+    previous_sheets = previous.get('sheets') if isinstance(previous, dict) else None
+    if not isinstance(sheets, list) or not isinstance(previous_sheets, list):
+        return sanitize_value(data)
     
-    return _sanitize_value(sanitized)
+    stored = {
+        sheet['name']: sheet for sheet in previous_sheets
+        if isinstance(sheet, dict) and isinstance(sheet.get('name'), str)
+    }
+    for key, value in data.items():
+        if key != 'sheets':
+            data[key] = sanitize_value(value)
+    
+    for index, sheet in enumerate(sheets):
+        name = sheet.get('name') if isinstance(sheet, dict) else None
+        stored_sheet = stored.get(name) if isinstance(name, str) else None
+        if stored_sheet is None:
+            sheets[index] = sanitize_value(sheet)
+            continue
+        for key, value in sheet.items():
+            stored_entries = stored_sheet.get(key)
+            if key in ('cells', 'formulas') and isinstance(value, dict) and isinstance(stored_entries, dict):
+                for ref, entry in value.items():
+                    if stored_entries.get(ref) != entry:
+                        value[ref] = sanitize_value(entry)
+            else:
+                sheet[key] = sanitize_value(value)
+    
+    return data
 
 def calculate_data_complexity(data: Dict[str, Any]) -> float:
     """
@@ -302,12 +362,16 @@ def calculate_checksum(data: Dict[str, Any]) -> str:
     if not data:
         return ""
     try:
-        return hashlib.md5(
-            json.dumps(data, sort_keys=True).encode('utf-8')
-        ).hexdigest()
+        return checksum_encoded_data(json.dumps(data, sort_keys=True))
     except (TypeError, ValueError):
         return ""
 
+def checksum_encoded_data(encoded: str) -> str:
+    """calculate_checksum for data already encoded with sort_keys (SpreadsheetDocument.set_editor_data)"""
+    if not encoded:
+        return ""
+    return hashlib.md5(encoded.encode('utf-8')).hexdigest()
+
 def extract_spreadsheet_stats(data: Dict[str, Any]) -> Dict[str, Any]:
     """Extract statistics from spreadsheet data"""
     if not data:
@@ -403,6 +467,11 @@ def validate_sheet_names(names: List[str]) -> bool:
     
     return True
 
+MALICIOUS_CONTENT_RE = re.compile(
+    r'<script.*?>.*?</script>|javascript:|vbscript:|on\w+\s*=|expression\s*\(|url\s*\(',
+    re.IGNORECASE,
+)
+
 def prevent_malicious_content(text: str) -> bool:
     """
     Check for potentially malicious content in text.
@@ -411,25 +480,11 @@ def prevent_malicious_content(text: str) -> bool:
     if not text:
         return False
     
-    malicious_patterns = [
-        r'<script.*?>.*?</script>',
-        r'javascript:',
-        r'vbscript:',
-        r'on\w+\s*=',
-        r'expression\s*\(',
-        r'url\s*\(',
-    ]
-    
-    text_lower = text.lower()
-    for pattern in malicious_patterns:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            return True
-    
     # Check for excessive length (potential DoS)
     if len(text) > 100000:  # 100KB limit for a single field
         return True
     
-    return False
+    return MALICIOUS_CONTENT_RE.search(text) is not None
 
 def export_to_excel(data: Dict[str, Any], title: str) -> str:
     """
@@ -485,73 +540,12 @@ def backup_document_data(data: Dict[str, Any], document_id: int) -> bool:
 def compare_spreadsheet_versions(old_data: Dict[str, Any], new_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Compare two versions of spreadsheet data and return differences.
+    See editor.diff for the delta between them.
     """
-    differences = {
-        'sheets_added': [],
-        'sheets_removed': [],
-        'sheets_modified': [],
-        'cells_changed': 0,
-        'formulas_changed': 0,
-    }
-    
-    try:
-        old_sheets = {sheet.get('name'): sheet for sheet in old_data.get('sheets', [])}
-        new_sheets = {sheet.get('name'): sheet for sheet in new_data.get('sheets', [])}
-        
-        # Find added and removed sheets
-        old_sheet_names = set(old_sheets.keys())
-        new_sheet_names = set(new_sheets.keys())
-        
-        differences['sheets_added'] = list(new_sheet_names - old_sheet_names)
-        differences['sheets_removed'] = list(old_sheet_names - new_sheet_names)
-        
-        # Find modified sheets
-        common_sheets = old_sheet_names.intersection(new_sheet_names)
-        for sheet_name in common_sheets:
-            old_sheet = old_sheets[sheet_name]
-            new_sheet = new_sheets[sheet_name]
-            
-            if _sheets_different(old_sheet, new_sheet):
-                differences['sheets_modified'].append(sheet_name)
-                differences['cells_changed'] += _count_cell_changes(old_sheet, new_sheet)
-                differences['formulas_changed'] += _count_formula_changes(old_sheet, new_sheet)
-        
-    except Exception as e:
-        logger.error(f"Error comparing spreadsheet versions: {e}")
+    from .diff import change_summary, diff_spreadsheets
     
-    return differences
-
-def _sheets_different(sheet1: Dict[str, Any], sheet2: Dict[str, Any]) -> bool:
-    """Check if two sheets are different"""
-    return (sheet1.get('cells') != sheet2.get('cells') or
-            sheet1.get('formulas') != sheet2.get('formulas') or
-            sheet1.get('styles') != sheet2.get('styles'))
-
-def _count_cell_changes(sheet1: Dict[str, Any], sheet2: Dict[str, Any]) -> int:
-    """Count number of changed cells between two sheets"""
-    changes = 0
-    cells1 = sheet1.get('cells', {})
-    cells2 = sheet2.get('cells', {})
-    
-    all_cells = set(cells1.keys()) | set(cells2.keys())
-    for cell_ref in all_cells:
-        if cells1.get(cell_ref) != cells2.get(cell_ref):
-            changes += 1
-    
-    return changes
+    return change_summary(diff_spreadsheets(old_data, new_data))
 
-def _count_formula_changes(sheet1: Dict[str, Any], sheet2: Dict[str, Any]) -> int:
-    """Count number of changed formulas between two sheets"""
-    changes = 0
-    formulas1 = sheet1.get('formulas', {})
-    formulas2 = sheet2.get('formulas', {})
-    
-    all_formulas = set(formulas1.keys()) | set(formulas2.keys())
-    for cell_ref in all_formulas:
-        if formulas1.get(cell_ref) != formulas2.get(cell_ref):
-            changes += 1
-    
-    return changes
 # Add this function to your editor/utils.py file
 
 def validate_spreadsheet_data(data: Dict[str, Any]) -> List[str]:
@@ -610,9 +604,10 @@ def validate_spreadsheet_data(data: Dict[str, Any]) -> List[str]:
     return errors
 # Add this function to your editor/utils.py file
 
-def calculate_spreadsheet_stats(data: Dict[str, Any]) -> Dict[str, Any]:
+def calculate_spreadsheet_stats(data: Dict[str, Any], data_size: Optional[int] = None) -> Dict[str, Any]:
     """
-    Calculate statistics for spreadsheet data.
+    Calculate statistics for spreadsheet data. Pass `data_size` when the
+    encoded size is already known to avoid encoding the data again.
     """
     if not data:
         return {}
@@ -628,7 +623,7 @@ def calculate_spreadsheet_stats(data: Dict[str, Any]) -> Dict[str, Any]:
     try:
         sheets = data.get('sheets', [])
         stats['sheet_count'] = len(sheets)
-        stats['data_size'] = len(json.dumps(data))
+        stats['data_size'] = data_size if data_size is not None else len(json.dumps(data))
         
         for sheet in sheets:
             # Count cells
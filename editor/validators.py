@@ -76,6 +76,12 @@ def validate_sheet_names(names: List[str]) -> None:
         if re.search(r'[\\/*?\[\]]', name):
             raise ValidationError(_('Sheet name contains invalid characters'))
 
+MALICIOUS_CONTENT_RE = re.compile(
+    r'<script.*?>.*?</script>|javascript:|vbscript:|on\w+\s*=|expression\s*\(|url\s*\('
+    r'|mocha:|livescript:',
+    re.IGNORECASE,
+)
+
 def prevent_malicious_content(text: str) -> None:
     """
     Check for potentially malicious content in text and raise ValidationError if found
@@ -83,20 +89,8 @@ def prevent_malicious_content(text: str) -> None:
     if not text:
         return
     
-    malicious_patterns = [
-        r'<script.*?>.*?</script>',
-        r'javascript:',
-        r'vbscript:',
-        r'on\w+\s*=',
-        r'expression\s*\(',
-        r'url\s*\(',
-        r'mocha:',
-        r'livescript:',
-    ]
-    
-    for pattern in malicious_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            raise ValidationError(_('Content contains potentially malicious code'))
+    if MALICIOUS_CONTENT_RE.search(text):
+        raise ValidationError(_('Content contains potentially malicious code'))
     
     # Check for excessive length (potential DoS)
     if len(text) > 100000:  # 100KB limit for a single field
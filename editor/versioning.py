@@ -0,0 +1,218 @@
+# editor/versioning.py
+import copy
+import json
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .diff import apply_delta, diff_spreadsheets
+
+# Storage for DocumentVersion data. Instead of a full copy of editor_data
+# per version, a document's history is a run of keyframes, each followed by
+# deltas: the diff_spreadsheets operations from the previous version. Both
+# are zlib-compressed JSON in DocumentVersion.payload. Reading a version
+# replays its deltas onto the nearest keyframe before it, so a keyframe is
+# written every SPREADSHEET_VERSION_KEYFRAME_INTERVAL versions, and whenever
+# the delta would not be much smaller than the data itself.
+#
+# Versions written before this have storage 'full' (data in version_data)
+# and count as keyframes. `manage.py compact_document_versions` rewrites
+# them as keyframes and deltas.
+#
+# A version that deltas are based on can still be deleted on its own:
+# rebase_dependents turns those deltas into keyframes first.
+
+# A delta is stored only if its encoding is under this fraction of the data's
+DELTA_MAX_RATIO = 0.5
+
+
+def keyframe_interval():
+    return getattr(settings, 'SPREADSHEET_VERSION_KEYFRAME_INTERVAL', 20)
+
+
+def compress(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def decompress(payload) -> Any:
+    return json.loads(zlib.decompress(bytes(payload)).decode('utf-8'))
+
+
+def encode_version(data, base, base_data, data_size) -> Tuple[str, bytes, int]:
+    """
+    (storage, payload, depth) for a version with `data` following version
+    `base` (None for the first), whose data is `base_data`. `data_size` is
+    the length of the data's JSON encoding.
+    """
+    from .models import VersionStorage
+
+    if base is not None and base.depth + 1 < keyframe_interval():
+        operations = diff_spreadsheets(base_data, data)['operations']
+        encoded = json.dumps(operations, separators=(',', ':'))
+        if len(encoded) < data_size * DELTA_MAX_RATIO:
+            return VersionStorage.DELTA, zlib.compress(encoded.encode('utf-8')), base.depth + 1
+    return VersionStorage.KEYFRAME, compress(data), 0
+
+
+def create_version(document, user, description: Optional[str] = None, encoded: Optional[str] = None):
+    """
+    Record document.editor_data as the document's next version. Pass
+    `encoded` from set_editor_data to reuse it for the checksum and size.
+    """
+    from .models import DocumentVersion, VersionStorage
+    from .utils import checksum_encoded_data
+
+    data = document.editor_data or {}
+    if encoded is None:
+        encoded = json.dumps(data, sort_keys=True) if data else ''
+
+    base = document.versions.order_by('-version_number').first()
+    needs_base = base is not None and base.depth + 1 < keyframe_interval()
+    storage, payload, depth = encode_version(
+        data, base, load_version_data(base) if needs_base else None, len(encoded)
+    )
+    return DocumentVersion.objects.create(
+        document=document,
+        version_data=None,
+        storage=storage,
+        payload=payload,
+        base=base if storage == VersionStorage.DELTA else None,
+        depth=depth,
+        created_by=user,
+        # Not count() + 1: deleted versions leave gaps in the numbering
+        version_number=base.version_number + 1 if base else 1,
+        change_description=description,
+        checksum=checksum_encoded_data(encoded),
+        data_size=len(encoded),
+    )
+
+
+def load_version_data(version, cache: Optional[Dict[int, Any]] = None) -> Dict[str, Any]:
+    """
+    The editor_data recorded by `version`. `cache` maps version ids to data
+    already loaded; replaying stops at a cached version and the result is
+    added to it. Cached data must not be mutated.
+    """
+    from .models import DocumentVersion, VersionStorage
+
+    if cache is not None and version.pk in cache:
+        return cache[version.pk]
+
+    chain, node, run = [], version, None
+    while node.storage == VersionStorage.DELTA and not (cache and node.pk in cache):
+        chain.append(node)
+        if run is None:
+            # The versions back to the keyframe, in one query. A chain is
+            # always the versions right before this one, though their
+            # numbers may have gaps where versions were deleted.
+            run = {
+                v.pk: v for v in DocumentVersion.objects.filter(
+                    document_id=version.document_id,
+                    version_number__lt=version.version_number,
+                ).order_by('-version_number')[:version.depth]
+            }
+        node = run.get(node.base_id) or DocumentVersion.objects.get(pk=node.base_id)
+
+    if cache and node.pk in cache:
+        data = copy.deepcopy(cache[node.pk]) if chain else cache[node.pk]
+    elif node.storage == VersionStorage.KEYFRAME:
+        data = decompress(node.payload)
+    else:
+        data = node.version_data or {}
+        if chain:
+            data = copy.deepcopy(data)
+
+    for delta in reversed(chain):
+        apply_delta(data, decompress(delta.payload))
+
+    if cache is not None:
+        cache[version.pk] = data
+    return data
+
+
+@transaction.atomic
+def rebase_dependents(versions) -> int:
+    """
+    Rewrite the deltas based on `versions`, which are about to be deleted,
+    as keyframes. Deltas among `versions` themselves are left alone. The
+    depths of later deltas in the same chains are updated to match.
+    Returns the number of versions rewritten.
+    """
+    from .models import DocumentVersion, VersionStorage
+
+    doomed = [version.pk for version in versions]
+    dependents = list(
+        DocumentVersion.objects.select_for_update().filter(base_id__in=doomed)
+        .exclude(pk__in=doomed).order_by('document_id', 'version_number')
+    )
+    cache = {}
+    for dependent in dependents:
+        data = load_version_data(dependent, cache)
+        dependent.storage, dependent.payload = VersionStorage.KEYFRAME, compress(data)
+        dependent.base, dependent.depth = None, 0
+        dependent.save(update_fields=['storage', 'payload', 'base', 'depth'])
+
+    for dependent in dependents:
+        depths = {dependent.pk: 0}
+        later = DocumentVersion.objects.filter(
+            document_id=dependent.document_id,
+            version_number__gt=dependent.version_number,
+            storage=VersionStorage.DELTA,
+        ).order_by('version_number').only('pk', 'base_id', 'depth')
+        for version in later:
+            if version.base_id in depths:
+                depths[version.pk] = depths[version.base_id] + 1
+                if version.depth != depths[version.pk]:
+                    DocumentVersion.objects.filter(pk=version.pk).update(depth=depths[version.pk])
+
+    return len(dependents)
+
+
+@transaction.atomic
+def compact_history(document_id) -> Tuple[int, int, int]:
+    """
+    Rewrite a document's full-copy versions as keyframes and deltas.
+    Returns (versions rewritten, bytes before, bytes after). Each delta is
+    replayed and checked against the full copy before the row is rewritten.
+    """
+    from .models import DocumentVersion, VersionStorage
+
+    versions = list(
+        DocumentVersion.objects.select_for_update().filter(document_id=document_id).order_by('version_number')
+    )
+    rewritten = before = after = 0
+    base = base_data = None
+    for version in versions:
+        if version.storage == VersionStorage.FULL:
+            data = version.version_data or {}
+            size = version.data_size or (len(json.dumps(data)) if data else 0)
+            stored_size = size
+        else:
+            data = load_version_data(version, {base.pk: base_data} if base is not None else None)
+            if version.storage == VersionStorage.KEYFRAME or (base is not None and version.depth == base.depth + 1):
+                base, base_data = version, data
+                continue
+            # Its base was a full copy that is now a delta itself, so the
+            # chain back to a keyframe got longer
+            size = version.data_size or len(json.dumps(data))
+            stored_size = len(version.payload)
+
+        storage, payload, depth = encode_version(data, base, base_data, size)
+        if storage == VersionStorage.DELTA:
+            replayed = apply_delta(copy.deepcopy(base_data), decompress(payload))
+            if replayed != data:
+                raise ValueError(f"Delta for version {version.pk} does not reproduce its data")
+
+        version.storage, version.payload, version.depth = storage, payload, depth
+        version.base = base if storage == VersionStorage.DELTA else None
+        version.version_data = None
+        version.save(update_fields=['storage', 'payload', 'depth', 'base', 'version_data'])
+
+        rewritten += 1
+        before += stored_size
+        after += len(payload)
+        base, base_data = version, data
+
+    return rewritten, before, after
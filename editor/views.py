@@ -19,7 +19,6 @@ from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404
 
 import logging
-import hashlib
 import json
 import csv
 from datetime import timedelta
@@ -35,6 +34,7 @@ from .models import (
 from .serializers import (
     SpreadsheetDocumentSerializer, 
     SpreadsheetDataSerializer,
+    SpreadsheetPatchSerializer,
     DocumentVersionSerializer,
     DocumentCollaboratorSerializer,
     DocumentCommentSerializer,
@@ -43,6 +43,7 @@ from .serializers import (
     TagSerializer,
     OrganizationDetailSerializer,
     OrganizationBasicSerializer,
+    MAX_SPREADSHEET_DATA_SIZE,
 )
 
 # Import permissions
@@ -61,8 +62,11 @@ from .utils import (
     backup_document_data,
     validate_spreadsheet_structure,
     sanitize_sheet_data,
-    calculate_data_complexity
+    calculate_data_complexity,
+    checksum_encoded_data
 )
+from .diff import change_summary, diff_spreadsheets, is_significant_change
+from .patches import PatchError, STRUCTURAL_OPERATIONS, apply_operations
 
 logger = logging.getLogger(__name__)
 
@@ -192,7 +196,15 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
         old_instance = self.get_object()
         
         with transaction.atomic():
-            instance = serializer.save()
+            if 'editor_data' in serializer.validated_data:
+                # A data save moves the revision on like the data endpoint
+                # does, so a PATCH made against the old one gets a 409
+                revision = SpreadsheetDocument.objects.select_for_update().values_list(
+                    'revision', flat=True
+                ).get(pk=old_instance.pk)
+                instance = serializer.save(revision=revision + 1)
+            else:
+                instance = serializer.save()
             
             # Create version snapshot if data changed significantly
             if 'editor_data' in serializer.validated_data:
@@ -208,15 +220,12 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
                     details={'changes': changes}
                 )
 
-    def _create_version_snapshot(self, document, user):
-        """Create a version snapshot of the document"""
-        DocumentVersion.objects.create(
-            document=document,
-            version_data=document.editor_data.copy() if document.editor_data else {},
-            created_by=user,
-            version_number=document.versions.count() + 1,
-            checksum=self._calculate_checksum(document.editor_data)
-        )
+    def _create_version_snapshot(self, document, user, encoded=None):
+        """
+        Create a version snapshot of the document. Pass `encoded` from
+        set_editor_data to reuse it for the checksum and size.
+        """
+        document.create_version(user, encoded=encoded)
 
     def _get_changes(self, old_instance, new_instance):
         """Detect and return changes between instances"""
@@ -228,14 +237,6 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
                 changes[field] = {'from': old_val, 'to': new_val}
         return changes
 
-    def _calculate_checksum(self, data):
-        """Calculate checksum for data integrity"""
-        if not data:
-            return ""
-        return hashlib.md5(
-            json.dumps(data, sort_keys=True).encode('utf-8')
-        ).hexdigest()
-
     @action(detail=True, methods=['get', 'put', 'patch'], 
             permission_classes=[IsAuthenticated, CanEditSpreadsheet],
             throttle_classes=[UserRateThrottle])
@@ -253,13 +254,17 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
             cache_key = f"spreadsheet_data_{document.id}_{document.updated_at.timestamp()}"
             cached_data = cache.get(cache_key)
             
-            if cached_data:
-                return Response(cached_data)
+            if not cached_data:
+                cached_data = document.editor_data or {}
+                cache.set(cache_key, cached_data, timeout=300)  # 5 minutes
             
-            response_data = document.editor_data or {}
-            cache.set(cache_key, response_data, timeout=300)  # 5 minutes
+            # Patch clients send this back as base_revision
+            response = Response(cached_data)
+            response['ETag'] = f'"{document.revision}"'
+            return response
             
-            return Response(response_data)
+        elif request.method == 'PATCH' and 'operations' in request.data:
+            return self._handle_data_patch(request, document)
             
         elif request.method in ['PUT', 'PATCH']:
             return self._handle_data_save(request, document)
@@ -267,7 +272,10 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
     def _handle_data_save(self, request, document):
         """Handle data saving with advanced validation and processing"""
         # Validate data structure
-        data_serializer = SpreadsheetDataSerializer(data=request.data)
+        data_serializer = SpreadsheetDataSerializer(
+            data=request.data,
+            context={'content_length': int(request.META.get('CONTENT_LENGTH') or 0)}
+        )
         data_serializer.is_valid(raise_exception=True)
         
         # Advanced validation
@@ -281,20 +289,24 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
         with transaction.atomic():
             # Store old data for comparison
             old_data = document.editor_data
+            old_size = document.size if old_data else 0
             
-            # Sanitize and update document data
-            sanitized_data = sanitize_sheet_data(request.data)
-            document.editor_data = sanitized_data
-            document.size = len(json.dumps(sanitized_data))
+            # Sanitize and update document data; cells unchanged since the
+            # last save are not rescanned. The data is encoded once here;
+            # size, checksum, stats and the version reuse the encoding.
+            sanitized_data = sanitize_sheet_data(request.data, previous=old_data)
+            diff = diff_spreadsheets(old_data, sanitized_data)
+            encoded = document.set_editor_data(sanitized_data)
+            document.revision += 1
             document.last_modified_by = request.user
             document.save()
             
             # Create version if significant changes
-            if self._is_significant_change(old_data, sanitized_data):
-                self._create_version_snapshot(document, request.user)
+            if not old_data or is_significant_change(diff):
+                self._create_version_snapshot(document, request.user, encoded=encoded)
             
             # Calculate statistics
-            stats = calculate_spreadsheet_stats(sanitized_data)
+            stats = calculate_spreadsheet_stats(sanitized_data, data_size=document.size)
             
             # Create audit log
             AuditLog.objects.create(
@@ -302,20 +314,13 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
                 user=request.user,
                 action='DATA_UPDATED',
                 details={
-                    'size_change': len(json.dumps(sanitized_data)) - len(json.dumps(old_data or {})),
+                    'size_change': document.size - old_size,
+                    'changes': change_summary(diff),
                     'stats': stats
                 }
             )
             
-            # Trigger async processing (if available)
-            try:
-                from .tasks import process_spreadsheet_webhook
-                process_spreadsheet_webhook.delay(document.id, 'data_updated')
-            except ImportError:
-                logger.debug("Celery tasks not available, skipping webhook processing")
-            
-            # Clear cache
-            cache.delete_pattern(f"spreadsheet_data_{document.id}_*")
+            self._data_updated(document)
             
             logger.info(f"Spreadsheet data updated: {document.id} by {request.user}")
             
@@ -323,25 +328,92 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
                 "id": document.pk,
                 "status": "Spreadsheet content updated successfully",
                 "last_updated": document.updated_at,
-                "checksum": self._calculate_checksum(document.editor_data),
+                "revision": document.revision,
+                "checksum": checksum_encoded_data(encoded),
                 "statistics": stats,
                 "version_count": document.versions.count()
             })
 
-    def _is_significant_change(self, old_data, new_data):
-        """Determine if changes are significant enough for versioning"""
-        if not old_data:
-            return True
+    def _handle_data_patch(self, request, document):
+        """
+        Apply cell-level operations (see editor.patches) to the stored
+        document. `base_revision` must match the current revision, otherwise
+        the client gets 409 and should reload or rebase its edits.
+        """
+        patch_serializer = SpreadsheetPatchSerializer(data=request.data)
+        patch_serializer.is_valid(raise_exception=True)
+        base_revision = patch_serializer.validated_data['base_revision']
+        operations = patch_serializer.validated_data['operations']
         
-        try:
-            old_str = json.dumps(old_data, sort_keys=True)
-            new_str = json.dumps(new_data, sort_keys=True)
+        with transaction.atomic():
+            document = SpreadsheetDocument.objects.select_for_update().get(pk=document.pk)
+            if document.revision != base_revision:
+                return Response(
+                    {"error": "Document has changed since base_revision", "revision": document.revision},
+                    status=status.HTTP_409_CONFLICT
+                )
             
-            # Consider it significant if more than 10% changed
-            size_change = abs(len(new_str) - len(old_str)) / max(len(old_str), 1)
-            return size_change > 0.1
-        except (TypeError, ValueError):
-            return True
+            data = document.editor_data or {}
+            try:
+                apply_operations(data, operations)
+            except PatchError as e:
+                return Response(
+                    {"errors": [str(e)], "operation": e.index},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            encoded = document.set_editor_data(data)
+            
+            # The result has to pass what a full save would have to pass
+            if document.size > MAX_SPREADSHEET_DATA_SIZE:
+                return Response(
+                    {"errors": [
+                        f"Total document size ({document.size} bytes) exceeds maximum "
+                        f"allowed ({MAX_SPREADSHEET_DATA_SIZE} bytes)"
+                    ]},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            validation_errors = validate_spreadsheet_data(data) or validate_spreadsheet_structure(data)
+            if validation_errors:
+                return Response({"errors": validation_errors}, status=status.HTTP_400_BAD_REQUEST)
+            
+            document.revision += 1
+            document.last_modified_by = request.user
+            document.save()
+            
+            if any(operation['op'] in STRUCTURAL_OPERATIONS for operation in operations):
+                self._create_version_snapshot(document, request.user, encoded=encoded)
+            
+            AuditLog.objects.create(
+                document=document,
+                user=request.user,
+                action='DATA_UPDATED',
+                details={'operations': len(operations), 'revision': document.revision}
+            )
+            
+            self._data_updated(document)
+        
+        logger.info(f"Spreadsheet data patched: {document.id} by {request.user} ({len(operations)} operations)")
+        
+        return Response({
+            "id": document.pk,
+            "status": "Spreadsheet content updated successfully",
+            "last_updated": document.updated_at,
+            "revision": document.revision,
+            "operations_applied": len(operations)
+        })
+
+    def _data_updated(self, document):
+        """Follow-up work after any change to a document's data"""
+        # Trigger async processing (if available)
+        try:
+            from .tasks import process_spreadsheet_webhook
+            process_spreadsheet_webhook.delay(document.id, 'data_updated')
+        except ImportError:
+            logger.debug("Celery tasks not available, skipping webhook processing")
+        
+        # Clear cache
+        cache.delete_pattern(f"spreadsheet_data_{document.id}_*")
 
     @action(detail=True, methods=['post'])
     def duplicate(self, request, pk=None):
@@ -428,8 +500,8 @@ class SpreadsheetDocumentViewSet(viewsets.ModelViewSet):
                 self._create_version_snapshot(document, request.user)
                 
                 # Restore old version
-                document.editor_data = version.version_data
-                document.size = len(json.dumps(version.version_data)) if version.version_data else 0
+                document.set_editor_data(version.get_data())
+                document.revision += 1
                 document.last_modified_by = request.user
                 document.save()
                 
@@ -621,19 +693,11 @@ class DocumentVersionViewSet(viewsets.ReadOnlyModelViewSet):
         
         with transaction.atomic():
             # Create backup of current version
-            DocumentVersion.objects.create(
-                document=document,
-                version_data=document.editor_data.copy() if document.editor_data else {},
-                created_by=request.user,
-                version_number=document.versions.count() + 1,
-                checksum=hashlib.md5(
-                    json.dumps(document.editor_data, sort_keys=True).encode('utf-8')
-                ).hexdigest() if document.editor_data else ""
-            )
+            document.create_version(request.user)
             
             # Restore the selected version
-            document.editor_data = version.version_data
-            document.size = len(json.dumps(version.version_data)) if version.version_data else 0
+            document.set_editor_data(version.get_data())
+            document.revision += 1
             document.last_modified_by = request.user
             document.save()
             
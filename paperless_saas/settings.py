@@ -282,21 +282,34 @@ CORS_ALLOW_METHODS = [
 ASGI_APPLICATION = 'paperless_saas.asgi.application' 
 
 # Channel layers configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
-    }
-}
+# 'memory' only reaches sockets inside one process, so any deployment running
+# more than one Daphne/Uvicorn worker must use 'redis'. The Redis layer uses
+# pub/sub: a group_send is a single PUBLISH per group and every worker that
+# holds members of the group receives it, regardless of room size.
+CHANNEL_LAYER_BACKEND = config('CHANNEL_LAYER_BACKEND', default='memory' if DEBUG else 'redis')
+CHANNEL_REDIS_HOSTS = [
+    host.strip() for host in
+    config('CHANNEL_REDIS_HOSTS', default='redis://127.0.0.1:6379/2').split(',')
+    if host.strip()
+]
 
-# For production with Redis (uncomment when ready):
-# CHANNEL_LAYERS = {
-#     'default': {
-#         'BACKEND': 'channels_redis.core.RedisChannelLayer',
-#         'CONFIG': {
-#             "hosts": [('127.0.0.1', 6379)],
-#         },
-#     },
-# }
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                # Several hosts are sharded by channel/group name
+                'hosts': CHANNEL_REDIS_HOSTS,
+                'prefix': 'paperless:chat',
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        }
+    }
 
 # ==============================================================================
 # CHAT SPECIFIC SETTINGS
@@ -304,14 +317,68 @@ CHANNEL_LAYERS = {
 # Maximum message length
 CHAT_MESSAGE_MAX_LENGTH = 5000
 
-# Rate limiting for chat messages (messages per minute)
+# Rate limiting for chat messages (messages per minute). These are token
+# buckets shared by the WebSocket and REST send paths: the *_BURST values are
+# how many can be sent back to back before the per-minute rate applies.
+# Rooms with slow_mode also allow one message per slow_mode seconds per user.
 CHAT_RATE_LIMIT = 30
+CHAT_RATE_LIMIT_BURST = 10
+CHAT_ROOM_RATE_LIMIT = 300  # all senders in one room
+CHAT_ROOM_RATE_LIMIT_BURST = 50
+CHAT_SOCKET_EVENT_RATE_LIMIT = 120  # WebSocket frames of any type per user
+CHAT_SOCKET_EVENT_BURST = 30
+CHAT_CONNECTION_RATE_LIMIT = 10  # WebSocket connects per user
 
 # Online status timeout (seconds)
 CHAT_ONLINE_TIMEOUT = 300
 
+# Room presence: sockets refresh every HEARTBEAT_INTERVAL seconds and count
+# as gone after TTL without a refresh (e.g. a crashed worker)
+CHAT_PRESENCE_TTL = 60
+CHAT_PRESENCE_HEARTBEAT_INTERVAL = 20
+
+# Typing indicators: at most one snapshot per room per INTERVAL seconds; a
+# typist without a fresh typing_start drops out after TTL seconds
+CHAT_TYPING_INTERVAL = 1.0
+CHAT_TYPING_TTL = 3
+
+# WebSocket connect snapshot: messages included, and how long the shared
+# per-room snapshot may be cached (seconds)
+CHAT_INITIAL_MESSAGES = 50
+CHAT_SNAPSHOT_TTL = 60
+
+# Shared async Redis pool for chat rate limiting and presence.
+# Use 'memory://' (or leave empty) for the in-process fallback in tests/dev.
+CHAT_REDIS_URL = config('CHAT_REDIS_URL', default='redis://localhost:6379/0')
+CHAT_REDIS_MAX_CONNECTIONS = config('CHAT_REDIS_MAX_CONNECTIONS', default=50, cast=int)
+# Seconds to wait for a free pooled connection before giving up
+CHAT_REDIS_POOL_TIMEOUT = config('CHAT_REDIS_POOL_TIMEOUT', default=5, cast=int)
+
+# Write-behind buffering of read receipts/reactions (seconds, pending items)
+CHAT_WRITE_BUFFER_INTERVAL = 2.0
+CHAT_WRITE_BUFFER_MAX_PENDING = 5000
+
+# Messages older than this many days are moved to the archive tables by
+# `manage.py chat_archive_messages`, in batches of CHAT_ARCHIVE_BATCH_SIZE;
+# room history reads through to them past this window
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_BATCH_SIZE = 1000
+
 # File upload limits for chat
 CHAT_MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
+# Resumable uploads: suggested chunk size, where partial files are staged
+# (must be shared by all web workers), and when abandoned ones are removed
+# by `manage.py chat_cleanup_uploads`
+CHAT_UPLOAD_CHUNK_SIZE = 1024 * 1024
+CHAT_UPLOAD_STAGING_DIR = config('CHAT_UPLOAD_STAGING_DIR', default=str(MEDIA_ROOT / 'chat_uploads'))
+CHAT_UPLOAD_EXPIRY_HOURS = 24
+
+# Image attachment previews: WebP size buckets (longest edge, px), encoder
+# quality, and background threads per web process (0 = generate inline)
+CHAT_THUMBNAIL_SIZES = [160, 480, 1080]
+CHAT_THUMBNAIL_QUALITY = 80
+CHAT_THUMBNAIL_WORKERS = config('CHAT_THUMBNAIL_WORKERS', default=2, cast=int)
 CHAT_ALLOWED_FILE_TYPES = [
     'image/jpeg', 'image/png', 'image/gif', 
     'application/pdf', 'text/plain',
@@ -319,6 +386,14 @@ CHAT_ALLOWED_FILE_TYPES = [
     'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
 ]
 
+# ==============================================================================
+# SPREADSHEET EDITOR
+# ==============================================================================
+
+# Spreadsheet versions are stored as deltas from the previous version, with
+# a full (compressed) keyframe at least every this many versions
+SPREADSHEET_VERSION_KEYFRAME_INTERVAL = 20
+
 # ==============================================================================
 # SECURITY SETTINGS (For Production)
 # ==============================================================================
@@ -17,6 +17,7 @@ def send_approval_notification(document_id):
     """Send notification when a document is fully approved"""
     try:
         # Import inside the function to avoid circular imports
+        from chat.events import send_user_notification
         from documents.models import Document
         
         document = Document.objects.select_related(
@@ -32,6 +33,12 @@ def send_approval_notification(document_id):
             'action': 'approved'
         }
         
+        # Push to the submitter's open notification sockets before emailing
+        send_user_notification(document.created_by_id, 'document_approved', {
+            'document_id': document.id,
+            'title': document.title,
+        })
+        
         html_message = render_to_string('workflow/email/approval_notification.html', context)
         plain_message = strip_tags(html_message)
         
@@ -53,6 +60,7 @@ def send_rejection_notification(document_id, rejection_reason="", rejected_by=No
     """Send notification when a document is rejected"""
     try:
         # Import inside the function to avoid circular imports
+        from chat.events import send_user_notification
         from documents.models import Document
         
         document = Document.objects.select_related(
@@ -74,6 +82,13 @@ def send_rejection_notification(document_id, rejection_reason="", rejected_by=No
             'resubmission_url': resubmission_url,
         }
         
+        send_user_notification(document.created_by_id, 'document_rejected', {
+            'document_id': document.id,
+            'title': document.title,
+            'reason': rejection_reason,
+            'rejected_by': rejected_by.get_full_name() if rejected_by else None,
+        })
+        
         html_message = render_to_string('workflow/email/rejection_notification.html', context)
         plain_message = strip_tags(html_message)
         
@@ -95,6 +110,7 @@ def send_pending_approval_notification(flow_id):
     """Send notification to the next approver"""
     try:
         # Import inside the function
+        from chat.events import send_user_notification
         from .models import DocumentApprovalFlow
         
         flow = DocumentApprovalFlow.objects.select_related(
@@ -119,6 +135,12 @@ def send_pending_approval_notification(flow_id):
             'assigned_date': timezone.now(),
         }
         
+        send_user_notification(flow.current_approver_id, 'approval_pending', {
+            'flow_id': flow.id,
+            'document_id': flow.document.id,
+            'title': flow.document.title,
+        })
+        
         html_message = render_to_string('workflow/email/pending_approval.html', context)
         plain_message = strip_tags(html_message)
         